@@ -0,0 +1,151 @@
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from io import BytesIO
+
+######################################
+## 画像ファンアウトの起動時間・メモリ使用量の比較
+######################################
+# 実行方式ごとに別プロセスを起動し、以下を計測する（Imagen APIは固定の遅延を返す偽物に置き換える）
+#   - lp_generator の読み込み時間
+#   - 最初のファンアウト（コールドスタート）と2回目のファンアウトの所要時間
+#   - プロセス（と子プロセス）の合計RSS
+# 使い方（backend ディレクトリで実行）:
+#   python bench/image_fanout_startup.py --images 4 --latency 0.5
+# ray は以前の動作（Webサーバー内でローカルのRayランタイムを起動する）を再現するため address=local で計測する
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+FAKE_LATENCY = float(os.environ.get("BENCH_FAKE_LATENCY", "0.5"))
+
+
+def fake_png() -> bytes:
+    from PIL import Image
+    buffer = BytesIO()
+    Image.new("RGB", (64, 64), (200, 200, 200)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+async def fake_imagen_generate(prompt, aspect_ratio, model=None) -> bytes:
+    await asyncio.sleep(FAKE_LATENCY)
+    return fake_png()
+
+
+def fake_generate_image_sync(prompt, aspect_ratio):
+    time.sleep(FAKE_LATENCY)
+    return fake_png()
+
+
+# 自プロセスと子孫プロセスのRSSの合計（MB、Linuxの /proc から取得）
+def process_tree_rss_mb() -> float:
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+
+    total_kb = 0
+    stack = [os.getpid()]
+    while stack:
+        pid = stack.pop()
+        stack.extend(children.get(pid, []))
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total_kb += int(line.split()[1])
+        except OSError:
+            continue
+    return total_kb / 1024
+
+
+async def fan_out(fanout, directory: str, images: int, round_id: int) -> float:
+    started = time.monotonic()
+    await asyncio.gather(*(
+        fanout.generate(f"prompt {i}", os.path.join(directory, f"bench_{round_id}_{i}.png"), "1:1")
+        for i in range(images)
+    ))
+    return time.monotonic() - started
+
+
+def run_child(backend: str, images: int):
+    os.environ["LP_IMAGE_FANOUT"] = "ray" if backend == "ray" else "async"
+    os.environ["LP_RAY_ADDRESS"] = "local"
+    os.environ.setdefault("LP_CACHE_DIR", tempfile.mkdtemp())
+    rss_before = process_tree_rss_mb()
+
+    started = time.monotonic()
+    import lp_generator
+    import image_fanout
+    import providers
+    import_seconds = time.monotonic() - started
+
+    providers.imagen_generate = fake_imagen_generate
+    image_fanout.generate_image_sync = fake_generate_image_sync
+
+    async def run():
+        with tempfile.TemporaryDirectory() as directory:
+            cold = await fan_out(lp_generator.image_fanout, directory, images, 0)
+            warm = await fan_out(lp_generator.image_fanout, directory, images, 1)
+            rss = process_tree_rss_mb()
+            await lp_generator.image_fanout.close()
+        return cold, warm, rss
+
+    cold, warm, rss = asyncio.run(run())
+    print(json.dumps({
+        "backend": backend,
+        "importSeconds": round(import_seconds, 3),
+        "coldFanoutSeconds": round(cold, 3),
+        "warmFanoutSeconds": round(warm, 3),
+        "rssBeforeMb": round(rss_before, 1),
+        "rssAfterMb": round(rss, 1),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Image fan-out startup time and memory by backend")
+    parser.add_argument("--backends", nargs="+", default=["async", "ray"])
+    parser.add_argument("--images", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.5, help="fake Imagen latency (seconds)")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.images)
+        return
+
+    results = []
+    for backend in args.backends:
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--child", backend, "--images", str(args.images)],
+            cwd=BACKEND_DIR,
+            env={**os.environ, "BENCH_FAKE_LATENCY": str(args.latency)},
+            capture_output=True,
+            text=True,
+        )
+        lines = [line for line in output.stdout.splitlines() if line.startswith("{")]
+        if output.returncode != 0 or not lines:
+            print(f"{backend}: failed\n{output.stderr[-2000:]}")
+            continue
+        results.append(json.loads(lines[-1]))
+
+    print(f"images={args.images}, fake latency={args.latency}s")
+    print("backend  import(s)  cold fan-out(s)  warm fan-out(s)  RSS(MB)")
+    for r in results:
+        print(f"{r['backend']:<7}  {r['importSeconds']:>9.2f}  {r['coldFanoutSeconds']:>15.2f}  "
+              f"{r['warmFanoutSeconds']:>15.2f}  {r['rssAfterMb']:>7.0f}")
+
+
+if __name__ == "__main__":
+    main()
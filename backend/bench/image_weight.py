@@ -0,0 +1,74 @@
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+######################################
+## 生成画像の最適化によるページの重さの比較
+######################################
+# 元画像（PNG）と、最適化した画像（WebP / AVIF・srcset 用の縮小版）のサイズと変換時間を比較する
+# 使い方（backend ディレクトリで実行）:
+#   python bench/image_weight.py jobs/<job_id>/placeholder_*.png
+#   python bench/image_weight.py --formats avif,webp   # 画像を指定しない場合は写真に近い合成画像を使う
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from image_optimizer import optimize_image_file, supported_formats  # noqa: E402
+
+
+# Imagen の出力と同じ 16:9（1408x768）の、ノイズとグラデーションを重ねた画像を作成する
+def create_sample_image(path: str, seed: int):
+    from PIL import Image, ImageFilter
+    noise = Image.effect_noise((1408, 768), 48 + seed).convert("RGB").filter(ImageFilter.GaussianBlur(2))
+    gradient = Image.linear_gradient("L").rotate(seed * 40).resize((1408, 768)).convert("RGB")
+    Image.blend(noise, gradient, 0.5).save(path, format="PNG")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Page weight of generated images before and after optimization")
+    parser.add_argument("images", nargs="*", help="PNG files (default: synthetic 1408x768 images)")
+    parser.add_argument("--samples", type=int, default=4)
+    parser.add_argument("--formats", default="webp")
+    parser.add_argument("--widths", default="640,1280,1920")
+    parser.add_argument("--quality", type=int, default=80)
+    args = parser.parse_args()
+    formats = supported_formats(args.formats.split(","))
+    widths = [int(value) for value in args.widths.split(",")]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        names = []
+        for i, path in enumerate(args.images):
+            names.append(f"image_{i + 1}.png")
+            shutil.copyfile(path, os.path.join(tmp, names[-1]))
+        if not names:
+            for i in range(args.samples):
+                names.append(f"sample_{i + 1}.png")
+                create_sample_image(os.path.join(tmp, names[-1]), i)
+
+        print(f"formats: {formats}, widths: {widths}, quality: {args.quality}")
+        print("image            original(KB)  " + "  ".join(f"{fmt}(KB)" for fmt in formats) + "  time(s)")
+        totals = {"original": 0, **{fmt: 0 for fmt in formats}, "all": 0}
+        for name in names:
+            started = time.perf_counter()
+            manifest = optimize_image_file(tmp, name, widths, formats, args.quality)
+            elapsed = time.perf_counter() - started
+            full_size = {v["format"]: v["bytes"] for v in manifest["variants"] if v["width"] == manifest["width"]}
+            totals["original"] += manifest["bytes"]
+            totals["all"] += sum(v["bytes"] for v in manifest["variants"])
+            for fmt in formats:
+                totals[fmt] += full_size[fmt]
+            print(f"{name:<15}  {manifest['bytes'] / 1e3:>12.1f}  "
+                  + "  ".join(f"{full_size[fmt] / 1e3:>{len(fmt) + 4}.1f}" for fmt in formats)
+                  + f"  {elapsed:>7.2f}")
+
+        # ブラウザが読み込むのは形式・幅ごとに1枚（元画像と同じ幅で比較する）
+        for fmt in formats:
+            print(f"{fmt}: {totals['original'] / max(1, totals[fmt]):.1f}x lighter than PNG")
+        print(f"all variants (ZIP contents): {totals['all'] / 1e3:.1f} KB vs PNG {totals['original'] / 1e3:.1f} KB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+import argparse
+import asyncio
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import httpx
+
+######################################
+## ジョブ状態の読み取りスループットの負荷試験
+######################################
+# ワーカープロセス数を変えてサーバーを起動し、GET /api/jobs/{job_id} のスループットを計測する
+# 使い方（backend ディレクトリで実行）:
+#   python bench/load_status_reads.py --workers 1 2 4 --duration 10
+# ジョブの状態は共有ストアにあるため、どのワーカーに振り分けられても応答できる
+# （同じマシンで計測するため、スループットはCPUコア数を超えては伸びない）
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from job_store import SQLiteJobStore  # noqa: E402
+
+
+# 完了済みのジョブを登録する（生成結果を含む）
+def seed_jobs(jobs_dir: str, count: int):
+    store = SQLiteJobStore(os.path.join(jobs_dir, "jobs.db"))
+    started_at = datetime.now() - timedelta(days=1)
+    job_ids = []
+    for i in range(count):
+        job_id = str(uuid.uuid4())
+        store.create({
+            "jobId": job_id,
+            "status": "completed",
+            "progress": 100,
+            "currentStep": "completed",
+            "steps": [],
+            "createdAt": (started_at + timedelta(seconds=i)).isoformat(),
+            "originalData": {"serviceName": f"bench-{i}"},
+            "result": {"html": "<html></html>" * 100, "css": "body{}" * 100, "js": ""},
+        })
+        job_ids.append(job_id)
+    store.close()
+    return job_ids
+
+
+def start_server(workers: int, port: int, jobs_dir: str, cache_dir: str) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        "LP_JOBS_DIR": jobs_dir,
+        "LP_CACHE_DIR": cache_dir,
+        "LP_WORKERS": str(workers),
+        "LP_PORT": str(port),
+    }
+    return subprocess.Popen(
+        [sys.executable, "main.py"],
+        cwd=BACKEND_DIR,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+def wait_until_ready(base_url: str, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"{base_url}/api/queue", timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError("Server did not start in time")
+
+
+async def _client_loop(base_url: str, job_ids, concurrency: int, duration: float):
+    latencies = []
+    errors = 0
+    deadline = time.monotonic() + duration
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=10) as client:
+        async def worker(offset: int):
+            nonlocal errors
+            i = offset
+            while time.monotonic() < deadline:
+                job_id = job_ids[i % len(job_ids)]
+                i += concurrency
+                started = time.monotonic()
+                try:
+                    response = await client.get(f"/api/jobs/{job_id}")
+                    if response.status_code != 200:
+                        errors += 1
+                        continue
+                except httpx.HTTPError:
+                    errors += 1
+                    continue
+                latencies.append(time.monotonic() - started)
+
+        await asyncio.gather(*(worker(offset) for offset in range(concurrency)))
+    return latencies, errors
+
+
+# 負荷をかけるクライアント（1プロセス分）
+def client_process(args):
+    base_url, job_ids, concurrency, duration = args
+    return asyncio.run(_client_loop(base_url, job_ids, concurrency, duration))
+
+
+def percentile(values, p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def run_load(base_url: str, job_ids, clients: int, concurrency: int, duration: float):
+    with multiprocessing.Pool(clients) as pool:
+        results = pool.map(client_process, [(base_url, job_ids, concurrency, duration)] * clients)
+    latencies = [latency for result in results for latency in result[0]]
+    errors = sum(result[1] for result in results)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": len(latencies) / duration,
+        "p50": percentile(latencies, 50) * 1000,
+        "p99": percentile(latencies, 99) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Status-read throughput vs. uvicorn worker count")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--jobs", type=int, default=1000, help="number of seeded jobs")
+    parser.add_argument("--clients", type=int, default=4, help="number of load-generating processes")
+    parser.add_argument("--concurrency", type=int, default=16, help="in-flight requests per client process")
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    print(f"CPU cores: {os.cpu_count()}")
+    rows = []
+    for workers in args.workers:
+        with tempfile.TemporaryDirectory() as tmp:
+            jobs_dir = os.path.join(tmp, "jobs")
+            job_ids = seed_jobs(jobs_dir, args.jobs)
+            base_url = f"http://127.0.0.1:{args.port}"
+            server = start_server(workers, args.port, jobs_dir, os.path.join(tmp, "cache"))
+            try:
+                wait_until_ready(base_url)
+                # ウォームアップ
+                run_load(base_url, job_ids, args.clients, args.concurrency, 2)
+                result = run_load(base_url, job_ids, args.clients, args.concurrency, args.duration)
+            finally:
+                server.terminate()
+                server.wait()
+        rows.append((workers, result))
+        print(f"workers={workers}: {result['rps']:.0f} req/s, "
+              f"p50={result['p50']:.1f}ms, p99={result['p99']:.1f}ms, errors={result['errors']}")
+
+    base_rps = rows[0][1]["rps"] or 1
+    print()
+    print("workers  req/s   speedup")
+    for workers, result in rows:
+        print(f"{workers:>7}  {result['rps']:>6.0f}  {result['rps'] / base_rps:>6.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,594 @@
+import argparse
+import asyncio
+import base64
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+from io import BytesIO
+from typing import Any, Dict, List, Optional
+
+######################################
+## 記録した応答を再生するオフラインのベンチマーク
+######################################
+# Claude / Gemini / Imagen の呼び出しを、記録した応答（または合成した応答）と疑似的な遅延に置き換え、
+# アプリをプロセス内で起動して /api/generate に目標の同時実行数でジョブを投入し続ける
+# ネットワークもAPIキーも不要なため、スケジューラーやキャッシュの変更をノートPCで比較できる
+# 計測する値:
+#   - ジョブ全体（投入〜完了）と段階ごと（timing）の所要時間の p50 / p95 / p99
+#   - 1分あたりの完了ジョブ数、イベントループの遅延、RSS、1ジョブあたりのディスク書き込み量
+# 使い方（backend ディレクトリで実行）:
+#   python bench/offline_replay.py --jobs 40 --concurrency 8 --time-scale 0.05
+#   python bench/offline_replay.py --latency claude=lognormal:30:0.5 --latency imagen=fixed:8 --json after.json
+#   LP_WIREFRAME_MODE=sections python bench/offline_replay.py --output-tps 60   # 出力の長さに比例する遅延で比較する
+#   python bench/offline_replay.py --record recording.json   # 実際のAPIで1ジョブ生成して応答を記録する（要APIキー）
+#   python bench/offline_replay.py --responses recording.json  # 記録した応答を再生する
+# 遅延の指定: fixed:秒 / uniform:最小:最大 / normal:平均:標準偏差 / lognormal:中央値:σ（--time-scale 倍される）
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+# 呼び出しの種類（システムプロンプトに含まれる語で判定する。プロンプトを調整しても記録を使い回せる）
+ROLE_PATTERNS = [
+    ("wireframe-outline", "セクション構成（アウトライン）"),
+    ("wireframe-section", "1つのセクションのHTML"),
+    ("wireframe", "ワイヤーフレーム作成"),
+    ("js", "JavaScriptを用いて"),
+    ("css", "CSSでデザインを提案"),
+    ("image-prompts", "画像生成のプロンプト"),
+    ("apply-image", "画像を適用"),
+]
+DEFAULT_LATENCIES = {
+    "claude": "lognormal:30:0.3",
+    "gemini": "lognormal:2:0.3",
+    "imagen": "lognormal:8:0.3",
+}
+# ストリーミングで返すテキストの分割数
+STREAM_CHUNKS = 20
+
+
+def classify(system_prompt: str) -> str:
+    for role, keyword in ROLE_PATTERNS:
+        if keyword in system_prompt:
+            return role
+    return system_prompt.strip().split("。")[0][:80]
+
+
+# 遅延の分布
+class LatencyModel:
+    def __init__(self, spec: str, time_scale: float, rng: random.Random):
+        self.spec = spec
+        self.kind, *values = spec.split(":")
+        self.values = [float(value) for value in values]
+        self.time_scale = time_scale
+        self.rng = rng
+        if self.kind not in ("fixed", "uniform", "normal", "lognormal"):
+            raise ValueError(f"Unknown latency distribution: {spec}")
+
+    def sample(self) -> float:
+        if self.kind == "fixed":
+            seconds = self.values[0]
+        elif self.kind == "uniform":
+            seconds = self.rng.uniform(*self.values)
+        elif self.kind == "normal":
+            seconds = self.rng.gauss(*self.values)
+        else:
+            median, sigma = self.values
+            seconds = self.rng.lognormvariate(math.log(median), sigma)
+        return max(0.0, seconds) * self.time_scale
+
+
+######################################
+## 応答（合成・記録）
+######################################
+
+def _synthetic_png() -> bytes:
+    from PIL import Image, ImageFilter
+    noise = Image.effect_noise((1408, 768), 48).convert("RGB").filter(ImageFilter.GaussianBlur(2))
+    gradient = Image.linear_gradient("L").resize((1408, 768)).convert("RGB")
+    buffer = BytesIO()
+    Image.blend(noise, gradient, 0.5).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+# 実際の生成結果と同程度の大きさの応答（6セクション・画像4枚）
+def synthetic_recording() -> Dict[str, Any]:
+    def section(i: int) -> str:
+        return f"""
+    <section id="section-{i}" class="section section-{i}">
+      <div class="container">
+        <h2 class="section-title">セクション{i}の見出し</h2>
+        <div class="grid">
+          {"".join(f'<div class="card"><i data-lucide="check"></i><h3>特徴{j}</h3><p>{"サービスの特徴を具体的に説明する文章です。" * 4}</p></div>' for j in range(4))}
+        </div>
+        {f'<img src="placeholder_html_{(i + 1) // 2}.png" alt="セクション{i}の画像" class="section-image">' if i % 2 else ''}
+      </div>
+    </section>"""
+
+    sections = "".join(section(i) for i in range(1, 7))
+    html = f"""```html
+<!DOCTYPE html>
+<html lang="ja">
+<head>
+  <meta charset="UTF-8">
+  <title>ベンチマーク</title>
+  <link rel="stylesheet" href="style.css">
+</head>
+<body>
+  <header class="header"><nav class="nav"><a href="#">ホーム</a><a href="#">特徴</a><a href="#">料金</a></nav></header>
+  <section class="hero"><div class="hero-content"><h1>サービス名</h1><p>キャッチコピー</p><a class="btn">無料で試す</a></div></section>{sections}
+  <footer class="footer"><p>&copy; 会社名</p></footer>
+  <script>lucide.createIcons();</script>
+  <script src="script.js"></script>
+</body>
+</html>
+```"""
+    rules = "".join(
+        f""".section-{i} {{ padding: 96px 24px; background: #f{i}f{i}f{i}; }}
+.section-{i} .card {{ padding: 32px; border-radius: 16px; background: #fff; box-shadow: 0 8px 24px rgba(0, 0, 0, 0.08); transition: transform 0.3s ease; }}
+.section-{i} .card:hover {{ transform: translateY(-4px); box-shadow: 0 12px 32px rgba(0, 0, 0, 0.12); }}
+.section-{i} .section-title {{ font-size: 2rem; margin-bottom: 48px; text-align: center; color: #222; }}
+"""
+        for i in range(1, 7)
+    )
+    css = f"""```css
+body {{ margin: 0; font-family: 'Noto Sans JP', sans-serif; color: #333; line-height: 1.8; }}
+.hero {{ min-height: 80vh; display: flex; align-items: center; justify-content: center; color: #fff;
+  background: linear-gradient(rgba(0, 0, 0, 0.5), rgba(0, 0, 0, 0.5)), url('placeholder_css_1.png') center/cover no-repeat; }}
+.hero h1 {{ font-size: 3rem; text-shadow: 0 2px 8px rgba(0, 0, 0, 0.6); }}
+{rules * 3}
+```"""
+    js = "```javascript\n" + "".join(
+        f"document.querySelectorAll('.section-{i} .card').forEach((card, index) => {{\n"
+        f"  card.style.transitionDelay = `${{index * 80}}ms`;\n"
+        f"  new IntersectionObserver(([entry]) => entry.isIntersecting && card.classList.add('visible')).observe(card);\n"
+        f"}});\n"
+        for i in range(1, 7)
+    ) + "```"
+
+    def entry(text: str) -> Dict[str, Any]:
+        return {"text": text, "outputTokens": len(text) // 3}
+
+    return {
+        "claude": {
+            "wireframe": entry(html), "css": entry(css), "js": entry(js),
+            # LP_WIREFRAME_MODE=sections の場合のセクションごとのHTML
+            "wireframe-section": entry(f"```html{section(1)}\n```"),
+        },
+        "gemini": {
+            "wireframe-outline": entry(json.dumps({
+                "title": "ベンチマーク", "siteName": "サービス名", "copyright": "© 会社名",
+                "sections": [
+                    {"id": "hero", "name": "ヒーロー", "content": "キャッチコピー", "sources": ["①", "②"]},
+                    *({"id": f"section-{i}", "name": f"セクション{i}", "content": "サービスの特徴", "sources": ["④"]}
+                      for i in range(1, 7)),
+                ],
+            }, ensure_ascii=False)),
+            "image-prompts": entry(json.dumps([
+                {"fileName": "placeholder", "prompt": "A bright modern office with a diverse team collaborating, natural light"},
+                {"fileName": "placeholder", "prompt": "A friendly teacher giving an online lesson on a laptop, warm tones"},
+            ])),
+            "apply-image": entry(css),
+        },
+        "imagen": {"16:9": base64.b64encode(_synthetic_png()).decode("ascii")},
+    }
+
+
+# 記録した応答を、疑似的な遅延とともに返す（providers の関数を置き換える）
+class ReplayProviders:
+    def __init__(self, recording: Dict[str, Any], latencies: Dict[str, LatencyModel],
+                 output_tps: Optional[float] = None, time_scale: float = 1.0):
+        self.recording = recording
+        self.latencies = latencies
+        # 出力トークン数に比例する遅延（1秒あたりの出力トークン数。None の場合は遅延の分布のみ）
+        self.output_tps = output_tps
+        self.time_scale = time_scale
+        self.images = {aspect: base64.b64decode(data) for aspect, data in recording["imagen"].items()}
+        self.calls: Dict[str, int] = {}
+        self.unmatched: Dict[str, int] = {}
+        # プロンプトキャッシュに書き込まれた context（2回目以降はキャッシュの読み込みとして使用量を返す）
+        self.cached_contexts: set = set()
+        self.prompt_cache = True
+
+    def _delay(self, provider: str, entry: Dict[str, Any]) -> float:
+        delay = self.latencies[provider].sample()
+        if self.output_tps:
+            delay += entry["outputTokens"] / self.output_tps * self.time_scale
+        return delay
+
+    def _entry(self, provider: str, system_prompt: str) -> Dict[str, Any]:
+        role = classify(system_prompt)
+        self.calls[f"{provider}:{role}"] = self.calls.get(f"{provider}:{role}", 0) + 1
+        entries = self.recording[provider]
+        if role in entries:
+            return entries[role]
+        # 記録にない呼び出しは、同じプロバイダーの最初の応答で代用する
+        self.unmatched[f"{provider}:{role}"] = self.unmatched.get(f"{provider}:{role}", 0) + 1
+        return next(iter(entries.values()))
+
+    async def claude_stream(self, system_prompt, prompt, on_text=None, model=None, max_tokens=8192, temperature=1,
+                            on_usage=None, context=None):
+        entry = self._entry("claude", system_prompt)
+        text = entry["text"]
+        delay = self._delay("claude", entry)
+        size = max(1, math.ceil(len(text) / STREAM_CHUNKS))
+        for start in range(0, len(text), size):
+            await asyncio.sleep(delay / STREAM_CHUNKS)
+            if on_text is not None:
+                on_text(text[start:start + size])
+        if on_usage is not None:
+            input_tokens, cache_read, cache_write = (len(system_prompt) + len(prompt)) // 3, 0, 0
+            if context and self.prompt_cache:
+                if context in self.cached_contexts:
+                    cache_read = len(context) // 3
+                else:
+                    cache_write = len(context) // 3
+                    self.cached_contexts.add(context)
+            elif context:
+                input_tokens += len(context) // 3
+            on_usage(input_tokens, entry["outputTokens"], cache_read, cache_write)
+        return text
+
+    async def claude_messages(self, system_prompt, prompt, model=None, max_tokens=8192, temperature=1, on_usage=None,
+                              context=None):
+        return await self.claude_stream(system_prompt, prompt, model=model, on_usage=on_usage, context=context)
+
+    async def gemini_generate(self, system_instruction, prompt, generation_config, model=None, on_usage=None):
+        entry = self._entry("gemini", system_instruction)
+        await asyncio.sleep(self._delay("gemini", entry))
+        text = entry["text"]
+        # JSON出力（画像のプロンプト）は、リクエストのファイル名に記録したプロンプトを順に割り当てる
+        if generation_config.get("response_mime_type") == "application/json":
+            try:
+                requested = [item["fileName"] for item in json.loads(prompt)]
+                recorded = [item["prompt"] for item in json.loads(text)]
+                text = json.dumps([
+                    {"fileName": name, "prompt": recorded[i % len(recorded)]} for i, name in enumerate(requested)
+                ])
+            except (ValueError, KeyError, TypeError, ZeroDivisionError):
+                pass
+        if on_usage is not None:
+            on_usage((len(system_instruction) + len(prompt)) // 3, entry["outputTokens"], 0, 0)
+        return text
+
+    async def imagen_generate(self, prompt, aspect_ratio, model=None) -> bytes:
+        self.calls["imagen"] = self.calls.get("imagen", 0) + 1
+        await asyncio.sleep(self.latencies["imagen"].sample())
+        return self.images.get(aspect_ratio) or next(iter(self.images.values()))
+
+    def install(self, providers):
+        self.prompt_cache = providers.CLAUDE_PROMPT_CACHE
+        providers.claude_stream = self.claude_stream
+        providers.claude_messages = self.claude_messages
+        providers.gemini_generate = self.gemini_generate
+        providers.imagen_generate = self.imagen_generate
+
+
+# 実際のAPIの応答を記録する（providers の関数を包む）
+class RecordingProviders:
+    def __init__(self, providers):
+        self.providers = providers
+        self.originals = {
+            name: getattr(providers, name)
+            for name in ("claude_stream", "claude_messages", "gemini_generate", "imagen_generate")
+        }
+        self.recording: Dict[str, Any] = {"claude": {}, "gemini": {}, "imagen": {}}
+
+    def _usage_recorder(self, on_usage, usage: Dict[str, int]):
+        def record(input_tokens, output_tokens, *cache_tokens):
+            usage["outputTokens"] = output_tokens
+            if on_usage is not None:
+                on_usage(input_tokens, output_tokens, *cache_tokens)
+        return record
+
+    async def claude_stream(self, system_prompt, prompt, on_text=None, on_usage=None, **kwargs):
+        usage: Dict[str, int] = {"outputTokens": 0}
+        text = await self.originals["claude_stream"](
+            system_prompt, prompt, on_text=on_text, on_usage=self._usage_recorder(on_usage, usage), **kwargs
+        )
+        self.recording["claude"][classify(system_prompt)] = {"text": text, **usage}
+        return text
+
+    async def claude_messages(self, system_prompt, prompt, on_usage=None, **kwargs):
+        usage: Dict[str, int] = {"outputTokens": 0}
+        text = await self.originals["claude_messages"](
+            system_prompt, prompt, on_usage=self._usage_recorder(on_usage, usage), **kwargs
+        )
+        self.recording["claude"][classify(system_prompt)] = {"text": text, **usage}
+        return text
+
+    async def gemini_generate(self, system_instruction, prompt, generation_config, on_usage=None, **kwargs):
+        usage: Dict[str, int] = {"outputTokens": 0}
+        text = await self.originals["gemini_generate"](
+            system_instruction, prompt, generation_config, on_usage=self._usage_recorder(on_usage, usage), **kwargs
+        )
+        self.recording["gemini"][classify(system_instruction)] = {"text": text, **usage}
+        return text
+
+    async def imagen_generate(self, prompt, aspect_ratio, **kwargs) -> bytes:
+        image_bytes = await self.originals["imagen_generate"](prompt, aspect_ratio, **kwargs)
+        self.recording["imagen"][aspect_ratio] = base64.b64encode(image_bytes).decode("ascii")
+        return image_bytes
+
+    def install(self):
+        for name in self.originals:
+            setattr(self.providers, name, getattr(self, name))
+
+
+######################################
+## 計測
+######################################
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q
+    lower, upper = math.floor(position), math.ceil(position)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def summarize(values: List[float]) -> Dict[str, Optional[float]]:
+    return {
+        "count": len(values),
+        **{
+            name: round(value, 3) if value is not None else None
+            for name, value in (("p50", percentile(values, 0.5)), ("p95", percentile(values, 0.95)),
+                                ("p99", percentile(values, 0.99)), ("max", max(values, default=None)))
+        },
+    }
+
+
+# 自プロセスと子孫プロセス（画像の最適化のプロセスなど）の pid
+def process_tree() -> List[int]:
+    children: Dict[int, List[int]] = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    pids, stack = [], [os.getpid()]
+    while stack:
+        pid = stack.pop()
+        pids.append(pid)
+        stack.extend(children.get(pid, []))
+    return pids
+
+
+def _proc_values(pid: int, file_name: str, keys: List[str]) -> Dict[str, int]:
+    values = {}
+    try:
+        with open(f"/proc/{pid}/{file_name}") as f:
+            for line in f:
+                name, _, value = line.partition(":")
+                if name in keys:
+                    values[name] = int(value.split()[0])
+    except OSError:
+        pass
+    return values
+
+
+def rss_mb() -> float:
+    return sum(_proc_values(pid, "status", ["VmRSS"]).get("VmRSS", 0) for pid in process_tree()) / 1024
+
+
+# 書き込んだバイト数（wchar: writeシステムコールの合計 / write_bytes: ストレージへの書き込み）
+# 終了した子プロセスの分は含まれない
+def written_bytes() -> Dict[str, int]:
+    totals = {"wchar": 0, "write_bytes": 0}
+    for pid in process_tree():
+        for key, value in _proc_values(pid, "io", list(totals)).items():
+            totals[key] += value
+    return totals
+
+
+def directory_bytes(directory: str) -> int:
+    total = 0
+    for root, _, files in os.walk(directory):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+# イベントループの遅延（interval ごとに起き、予定より遅れた時間を記録する）
+async def monitor_event_loop(samples: List[float], interval: float = 0.05):
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, time.perf_counter() - started - interval))
+
+
+######################################
+## 実行
+######################################
+
+def request_body(index: int) -> Dict[str, Any]:
+    return {
+        "serviceName": f"bench-service-{index}",
+        "serviceType": "オンライン英会話",
+        "targetAudience": "社会人",
+        "features": "ネイティブ講師、24時間予約可能",
+        "testimonials": "満足度95%",
+        "companyName": "ベンチマーク株式会社",
+        "noCache": True,
+    }
+
+
+async def drive(app_module, args) -> Dict[str, Any]:
+    import httpx
+    transport = httpx.ASGITransport(app=app_module.app)
+    job_latencies: List[float] = []
+    stage_latencies: Dict[str, List[float]] = {}
+    queue_waits: List[float] = []
+    outcomes = {"completed": 0, "error": 0, "rejected": 0}
+    next_index = iter(range(args.jobs))
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def worker():
+            for index in next_index:
+                submitted = time.perf_counter()
+                while True:
+                    response = await client.post("/api/generate", json=request_body(index))
+                    if response.status_code != 429:
+                        break
+                    outcomes["rejected"] += 1
+                    await asyncio.sleep(args.poll_interval)
+                job_id = response.json()["jobId"]
+                started = None
+                while True:
+                    await asyncio.sleep(args.poll_interval)
+                    job = (await client.get(f"/api/jobs/{job_id}")).json()
+                    if started is None and job["status"] != "pending":
+                        started = time.perf_counter()
+                    if job["status"] in ("completed", "error"):
+                        break
+                outcomes[job["status"]] += 1
+                job_latencies.append(time.perf_counter() - submitted)
+                queue_waits.append((started or time.perf_counter()) - submitted)
+                for stage_id, timing in (job.get("timing") or {}).get("stages", {}).items():
+                    stage_latencies.setdefault(stage_id, []).append(timing["duration"])
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "elapsedSeconds": round(elapsed, 3),
+        "jobsPerMinute": round(outcomes["completed"] / elapsed * 60, 2),
+        "outcomes": outcomes,
+        "jobLatency": summarize(job_latencies),
+        "queueWait": summarize(queue_waits),
+        "stageLatency": {stage_id: summarize(values) for stage_id, values in stage_latencies.items()},
+    }
+
+
+async def run_benchmark(args, tmp: str) -> Dict[str, Any]:
+    import main
+    import providers
+
+    rng = random.Random(args.seed)
+    specs = {**DEFAULT_LATENCIES, **dict(spec.split("=", 1) for spec in args.latency)}
+    latencies = {provider: LatencyModel(spec, args.time_scale, rng) for provider, spec in specs.items()}
+    if args.responses:
+        with open(args.responses, encoding="utf-8") as f:
+            recording = json.load(f)
+    else:
+        recording = synthetic_recording()
+    replay = ReplayProviders(recording, latencies, args.output_tps, args.time_scale)
+    replay.install(providers)
+
+    lag_samples: List[float] = []
+    async with main.lifespan(main.app):
+        written_before = written_bytes()
+        monitor = asyncio.create_task(monitor_event_loop(lag_samples))
+        report = await drive(main, args)
+        monitor.cancel()
+        written_after = written_bytes()
+        rss = rss_mb()
+
+    completed = max(1, report["outcomes"]["completed"])
+    report.update({
+        "eventLoopLag": summarize(lag_samples),
+        "rssMb": round(rss, 1),
+        "writtenBytesPerJob": {key: (written_after[key] - written_before[key]) // completed for key in written_after},
+        "diskFootprintBytesPerJob": directory_bytes(os.path.join(tmp, "jobs")) // completed,
+        "providerCalls": replay.calls,
+        "unmatchedCalls": replay.unmatched,
+        "config": {
+            "jobs": args.jobs,
+            "concurrency": args.concurrency,
+            "timeScale": args.time_scale,
+            "outputTps": args.output_tps,
+            "latency": specs,
+            "responses": args.responses or "synthetic",
+            "maxConcurrentJobs": os.environ["LP_MAX_CONCURRENT_JOBS"],
+        },
+    })
+    return report
+
+
+async def record(args, output: str):
+    import main
+    import providers
+
+    recorder = RecordingProviders(providers)
+    recorder.install()
+    async with main.lifespan(main.app):
+        job_id = main.create_pending_job(request_body(0))
+        while main.job_store.get(job_id, include_result=False)["status"] not in ("completed", "error"):
+            await asyncio.sleep(1)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(recorder.recording, f, ensure_ascii=False)
+    print(f"recorded: {sorted(recorder.recording['claude'])} {sorted(recorder.recording['gemini'])} -> {output}")
+
+
+def print_report(report: Dict[str, Any]):
+    print(f"jobs: {report['outcomes']}, {report['elapsedSeconds']}s, {report['jobsPerMinute']} jobs/min")
+    print("latency(s)            count     p50     p95     p99     max")
+    rows = [("job (end-to-end)", report["jobLatency"]), ("queue wait", report["queueWait"])]
+    rows += [(f"  {stage_id}", values) for stage_id, values in report["stageLatency"].items()]
+    rows.append(("event loop lag", report["eventLoopLag"]))
+    for name, values in rows:
+        print(f"{name:<20}  {values['count']:>5}  " + "  ".join(
+            f"{values[key]:>6.3f}" if values[key] is not None else "     -" for key in ("p50", "p95", "p99", "max")
+        ))
+    print(f"RSS: {report['rssMb']} MB (process tree), written per job: {report['writtenBytesPerJob']}, "
+          f"job directory per job: {report['diskFootprintBytesPerJob']} bytes")
+    if report["unmatchedCalls"]:
+        print(f"warning: calls without a recorded response (replayed another response): {report['unmatchedCalls']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load benchmark with replayed provider responses")
+    parser.add_argument("--jobs", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=4, help="jobs kept in flight by the client")
+    parser.add_argument("--server-concurrency", type=int, help="LP_MAX_CONCURRENT_JOBS (default: keep)")
+    parser.add_argument("--latency", action="append", default=[], metavar="PROVIDER=DIST",
+                        help="claude / gemini / imagen latency, e.g. imagen=lognormal:8:0.3")
+    parser.add_argument("--output-tps", type=float,
+                        help="add output tokens / TPS seconds to each Claude / Gemini call, e.g. 60")
+    parser.add_argument("--time-scale", type=float, default=0.05, help="multiplier for all latencies")
+    parser.add_argument("--poll-interval", type=float, default=0.2)
+    parser.add_argument("--responses", help="recorded responses (JSON); default: synthetic responses")
+    parser.add_argument("--record", metavar="PATH", help="run one job against the real APIs and record responses")
+    parser.add_argument("--keep-rate-limits", action="store_true", help="keep the configured provider rate limits")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", metavar="PATH", help="write the report as JSON (for A/B comparisons)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # アプリの読み込み前に、ジョブ・キャッシュ・画像ライブラリの保存先を一時ディレクトリにする
+        os.environ["LP_JOBS_DIR"] = os.path.join(tmp, "jobs")
+        os.environ["LP_CACHE_DIR"] = os.path.join(tmp, "cache")
+        os.environ["LP_IMAGE_LIBRARY_DIR"] = os.path.join(tmp, "image_library")
+        os.environ.setdefault("LP_MAX_QUEUED_JOBS", str(max(20, args.concurrency * 2)))
+        if args.server_concurrency:
+            os.environ["LP_MAX_CONCURRENT_JOBS"] = str(args.server_concurrency)
+        os.environ.setdefault("LP_MAX_CONCURRENT_JOBS", "4")
+        if not args.keep_rate_limits and not args.record:
+            import rate_limiter
+            os.environ["LP_RATE_LIMITS"] = json.dumps({model: {} for model in rate_limiter.DEFAULT_RATE_LIMITS})
+
+        if args.record:
+            asyncio.run(record(args, args.record))
+            return
+        report = asyncio.run(run_benchmark(args, tmp))
+
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from io import BytesIO
+
+######################################
+## ZIPパッケージングのディスクI/Oの比較
+######################################
+# 以前の方式（成果物を一時ディレクトリにコピー → make_archive → 削除）と、
+# ストリーミング方式（配信時に成果物から直接ZIPを生成）で、1ジョブあたりの読み書き量と時間を計測する
+# 使い方（backend ディレクトリで実行）:
+#   python bench/packaging_io.py --images 6 --downloads 1
+# 読み書き量は /proc/self/io の rchar / wchar（Linuxのみ）から取得する
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from zip_stream import iter_zip  # noqa: E402
+
+
+def io_counters():
+    counters = {}
+    with open("/proc/self/io") as f:
+        for line in f:
+            name, value = line.split(":")
+            counters[name] = int(value)
+    return counters["rchar"], counters["wchar"]
+
+
+# LPの成果物と同程度のファイルを作成する（HTML/CSS/JS と 16:9 のPNG画像）
+def create_artifacts(directory: str, images: int):
+    from PIL import Image
+    with open(os.path.join(directory, "index.html"), "w", encoding="utf-8") as f:
+        f.write("<section><h2>見出し</h2><p>本文のテキスト</p></section>\n" * 400)
+    with open(os.path.join(directory, "style.css"), "w", encoding="utf-8") as f:
+        f.write(".section { margin: 0 auto; padding: 64px 24px; color: #333; }\n" * 300)
+    with open(os.path.join(directory, "script.js"), "w", encoding="utf-8") as f:
+        f.write("document.querySelectorAll('.section').forEach((el) => el.classList.add('ready'));\n" * 100)
+    for i in range(images):
+        buffer = BytesIO()
+        Image.effect_noise((1408, 768), 64).convert("RGB").save(buffer, format="PNG")
+        with open(os.path.join(directory, f"placeholder_html_{i + 1}.png"), "wb") as f:
+            f.write(buffer.getvalue())
+
+
+def artifact_names(directory: str):
+    return sorted(name for name in os.listdir(directory) if not name.startswith("download-"))
+
+
+# 以前の方式: ジョブの完了時にZIPを作成し、ダウンロード時はそのファイルを送信する
+def legacy_package(directory: str, job_id: str, downloads: int):
+    zip_dir = os.path.join(os.path.dirname(directory), f"zip-{job_id}")
+    os.makedirs(zip_dir, exist_ok=True)
+    for name in artifact_names(directory):
+        shutil.copy(os.path.join(directory, name), os.path.join(zip_dir, name))
+    shutil.make_archive(os.path.join(directory, f"download-{job_id}"), "zip", zip_dir)
+    shutil.rmtree(zip_dir)
+    for _ in range(downloads):
+        with open(os.path.join(directory, f"download-{job_id}.zip"), "rb") as f:
+            while f.read(64 * 1024):
+                pass
+
+
+# ストリーミング方式: ジョブの完了時には何もせず、ダウンロード時に成果物から直接生成する
+def streaming_package(directory: str, job_id: str, downloads: int):
+    entries = [(name, os.path.join(directory, name)) for name in artifact_names(directory)]
+    for _ in range(downloads):
+        for _chunk in iter_zip(entries):
+            pass
+
+
+def measure(func, directory: str, downloads: int):
+    read_before, written_before = io_counters()
+    started = time.perf_counter()
+    func(directory, "bench", downloads)
+    elapsed = time.perf_counter() - started
+    read_after, written_after = io_counters()
+    return read_after - read_before, written_after - written_before, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Disk I/O of ZIP packaging per job")
+    parser.add_argument("--images", type=int, default=6)
+    parser.add_argument("--downloads", type=int, default=1, help="downloads per job")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = os.path.join(tmp, "job")
+        os.makedirs(directory)
+        create_artifacts(directory, args.images)
+        artifacts_mb = sum(os.path.getsize(os.path.join(directory, n)) for n in artifact_names(directory)) / 1e6
+        print(f"artifacts: {artifacts_mb:.2f} MB ({args.images} images), downloads per job: {args.downloads}")
+        print("method      read(MB)  written(MB)  total(MB)  time(s)")
+        results = {}
+        for name, func in (("legacy", legacy_package), ("streaming", streaming_package)):
+            read, written, elapsed = measure(func, directory, args.downloads)
+            results[name] = read + written
+            print(f"{name:<10}  {read / 1e6:>8.2f}  {written / 1e6:>11.2f}  {(read + written) / 1e6:>9.2f}  {elapsed:>7.3f}")
+        print(f"disk I/O reduction: {1 - results['streaming'] / results['legacy']:.0%}")
+
+
+if __name__ == "__main__":
+    main()
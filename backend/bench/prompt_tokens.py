@@ -0,0 +1,157 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+######################################
+## プロンプトキャッシュ・コンテキストの要約による入力トークンの比較
+######################################
+# HTMLを受け取るエージェント（CSS / JS / 画像の適用）を、次の2つの設定で実行し、呼び出しごとの入力トークン数・
+# キャッシュの読み込み / 書き込み・費用の見積もり（と --live の場合は所要時間）を比較する
+#   before: 全文を渡す（LP_CONTEXT_COMPACTION=0, LP_CLAUDE_PROMPT_CACHE=0）
+#   after:  HTMLを共通の context としてキャッシュし、JS / 画像の適用には要約を渡す（既定）
+# 使い方（backend ディレクトリで実行）:
+#   python bench/prompt_tokens.py                          # 合成した応答を再生（トークン数は文字数からの概算）
+#   python bench/prompt_tokens.py --responses rec.json     # offline_replay.py --record で記録した応答を使う
+#   python bench/prompt_tokens.py --live                   # 実際のAPIを呼び出し、実際の使用量と所要時間を計測
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from offline_replay import LatencyModel, ReplayProviders, classify, synthetic_recording  # noqa: E402
+
+MODES = {
+    "before": {"compaction": False, "prompt_cache": False},
+    "after": {"compaction": True, "prompt_cache": True},
+}
+
+
+# 呼び出しごとの使用量と所要時間を記録する（providers の関数を包む）
+class UsageProviders:
+    def __init__(self, providers):
+        self.providers = providers
+        self.originals = {name: getattr(providers, name) for name in ("claude_stream", "claude_messages", "gemini_generate")}
+        self.calls: List[Dict[str, Any]] = []
+
+    def _wrap(self, name: str, provider: str, model: str):
+        original = self.originals[name]
+
+        async def call(system_prompt, prompt, *args, on_usage=None, **kwargs):
+            entry = {"provider": provider, "model": model, "role": classify(system_prompt),
+                     "input": 0, "output": 0, "cacheRead": 0, "cacheWrite": 0}
+
+            def record(input_tokens, output_tokens, cache_read=0, cache_write=0):
+                entry.update(input=input_tokens, output=output_tokens, cacheRead=cache_read, cacheWrite=cache_write)
+                if on_usage is not None:
+                    on_usage(input_tokens, output_tokens, cache_read, cache_write)
+
+            started = time.perf_counter()
+            text = await original(system_prompt, prompt, *args, on_usage=record, **kwargs)
+            entry["seconds"] = time.perf_counter() - started
+            self.calls.append(entry)
+            return text
+        return call
+
+    def install(self):
+        self.providers.claude_stream = self._wrap("claude_stream", "claude", self.providers.CLAUDE_MODEL)
+        self.providers.claude_messages = self._wrap("claude_messages", "claude", self.providers.CLAUDE_MODEL)
+        self.providers.gemini_generate = self._wrap("gemini_generate", "gemini", self.providers.GEMINI_MODEL)
+
+    def uninstall(self):
+        for name, original in self.originals.items():
+            setattr(self.providers, name, original)
+
+
+async def run_mode(mode: str, recording: Dict[str, Any], tmp: str, live: bool) -> List[Dict[str, Any]]:
+    import lp_generator
+    import providers
+    from response_cache import cache_bypass
+
+    cache_bypass.set(True)
+    lp_generator.CONTEXT_COMPACTION = MODES[mode]["compaction"]
+    lp_generator.APPLY_IMAGE_MODE = "llm"
+    providers.CLAUDE_PROMPT_CACHE = MODES[mode]["prompt_cache"]
+
+    originals = {name: getattr(providers, name) for name in ("claude_stream", "claude_messages", "gemini_generate")}
+    if not live:
+        ReplayProviders(recording, {
+            provider: LatencyModel("fixed:0", 1.0, None) for provider in ("claude", "gemini", "imagen")
+        }).install(providers)
+    usage = UsageProviders(providers)
+    usage.install()
+    try:
+        workspace = lp_generator.JobWorkspace(os.path.join(tmp, mode))
+        html_data = lp_generator.extract_html_code(recording["claude"]["wireframe"]["text"])
+        css_data = await lp_generator.design_css_agent(workspace, html_data)
+        await lp_generator.design_js_agent(workspace, html_data, css_data)
+        await lp_generator.apply_image(workspace, html_data, css_data, [])
+    finally:
+        usage.uninstall()
+        for name, original in originals.items():
+            setattr(providers, name, original)
+    return usage.calls
+
+
+def print_report(results: Dict[str, List[Dict[str, Any]]], live: bool):
+    from observability import estimate_cost
+
+    print("mode    call                 input  cache read  cache write  output  cost(USD)" + ("  time(s)" if live else ""))
+    totals = {}
+    for mode, calls in results.items():
+        total = {"input": 0, "cacheRead": 0, "cacheWrite": 0, "output": 0, "cost": 0.0, "seconds": 0.0}
+        for call in calls:
+            cost = estimate_cost(call["model"], call["input"], call["output"], call["cacheRead"], call["cacheWrite"])
+            for key in ("input", "cacheRead", "cacheWrite", "output", "seconds"):
+                total[key] += call[key]
+            total["cost"] += cost
+            print(f"{mode:<7} {call['provider'] + ':' + call['role']:<20} {call['input']:>6}  {call['cacheRead']:>10}"
+                  f"  {call['cacheWrite']:>11}  {call['output']:>6}  {cost:>9.4f}" + (f"  {call['seconds']:>7.2f}" if live else ""))
+        print(f"{mode:<7} {'total':<20} {total['input']:>6}  {total['cacheRead']:>10}  {total['cacheWrite']:>11}"
+              f"  {total['output']:>6}  {total['cost']:>9.4f}" + (f"  {total['seconds']:>7.2f}" if live else ""))
+        totals[mode] = total
+
+    before, after = totals["before"], totals["after"]
+    billed_before = before["input"] + before["cacheWrite"]
+    billed_after = after["input"] + after["cacheWrite"]
+    print(f"uncached input tokens: {billed_before} -> {billed_after} "
+          f"({(billed_after - billed_before) / max(1, billed_before) * 100:+.1f}%), "
+          f"cost: {before['cost']:.4f} -> {after['cost']:.4f} USD "
+          f"({(after['cost'] - before['cost']) / max(1e-9, before['cost']) * 100:+.1f}%)")
+    if live:
+        print(f"time: {before['seconds']:.2f} -> {after['seconds']:.2f} s")
+    else:
+        print("(offline: tokens are estimated from characters; use --live for actual usage and latency)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Input tokens with and without prompt caching and context compaction")
+    parser.add_argument("--responses", help="recorded responses (JSON); default: synthetic responses")
+    parser.add_argument("--live", action="store_true", help="call the real APIs (uses the recorded / synthetic HTML)")
+    parser.add_argument("--json", metavar="PATH", help="write the per-call results as JSON")
+    args = parser.parse_args()
+
+    if args.responses:
+        with open(args.responses, encoding="utf-8") as f:
+            recording = json.load(f)
+    else:
+        recording = synthetic_recording()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # 読み込み前に、キャッシュ・画像ライブラリの保存先を一時ディレクトリにする
+        os.environ["LP_CACHE_DIR"] = os.path.join(tmp, "cache")
+        os.environ["LP_IMAGE_LIBRARY_DIR"] = os.path.join(tmp, "image_library")
+        results = {mode: asyncio.run(run_mode(mode, recording, tmp, args.live)) for mode in MODES}
+
+    print_report(results, args.live)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
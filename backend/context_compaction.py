@@ -0,0 +1,200 @@
+import re
+from html.parser import HTMLParser
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from placeholders import CSS_COMMENT_PATTERN
+
+######################################
+## プロンプトに渡すHTML / CSSの要約（入力トークンの削減）
+######################################
+# 後段のエージェントが全文を必要としない場合に、構造だけを渡す
+#   - HTML: セクションごとの要素（タグ・id・class）、見出し、含まれるclassと画像の一覧
+#   - CSS: セレクター、メディアクエリ、@keyframes、カスタムプロパティ、transition / animation、
+#          HTMLにないclass（JavaScriptで付け外しすることを想定した状態のclass）
+
+# セクションとして扱う要素（body の直下、または main の直下）
+SECTION_TAGS = {"header", "nav", "main", "section", "article", "aside", "footer", "div"}
+HEADING_TAGS = {"h1", "h2", "h3"}
+# 内容を持たない要素
+VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"}
+# 見出しのテキストの最大文字数
+HEADING_CHARS = 40
+CLASS_PATTERN = re.compile(r"\.(-?[_a-zA-Z][\w-]*)")
+
+
+def _selector(tag: str, attributes: Dict[str, str]) -> str:
+    selector = tag
+    if attributes.get("id"):
+        selector += f"#{attributes['id']}"
+    selector += "".join(f".{name}" for name in (attributes.get("class") or "").split())
+    return selector
+
+
+# セクション（トップレベルの要素）ごとの構造を集める
+class _OutlineParser(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.stack: List[str] = []
+        self.sections: List[Dict] = []
+        self.ids: List[str] = []
+        self.classes: Dict[str, int] = {}
+        self._section: Optional[Dict] = None
+        self._section_depth = 0
+        self._heading: Optional[List[str]] = None
+
+    def _is_section_start(self, tag: str) -> bool:
+        parents = [name for name in self.stack if name not in ("html",)]
+        return tag in SECTION_TAGS and (parents == ["body"] or parents == ["body", "main"])
+
+    def handle_starttag(self, tag, attrs):
+        attributes = {name: value or "" for name, value in attrs}
+        if attributes.get("id"):
+            self.ids.append(attributes["id"])
+        for name in (attributes.get("class") or "").split():
+            self.classes[name] = self.classes.get(name, 0) + 1
+
+        if self._section is None and tag != "main" and self._is_section_start(tag):
+            self._section = {"selector": _selector(tag, attributes), "headings": [], "classes": {}, "images": []}
+            self.sections.append(self._section)
+            self._section_depth = len(self.stack)
+        elif self._section is not None:
+            for name in (attributes.get("class") or "").split():
+                self._section["classes"][name] = self._section["classes"].get(name, 0) + 1
+            if tag == "img" and attributes.get("src"):
+                self._section["images"].append(attributes["src"])
+            if tag in HEADING_TAGS and self._heading is None:
+                self._heading = [tag]
+
+        if tag not in VOID_TAGS:
+            self.stack.append(tag)
+
+    def handle_endtag(self, tag):
+        if tag not in self.stack:
+            return
+        while self.stack:
+            closed = self.stack.pop()
+            if self._heading is not None and closed == self._heading[0]:
+                text = re.sub(r"\s+", " ", "".join(self._heading[1:])).strip()[:HEADING_CHARS]
+                if text and self._section is not None:
+                    self._section["headings"].append(f"{closed}: {text}")
+                self._heading = None
+            if self._section is not None and len(self.stack) == self._section_depth:
+                self._section = None
+            if closed == tag:
+                break
+
+    def handle_data(self, data):
+        if self._heading is not None:
+            self._heading.append(data)
+
+
+# HTMLで使われている class（出現回数）と id の一覧
+def html_names(html: str) -> Tuple[Dict[str, int], List[str]]:
+    parser = _OutlineParser()
+    parser.feed(html or "")
+    parser.close()
+    return parser.classes, parser.ids
+
+
+# HTMLの構造の要約（セクションごとの要素・見出し・class・画像と、全体のid / classの一覧）
+def summarize_html(html: str) -> str:
+    parser = _OutlineParser()
+    parser.feed(html or "")
+    parser.close()
+
+    lines = ["HTMLの構造（セクションごと）:"]
+    for index, section in enumerate(parser.sections, start=1):
+        parts = [f"{index}. {section['selector']}"]
+        if section["headings"]:
+            parts.append(" / ".join(section["headings"]))
+        if section["classes"]:
+            parts.append("class: " + ", ".join(
+                f"{name}×{count}" if count > 1 else name for name, count in section["classes"].items()
+            ))
+        if section["images"]:
+            parts.append("画像: " + ", ".join(section["images"]))
+        lines.append(" — ".join(parts))
+    if parser.ids:
+        lines.append("id: " + ", ".join(dict.fromkeys(parser.ids)))
+    return "\n".join(lines)
+
+
+# CSSの規則を (外側のat-rule, セレクター, 宣言) の順に返す（ネストしたat-ruleの中の規則を含む）
+def iter_css_rules(css: str) -> Iterator[Tuple[List[str], str, str]]:
+    css = CSS_COMMENT_PATTERN.sub("", css or "")
+    stack: List[list] = []
+    segment_start = 0
+    for i, char in enumerate(css):
+        if char == "{":
+            if stack:
+                stack[-1][2] = True
+            stack.append([" ".join(css[segment_start:i].split()), i + 1, False])
+            segment_start = i + 1
+        elif char == "}" and stack:
+            prelude, body_start, has_children = stack.pop()
+            if not has_children:
+                yield [item[0] for item in stack], prelude, css[body_start:i]
+            segment_start = i + 1
+        elif char == ";":
+            segment_start = i + 1
+
+
+def _declarations(body: str) -> Dict[str, str]:
+    declarations = {}
+    for declaration in body.split(";"):
+        name, _, value = declaration.partition(":")
+        if value.strip():
+            declarations[name.strip().lower()] = " ".join(value.split())
+    return declarations
+
+
+# CSSの要約（JavaScriptから参照するセレクターや状態のclass、アニメーション）
+# html を渡すと、HTMLにないclass（JavaScriptで付け外しするもの）を区別する
+def summarize_css(css: str, html: Optional[str] = None) -> str:
+    selectors: Dict[str, None] = {}
+    media: Dict[str, Dict[str, None]] = {}
+    keyframes: Dict[str, None] = {}
+    custom_properties: Dict[str, str] = {}
+    motion: Dict[str, str] = {}
+
+    for at_rules, prelude, body in iter_css_rules(css):
+        if prelude.startswith("@keyframes") or any(rule.startswith("@keyframes") for rule in at_rules):
+            name = (prelude if prelude.startswith("@keyframes") else next(
+                rule for rule in at_rules if rule.startswith("@keyframes")
+            )).split(maxsplit=1)[-1]
+            keyframes[name] = None
+            continue
+        if prelude.startswith("@"):
+            continue
+        media_rules = [rule for rule in at_rules if rule.startswith("@media")]
+        if media_rules:
+            media.setdefault(media_rules[-1][len("@media"):].strip(), {})[prelude] = None
+        else:
+            selectors[prelude] = None
+        declarations = _declarations(body)
+        for name, value in declarations.items():
+            if name.startswith("--"):
+                custom_properties[name] = value
+        effects = [f"{name}: {declarations[name]}" for name in ("transition", "animation") if name in declarations]
+        if effects:
+            motion[prelude] = "; ".join(effects)
+
+    lines = ["CSSの要約:", "セレクター: " + ", ".join(selectors)]
+    for condition, media_selectors in media.items():
+        lines.append(f"@media {condition}: " + ", ".join(media_selectors))
+    if keyframes:
+        lines.append("@keyframes: " + ", ".join(keyframes))
+    if custom_properties:
+        lines.append("カスタムプロパティ: " + ", ".join(f"{name}: {value}" for name, value in custom_properties.items()))
+    if motion:
+        lines.append("transition / animation: " + "; ".join(f"{selector} {{{effects}}}" for selector, effects in motion.items()))
+    if html is not None:
+        html_classes, _ = html_names(html)
+        css_classes = dict.fromkeys(name for selector in list(selectors) + [
+            selector for media_selectors in media.values() for selector in media_selectors
+        ] for name in CLASS_PATTERN.findall(selector))
+        state_classes = [name for name in css_classes if name not in html_classes]
+        if state_classes:
+            lines.append("HTMLにないclass（JavaScriptで付け外しする状態）: " + ", ".join(state_classes))
+    return "\n".join(lines)
+
@@ -0,0 +1,223 @@
+import asyncio
+import hashlib
+import logging
+import os
+import random
+import time
+from contextlib import nullcontext
+from io import BytesIO
+from typing import Optional, Tuple
+
+import httpx
+from PIL import Image
+
+import providers
+from observability import record_retry
+from rate_limiter import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+######################################
+## 画像生成のファンアウト（複数画像の並行生成）
+######################################
+
+# 画像のバイト列を検証してPNGとして保存する（CPU処理のためスレッドで実行する）
+def save_image(image_bytes: bytes, file_path: str):
+    image = Image.open(BytesIO(image_bytes))
+    image.save(file_path)
+    logger.info(f"画像を保存しました: {file_path}")
+
+
+# アスペクト比（"16:9" など）から代替画像のサイズを決める（長辺 long_side px）
+def placeholder_size(aspect_ratio: str, long_side: int = 1280) -> Tuple[int, int]:
+    try:
+        width, height = (int(value) for value in aspect_ratio.split(":"))
+    except ValueError:
+        width, height = 1, 1
+    if width >= height:
+        return long_side, max(1, long_side * height // width)
+    return max(1, long_side * width // height), long_side
+
+
+# 生成に失敗した画像の代わりに、プロンプトから決まる色のグラデーション画像を保存する
+def save_gradient_placeholder(file_path: str, aspect_ratio: str, seed: str):
+    digest = hashlib.sha256(seed.encode("utf-8")).digest()
+    top = tuple(64 + value // 2 for value in digest[:3])
+    bottom = tuple(value // 3 for value in digest[3:6])
+    size = placeholder_size(aspect_ratio)
+    mask = Image.linear_gradient("L").resize(size)
+    image = Image.composite(Image.new("RGB", size, bottom), Image.new("RGB", size, top), mask)
+    image.save(file_path)
+    logger.info(f"代替画像（グラデーション）を保存しました: {file_path}")
+
+
+# 再試行すべきエラーか（タイムアウト、通信エラー、レート制限（429）、サーバーエラー（5xx））
+def is_retryable_error(error: BaseException) -> bool:
+    if isinstance(error, (asyncio.TimeoutError, httpx.TransportError)):
+        return True
+    code = getattr(error, "code", None)
+    if not isinstance(code, int):
+        code = getattr(error, "status_code", None)
+    if isinstance(code, int):
+        return code == 429 or code >= 500
+    # Rayのタスク内で発生したエラーは cause に元の例外が入る
+    cause = getattr(error, "cause", None) or error.__cause__
+    return isinstance(cause, BaseException) and cause is not error and is_retryable_error(cause)
+
+
+# 1枚の画像を生成し、画像のバイト列を返す（同期版。Rayワーカーで実行される）
+# Rayワーカーは別のホストで動くことがあるため、保存は呼び出し元（APIサーバー）で行う
+def generate_image_sync(prompt: str, aspect_ratio: str) -> bytes:
+    return providers.imagen_generate_sync(prompt, aspect_ratio)
+
+
+# 画像生成の実行方式の基底クラス
+#   - 同時に生成する画像は最大 max_concurrency 枚
+#   - 1回の呼び出しが timeout 秒を超えた場合は asyncio.TimeoutError
+#   - 再試行すべきエラーは指数バックオフ（ジッター付き）で最大 max_attempts 回まで試す
+#   - 再試行を含めて1枚あたり deadline 秒を超える場合は諦めて例外を送出する
+#     （レート制限・同時実行数の空きを待っている時間は timeout にも deadline にも含めない）
+#   - rate_limiter を渡した場合、再試行を含む各呼び出しはレート制限を通る
+class ImageFanout:
+    name = "base"
+
+    def __init__(self, max_concurrency: int, timeout: float, deadline: Optional[float] = None,
+                 max_attempts: int = 3, backoff_base: float = 1.0, backoff_max: float = 20.0,
+                 rate_limiter: Optional[RateLimiter] = None):
+        self.rate_limiter = rate_limiter
+        self.max_concurrency = max(1, max_concurrency)
+        self.timeout = timeout
+        self.deadline = deadline if deadline is not None else timeout
+        self.max_attempts = max(1, max_attempts)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    # 画像を生成して file_path に保存し、ファイル名を返す
+    async def generate(self, prompt: str, file_path: str, aspect_ratio: str) -> str:
+        await self.start()
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        deadline = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                # レート制限・同時実行数の待ち時間は期限に含めない（待った分だけ期限を延ばす）
+                # 同時実行数の枠を得てからレート制限の許可を取る（許可を持ったまま枠を待たない）
+                waiting_since = time.monotonic()
+                async with self._semaphore, self._rate_limit():
+                    deadline += time.monotonic() - waiting_since
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise asyncio.TimeoutError(f"Image deadline exceeded ({self.deadline}s)")
+                    return await asyncio.wait_for(
+                        self._generate(prompt, file_path, aspect_ratio),
+                        timeout=min(self.timeout, remaining),
+                    )
+            except Exception as e:
+                if attempt >= self.max_attempts or not is_retryable_error(e):
+                    raise
+                # 同時に失敗した呼び出しが一斉に再試行しないよう、待ち時間をランダムにずらす
+                delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)))
+                if time.monotonic() + delay >= deadline:
+                    raise
+                logger.warning(f"画像生成を再試行します ({os.path.basename(file_path)}, {attempt}回目: {e!r}, {delay:.1f}秒後)")
+                record_retry("google", providers.IMAGEN_MODEL, e)
+                await asyncio.sleep(delay)
+
+    # 1回の試行ごとに取得するレート制限の許可（rate_limiter がなければ何もしない）
+    def _rate_limit(self):
+        if self.rate_limiter is None:
+            return nullcontext()
+        return self.rate_limiter.limit("google", providers.IMAGEN_MODEL)
+
+    async def _generate(self, prompt: str, file_path: str, aspect_ratio: str) -> str:
+        raise NotImplementedError
+
+
+# 既定の実行方式: イベントループ上で非同期クライアントを呼び、画像の保存のみスレッドで行う
+# 画像生成はAPI呼び出し（I/O待ち）のため、別プロセスを起動する必要がない
+class AsyncImageFanout(ImageFanout):
+    name = "async"
+
+    async def _generate(self, prompt: str, file_path: str, aspect_ratio: str) -> str:
+        image_bytes = await providers.imagen_generate(prompt, aspect_ratio)
+        await asyncio.to_thread(save_image, image_bytes, file_path)
+        return os.path.basename(file_path)
+
+
+# Rayクラスターのタスクとして生成する実行方式（LP_IMAGE_FANOUT=ray の場合のみ使用）
+# Webサーバー内にRayのランタイムを起動しないよう、外部のクラスター（address）に接続する
+class RayImageFanout(ImageFanout):
+    name = "ray"
+
+    def __init__(self, max_concurrency: int, timeout: float, address: str, **retry_options):
+        super().__init__(max_concurrency, timeout, **retry_options)
+        self.address = address
+        self._ray = None
+        self._remote = None
+        self._init_lock: Optional[asyncio.Lock] = None
+
+    async def start(self):
+        if self._init_lock is None:
+            self._init_lock = asyncio.Lock()
+        async with self._init_lock:
+            if self._remote is not None:
+                return
+            # Rayは使う場合のみ読み込む（読み込みだけで起動時間とメモリを消費するため）
+            import ray
+            if not ray.is_initialized():
+                await asyncio.to_thread(ray.init, address=self.address)
+            self._ray = ray
+            self._remote = ray.remote(generate_image_sync)
+
+    async def close(self):
+        if self._ray is not None and self._ray.is_initialized():
+            self._ray.shutdown()
+        self._ray = None
+        self._remote = None
+
+    async def _generate(self, prompt: str, file_path: str, aspect_ratio: str) -> str:
+        ref = self._remote.remote(prompt, aspect_ratio)
+        try:
+            ## ObjectRefを待機してもイベントループはブロックされない
+            image_bytes = await ref
+        except asyncio.CancelledError:
+            # タイムアウトした場合はクラスター上のタスクも取り消す
+            self._ray.cancel(ref)
+            raise
+        await asyncio.to_thread(save_image, image_bytes, file_path)
+        return os.path.basename(file_path)
+
+
+# 環境変数から設定を読み込んで画像生成の実行方式を作成する
+#   LP_IMAGE_FANOUT: async（既定） / ray
+#   LP_IMAGE_CONCURRENCY: 同時に生成する画像の数
+#   LP_IMAGE_TIMEOUT_SECONDS: 1回の呼び出しのタイムアウト
+#   LP_IMAGE_DEADLINE_SECONDS: 再試行を含めた1枚あたりの期限
+#   LP_IMAGE_MAX_ATTEMPTS: 1枚あたりの最大試行回数
+#   LP_RAY_ADDRESS: 接続するRayクラスターのアドレス（ray の場合のみ）
+def create_image_fanout_from_env(rate_limiter: Optional[RateLimiter] = None) -> ImageFanout:
+    backend = os.environ.get("LP_IMAGE_FANOUT", "async")
+    max_concurrency = int(os.environ.get("LP_IMAGE_CONCURRENCY", "8"))
+    timeout = float(os.environ.get("LP_IMAGE_TIMEOUT_SECONDS", "120"))
+    retry_options = {
+        "deadline": float(os.environ.get("LP_IMAGE_DEADLINE_SECONDS", "180")),
+        "max_attempts": int(os.environ.get("LP_IMAGE_MAX_ATTEMPTS", "3")),
+        "backoff_base": float(os.environ.get("LP_IMAGE_BACKOFF_BASE_SECONDS", "1")),
+        "backoff_max": float(os.environ.get("LP_IMAGE_BACKOFF_MAX_SECONDS", "20")),
+        "rate_limiter": rate_limiter,
+    }
+    if backend == "async":
+        return AsyncImageFanout(max_concurrency, timeout, **retry_options)
+    if backend == "ray":
+        return RayImageFanout(max_concurrency, timeout, os.environ.get("LP_RAY_ADDRESS", "auto"), **retry_options)
+    raise ValueError(f"Unknown image fan-out backend: {backend}")
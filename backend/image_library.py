@@ -0,0 +1,190 @@
+import hashlib
+import math
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+######################################
+## 画像ライブラリ（似たプロンプトで生成済みの画像の再利用）
+######################################
+# 生成した画像をプロンプト・アスペクト比とともに保存し、新しいプロンプトと似たものがあれば再利用する
+#   - プロンプトの埋め込みは、単語・単語の2-gram・文字の3-gram をハッシュした疎ベクトル（L2正規化）
+#   - 埋め込みはプロンプトから決まるため保存せず、各プロセスがSQLiteの一覧から転置インデックスを作る
+#   - 類似度はコサイン類似度。threshold 以上で最も似た画像を再利用する
+
+# 埋め込みの次元数（ハッシュの空間）
+EMBEDDING_DIMENSIONS = 1 << 20
+# 類似度に影響しない語
+STOP_WORDS = {
+    "a", "an", "the", "of", "and", "or", "in", "on", "at", "with", "for", "to", "by", "from", "is", "are",
+    "image", "photo", "photograph", "picture", "high", "quality", "resolution", "detailed", "style",
+}
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def _feature_id(feature: str) -> int:
+    # Python の hash() はプロセスごとに変わるため、安定したハッシュを使う
+    return int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "big") % EMBEDDING_DIMENSIONS
+
+
+# プロンプトの埋め込み（特徴ID → 重み の疎ベクトル）
+def embed_prompt(prompt: str) -> Dict[int, float]:
+    words = [word for word in WORD_PATTERN.findall(prompt.lower()) if word not in STOP_WORDS]
+    weights: Dict[int, float] = defaultdict(float)
+    for word in words:
+        weights[_feature_id(f"w:{word}")] += 1.0
+        # 語形の違い（collaboration / collaborating など）を吸収する
+        padded = f"^{word}$"
+        for i in range(len(padded) - 2):
+            weights[_feature_id(f"c:{padded[i:i + 3]}")] += 0.25
+    for first, second in zip(words, words[1:]):
+        weights[_feature_id(f"b:{first} {second}")] += 0.5
+    norm = math.sqrt(sum(weight * weight for weight in weights.values()))
+    return {feature: weight / norm for feature, weight in weights.items()} if norm else {}
+
+
+# 再利用できる画像
+class LibraryMatch:
+    def __init__(self, image_id: int, prompt: str, path: str, similarity: float):
+        self.image_id = image_id
+        self.prompt = prompt
+        self.path = path
+        self.similarity = similarity
+
+
+# 画像ライブラリ（複数のワーカープロセスで同じディレクトリを共有できる）
+class ImageLibrary:
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS images (
+        image_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        prompt TEXT NOT NULL,
+        aspect_ratio TEXT NOT NULL,
+        file_name TEXT NOT NULL,
+        generation_seconds REAL,
+        created_at REAL NOT NULL,
+        hits INTEGER NOT NULL DEFAULT 0
+    );
+    """
+
+    def __init__(self, directory: str, threshold: float, cost_per_image: float = 0.0):
+        self.directory = os.path.abspath(directory)
+        self.threshold = threshold
+        self.cost_per_image = cost_per_image
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            os.path.join(self.directory, "library.db"), check_same_thread=False, isolation_level=None
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self.SCHEMA)
+        # 転置インデックス: アスペクト比 → 特徴ID → [(画像ID, 重み)]
+        self._index: Dict[str, Dict[int, List[Tuple[int, float]]]] = defaultdict(lambda: defaultdict(list))
+        self._entries: Dict[int, Tuple[str, str]] = {}
+        self._loaded_id = 0
+        self._generation_seconds: List[float] = []
+        self._counters = {"lookups": 0, "hits": 0, "misses": 0, "added": 0}
+
+    # 他のプロセスが追加した画像をインデックスに反映する
+    def _refresh(self):
+        rows = self._conn.execute(
+            "SELECT image_id, prompt, aspect_ratio, file_name, generation_seconds FROM images "
+            "WHERE image_id > ? ORDER BY image_id",
+            (self._loaded_id,),
+        ).fetchall()
+        for image_id, prompt, aspect_ratio, file_name, generation_seconds in rows:
+            index = self._index[aspect_ratio]
+            for feature, weight in embed_prompt(prompt).items():
+                index[feature].append((image_id, weight))
+            self._entries[image_id] = (prompt, file_name)
+            if generation_seconds is not None:
+                self._generation_seconds.append(generation_seconds)
+            self._loaded_id = image_id
+
+    # プロンプトが最も似ている画像を返す（threshold 未満・ファイルが削除された場合は None）
+    def find(self, prompt: str, aspect_ratio: str) -> Optional[LibraryMatch]:
+        embedding = embed_prompt(prompt)
+        with self._lock:
+            self._refresh()
+            self._counters["lookups"] += 1
+            scores: Dict[int, float] = defaultdict(float)
+            index = self._index.get(aspect_ratio, {})
+            for feature, weight in embedding.items():
+                for image_id, entry_weight in index.get(feature, ()):
+                    scores[image_id] += weight * entry_weight
+
+            for image_id, similarity in sorted(scores.items(), key=lambda item: (-item[1], item[0])):
+                if similarity < self.threshold:
+                    break
+                library_prompt, file_name = self._entries[image_id]
+                path = os.path.join(self.directory, file_name)
+                if not os.path.exists(path):
+                    continue
+                self._counters["hits"] += 1
+                self._conn.execute("UPDATE images SET hits = hits + 1 WHERE image_id = ?", (image_id,))
+                return LibraryMatch(image_id, library_prompt, path, similarity)
+            self._counters["misses"] += 1
+            return None
+
+    # 生成した画像をライブラリに追加する（同じ内容の画像は1つのファイルを共有する）
+    def add(self, prompt: str, aspect_ratio: str, image_path: str, generation_seconds: Optional[float] = None):
+        with open(image_path, "rb") as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        file_name = f"{digest}{os.path.splitext(image_path)[1].lower() or '.png'}"
+        path = os.path.join(self.directory, file_name)
+        if not os.path.exists(path):
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            shutil.copyfile(image_path, tmp_path)
+            os.replace(tmp_path, path)
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO images (prompt, aspect_ratio, file_name, generation_seconds, created_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (prompt, aspect_ratio, file_name, generation_seconds, time.time()),
+            )
+            self._counters["added"] += 1
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    # 再利用の件数と、それによって省けたImagenの呼び出し時間・費用の見積もり
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._refresh()
+            hits = self._counters["hits"]
+            average_seconds = (
+                sum(self._generation_seconds) / len(self._generation_seconds) if self._generation_seconds else 0.0
+            )
+            return {
+                **self._counters,
+                "hitRate": round(hits / self._counters["lookups"], 3) if self._counters["lookups"] else 0.0,
+                "images": len(self._entries),
+                "threshold": self.threshold,
+                "savedImagenCalls": hits,
+                "savedSeconds": round(hits * average_seconds, 1),
+                "savedCost": round(hits * self.cost_per_image, 4),
+            }
+
+
+# 環境変数から設定を読み込んで画像ライブラリを作成する（LP_IMAGE_LIBRARY=0 で無効、None を返す）
+#   LP_IMAGE_LIBRARY_DIR: 画像と一覧（library.db）を保存するディレクトリ
+#   LP_IMAGE_LIBRARY_THRESHOLD: 再利用するプロンプトの類似度（コサイン類似度、0〜1）
+#   LP_IMAGEN_COST_PER_IMAGE: Imagen の1枚あたりの費用（省けた費用の見積もりに使う）
+def create_image_library_from_env() -> Optional[ImageLibrary]:
+    if os.environ.get("LP_IMAGE_LIBRARY", "1") in ("0", "false", "off"):
+        return None
+    directory = os.environ.get(
+        "LP_IMAGE_LIBRARY_DIR",
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "image_library"),
+    )
+    return ImageLibrary(
+        directory,
+        threshold=float(os.environ.get("LP_IMAGE_LIBRARY_THRESHOLD", "0.8")),
+        cost_per_image=float(os.environ.get("LP_IMAGEN_COST_PER_IMAGE", "0.03")),
+    )
@@ -0,0 +1,262 @@
+import asyncio
+import html
+import logging
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence
+
+from PIL import Image, features
+
+from workspace import JobWorkspace
+
+logger = logging.getLogger(__name__)
+
+######################################
+## 生成画像の最適化（WebP / AVIF・レスポンシブ画像）
+######################################
+
+# 出力形式ごとの Content-Type と保存時の設定
+IMAGE_FORMATS = {
+    "avif": {"mimeType": "image/avif", "pillow": "AVIF", "options": {"speed": 6}},
+    "webp": {"mimeType": "image/webp", "pillow": "WEBP", "options": {"method": 6}},
+}
+# 最適化した画像のファイル名（元の名前-幅.形式）
+VARIANT_PATTERN = re.compile(r"^(?P<stem>.+)-(?P<width>\d+)\.(?P<format>webp|avif)$")
+# 最適化の対象とする元画像の拡張子
+SOURCE_EXTENSIONS = {".png", ".jpg", ".jpeg"}
+
+
+def variant_name(file_name: str, width: int, image_format: str) -> str:
+    return f"{os.path.splitext(file_name)[0]}-{width}.{image_format}"
+
+
+# 最適化した画像であれば元画像の名前（拡張子なし）を返す
+def variant_source_stem(file_name: str) -> Optional[str]:
+    match = VARIANT_PATTERN.match(file_name)
+    return match.group("stem") if match else None
+
+
+# このPillowで出力できる形式のみ残す（AVIFは Pillow 11.2 以降）
+def supported_formats(formats: Sequence[str]) -> List[str]:
+    return [image_format for image_format in formats if image_format in IMAGE_FORMATS and features.check(image_format)]
+
+
+# 1枚の画像から、幅ごと・形式ごとの最適化した画像を作成する（プロセスプールで実行される）
+#   - 元画像より大きな幅は作成しない（元画像の幅のものは必ず作成する）
+#   - EXIF・ICCプロファイル・テキストチャンクなどのメタデータは引き継がない
+#   - 途中で失敗した場合は作成済みの画像を削除する（元画像のみが残る）
+def optimize_image_file(directory: str, file_name: str, widths: Sequence[int], formats: Sequence[str],
+                        quality: int) -> Dict[str, Any]:
+    source_path = os.path.join(directory, file_name)
+    with Image.open(source_path) as source:
+        has_alpha = source.mode in ("RGBA", "LA") or (source.mode == "P" and "transparency" in source.info)
+        image = source.convert("RGBA" if has_alpha else "RGB")
+    image.info = {}
+
+    targets = sorted({width for width in widths if width < image.width} | {image.width})
+    variants: List[Dict[str, Any]] = []
+    try:
+        for width in targets:
+            height = max(1, round(image.height * width / image.width))
+            resized = image if width == image.width else image.resize((width, height), Image.Resampling.LANCZOS)
+            for image_format in formats:
+                name = variant_name(file_name, width, image_format)
+                path = os.path.join(directory, name)
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                resized.save(tmp_path, format=IMAGE_FORMATS[image_format]["pillow"], quality=quality,
+                             **IMAGE_FORMATS[image_format]["options"])
+                os.replace(tmp_path, path)
+                variants.append({
+                    "fileName": name,
+                    "format": image_format,
+                    "width": width,
+                    "height": height,
+                    "bytes": os.path.getsize(path),
+                })
+    except Exception:
+        for variant in variants:
+            os.remove(os.path.join(directory, variant["fileName"]))
+        raise
+
+    return {
+        "fileName": file_name,
+        "width": image.width,
+        "height": image.height,
+        "bytes": os.path.getsize(source_path),
+        "variants": variants,
+    }
+
+
+# 画像の最適化をプロセスプールで実行するクラス（CPU処理のためイベントループを止めない）
+class ImageOptimizer:
+    def __init__(self, max_workers: int, widths: Sequence[int], formats: Sequence[str], quality: int):
+        self.max_workers = max(1, max_workers)
+        self.widths = sorted(set(widths))
+        self.formats = supported_formats(formats)
+        self.quality = quality
+        self._pool: Optional[ProcessPoolExecutor] = None
+        unsupported = [image_format for image_format in formats if image_format not in self.formats]
+        if unsupported:
+            logger.warning(f"このPillowでは出力できない画像形式を無効にしました: {unsupported}")
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.formats)
+
+    # プロセスは初回利用時に作成する（サーバーの起動時間に影響させない）
+    # fork ではなく spawn で起動する（スレッドを持つサーバープロセスを複製しない）
+    # 子プロセスは起動元の __main__ を読み込み直すため、サーバーは python -m uvicorn で起動する（main.py を参照）
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers,
+                                             mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    # ワークスペースの画像を最適化し、作成した画像の一覧を返す（最適化が無効の場合は None）
+    async def optimize(self, workspace: JobWorkspace, file_name: str) -> Optional[Dict[str, Any]]:
+        if not self.enabled:
+            return None
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._get_pool(), optimize_image_file,
+            workspace.root, file_name, self.widths, self.formats, self.quality,
+        )
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+
+
+# 環境変数から設定を読み込んで画像の最適化を作成する
+#   LP_IMAGE_OUTPUT_FORMATS: 出力形式（優先する順、カンマ区切り。例: avif,webp）。空にすると最適化しない
+#   LP_IMAGE_OUTPUT_WIDTHS: srcset 用に作成する幅（カンマ区切り）
+#   LP_IMAGE_OUTPUT_QUALITY: 画質（0〜100）
+#   LP_IMAGE_PROCESS_WORKERS: 最適化を行うプロセス数
+def create_image_optimizer_from_env() -> ImageOptimizer:
+    formats = [value.strip().lower() for value in os.environ.get("LP_IMAGE_OUTPUT_FORMATS", "webp").split(",")]
+    widths = [int(value) for value in os.environ.get("LP_IMAGE_OUTPUT_WIDTHS", "640,1280,1920").split(",") if value.strip()]
+    return ImageOptimizer(
+        max_workers=int(os.environ.get("LP_IMAGE_PROCESS_WORKERS", str(min(4, os.cpu_count() or 1)))),
+        widths=widths,
+        formats=[image_format for image_format in formats if image_format],
+        quality=int(os.environ.get("LP_IMAGE_OUTPUT_QUALITY", "80")),
+    )
+
+
+######################################
+## HTML / CSS の画像参照の書き換え
+######################################
+# 元画像（PNG）への参照を、最適化した画像への参照に置き換える
+#   - HTML の <img src="元画像"> は <picture> と srcset / sizes に
+#   - CSS の url(元画像) は image-set() に（image-set に対応していないブラウザ向けの宣言を先に置く）
+#   - それ以外に残った参照（インラインスタイル・JSなど）は既定の画像に
+# 書き換え後は元画像への参照が残らないため、何度実行しても結果は変わらない
+
+IMG_TAG_PATTERN = re.compile(r"<img\b[^>]*>", re.IGNORECASE)
+SRC_ATTRIBUTE_PATTERN = re.compile(r"""(?<![\w-])src\s*=\s*(["']?)([^"'\s>]+)\1""", re.IGNORECASE)
+CSS_DECLARATION_PATTERN = re.compile(r"(?P<property>[\w-]+)\s*:\s*(?P<value>[^;{}]*\burl\([^;{}]*)(?:;|(?=\}))")
+CSS_URL_PATTERN = re.compile(r"""url\(\s*(["']?)([^"')]+)\1\s*\)""")
+# <img> の表示幅が分からないため、画面幅いっぱいを想定する
+DEFAULT_SIZES = "100vw"
+
+
+# 元画像ごとの置き換え先（srcset・既定の画像・CSSの image-set）
+class ImageReference:
+    def __init__(self, manifest: Dict[str, Any]):
+        self.file_name = manifest["fileName"]
+        self.width = manifest["width"]
+        variants = manifest["variants"]
+        self.formats = list(dict.fromkeys(variant["format"] for variant in variants))
+        self.srcsets = {
+            image_format: ", ".join(
+                f"{variant['fileName']} {variant['width']}w" for variant in variants if variant["format"] == image_format
+            )
+            for image_format in self.formats
+        }
+        largest = {variant["format"]: variant["fileName"] for variant in variants if variant["width"] == self.width}
+        # image-set / srcset に対応していないブラウザ向けの画像は、最も対応の広い形式（最後に指定したもの）
+        self.fallback_format = self.formats[-1]
+        self.default = largest[self.fallback_format]
+        self.image_set = "image-set(" + ", ".join(
+            f'url("{largest[image_format]}") type("{IMAGE_FORMATS[image_format]["mimeType"]}")'
+            for image_format in self.formats
+        ) + ")"
+
+    def picture(self, img_tag: str) -> str:
+        img_tag = SRC_ATTRIBUTE_PATTERN.sub(lambda _: f'src="{self.default}"', img_tag, count=1)
+        attributes = f' srcset="{self.srcsets[self.fallback_format]}" sizes="{DEFAULT_SIZES}"'
+        img_tag = re.sub(r"\s*/?>$", lambda end: attributes + end.group(0), img_tag)
+        sources = "".join(
+            f'<source type="{IMAGE_FORMATS[image_format]["mimeType"]}" srcset="{self.srcsets[image_format]}" sizes="{DEFAULT_SIZES}">'
+            for image_format in self.formats
+            if image_format != self.fallback_format
+        )
+        return f"<picture>{sources}{img_tag}</picture>" if sources else img_tag
+
+
+def rewrite_html(text: str, references: Dict[str, ImageReference]) -> str:
+    def replace_img(match: re.Match) -> str:
+        src = SRC_ATTRIBUTE_PATTERN.search(match.group(0))
+        reference = references.get(html.unescape(src.group(2))) if src else None
+        return reference.picture(match.group(0)) if reference else match.group(0)
+
+    return IMG_TAG_PATTERN.sub(replace_img, text)
+
+
+def rewrite_css(text: str, references: Dict[str, ImageReference]) -> str:
+    def replace_declaration(match: re.Match) -> str:
+        value = match.group("value")
+        urls = [url.group(2) for url in CSS_URL_PATTERN.finditer(value)]
+        if not any(url in references for url in urls):
+            return match.group(0)
+
+        def fallback(url: re.Match) -> str:
+            reference = references.get(url.group(2))
+            return f'url("{reference.default}")' if reference else url.group(0)
+
+        def image_set(url: re.Match) -> str:
+            reference = references.get(url.group(2))
+            return reference.image_set if reference else url.group(0)
+
+        prop = match.group("property")
+        return (f"{prop}: {CSS_URL_PATTERN.sub(fallback, value).strip()}; "
+                f"{prop}: {CSS_URL_PATTERN.sub(image_set, value).strip()};")
+
+    return CSS_DECLARATION_PATTERN.sub(replace_declaration, text)
+
+
+def replace_remaining(text: str, references: Dict[str, ImageReference]) -> str:
+    for file_name, reference in references.items():
+        text = re.sub(rf"(?<![\w.-]){re.escape(file_name)}", reference.default, text)
+    return text
+
+
+# ワークスペースの index.html / style.css / script.js の画像参照を書き換える
+# manifests には ImageOptimizer.optimize の戻り値を渡す。書き換えたファイル名を返す
+def rewrite_image_references(workspace: JobWorkspace, manifests: List[Dict[str, Any]]) -> List[str]:
+    references = {
+        manifest["fileName"]: ImageReference(manifest)
+        for manifest in manifests
+        if manifest and manifest.get("variants")
+    }
+    if not references:
+        return []
+
+    rewriters = {
+        "index.html": lambda text: replace_remaining(rewrite_html(text, references), references),
+        "style.css": lambda text: replace_remaining(rewrite_css(text, references), references),
+        "script.js": lambda text: replace_remaining(text, references),
+    }
+    rewritten = []
+    for file_name, rewrite in rewriters.items():
+        if not workspace.exists(file_name):
+            continue
+        text = workspace.read_text(file_name)
+        updated = rewrite(text)
+        if updated != text:
+            workspace.write_text(file_name, updated)
+            rewritten.append(file_name)
+    return rewritten
@@ -0,0 +1,88 @@
+import html as html_lib
+import re
+from typing import Any, Dict, Iterable, List
+
+from context_compaction import CLASS_PATTERN, html_names, iter_css_rules
+
+######################################
+## 部分的な再生成（変更した項目に関係する部分のみを作り直す）
+######################################
+# 完了したジョブの入力の一部を変更した場合に、前回の成果物のうち変更の影響を受けない部分を再利用する
+#   - HTML: アウトラインで変更した項目を基にするセクションのみを作成し直す（ヘッダー・フッターの文字列は置き換える）
+#   - CSS: 既存の規則を残し、再生成したセクションのうちスタイルのないclassの規則のみを追加する
+#   - JS: 参照しているclass / id がHTMLからなくなった場合のみ作成し直す
+#   - 画像: HTML / CSS から参照され続けている画像は再利用する
+
+# JavaScriptの文字列リテラル（セレクターを含むもの）
+JS_STRING_PATTERN = re.compile(r"""(["'`])((?:\\.|(?!\1).)*?)\1""", re.DOTALL)
+ID_PATTERN = re.compile(r"#(-?[_a-zA-Z][\w-]*)")
+# HTMLのテキスト以外の部分（<script> / <style> とその中身・コメント・タグ）
+MARKUP_PATTERN = re.compile(r"<(script|style)\b.*?</\1\s*>|<!--.*?-->|<[^>]*>", re.IGNORECASE | re.DOTALL)
+
+
+# 変更した項目の番号を基にするセクションのid
+# 基にする項目（sources）が記録されていないセクションは、何かを変更した場合は常に作成し直す
+def sections_to_regenerate(outline: Dict[str, Any], changed_items: Iterable[str]) -> List[str]:
+    changed_items = set(changed_items)
+    if not changed_items:
+        return []
+    return [
+        section["id"] for section in outline["sections"]
+        if not section.get("sources") or changed_items & set(section["sources"])
+    ]
+
+
+# 変更前の値を変更後の値に置き換える（全ての値を1回で置き換え、置き換えた結果をさらに置き換えない）
+def replace_values(text: str, replacements: Dict[str, str]) -> str:
+    olds = sorted((old for old in replacements if old), key=len, reverse=True)
+    if not olds:
+        return text
+    return re.sub("|".join(map(re.escape, olds)), lambda match: replacements[match.group(0)], text)
+
+
+# HTMLのテキストに含まれる変更前の値のみを置き換える（class名・属性値・スクリプトの中の同じ文字列は変えない）
+# テキストには文字参照（&amp; など）で書かれていることもあるため、文字参照にした値も置き換える
+def replace_html_text(html: str, replacements: Dict[str, str]) -> str:
+    escaped: Dict[str, str] = {}
+    for old, new in replacements.items():
+        if old:
+            for form in (old, html_lib.escape(old, quote=False), html_lib.escape(old)):
+                escaped[form] = html_lib.escape(new, quote=False)
+    parts = []
+    position = 0
+    for match in MARKUP_PATTERN.finditer(html):
+        parts.append(replace_values(html[position:match.start()], escaped))
+        parts.append(match.group(0))
+        position = match.end()
+    parts.append(replace_values(html[position:], escaped))
+    return "".join(parts)
+
+
+# ヘッダー・フッター（タイトル・サービス名・著作権表示）に含まれる変更前の値を変更後の値に置き換える
+def update_outline_text(outline: Dict[str, Any], replacements: Dict[str, str]) -> Dict[str, Any]:
+    outline = dict(outline)
+    for key in ("title", "siteName", "copyright"):
+        outline[key] = replace_values(outline[key], replacements)
+    return outline
+
+
+# HTMLで使われているが、CSSのどのセレクターにも現れないclass
+def unstyled_classes(html: str, css: str) -> List[str]:
+    styled = {name for _, prelude, _ in iter_css_rules(css) for name in CLASS_PATTERN.findall(prelude)}
+    return [name for name in html_names(html)[0] if name not in styled]
+
+
+# JavaScriptが参照しているclass / id のうち、変更前のHTMLにあって変更後のHTMLにないもの
+# （空でなければ、JavaScriptを作成し直す必要がある）
+def stale_js_selectors(js: str, old_html: str, new_html: str) -> List[str]:
+    (old_classes, old_ids), (new_classes, new_ids) = html_names(old_html), html_names(new_html)
+    stale: Dict[str, None] = {}
+    for match in JS_STRING_PATTERN.finditer(js or ""):
+        literal = match.group(2)
+        for name in CLASS_PATTERN.findall(literal):
+            if name in old_classes and name not in new_classes:
+                stale[f".{name}"] = None
+        for name in ID_PATTERN.findall(literal):
+            if name in old_ids and name not in new_ids:
+                stale[f"#{name}"] = None
+    return list(stale)
@@ -0,0 +1,134 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from job_executor import JobExecutor
+from job_store import JobStore
+
+logger = logging.getLogger(__name__)
+
+######################################
+## 共有ジョブキューからの取得（複数ワーカープロセス対応）
+######################################
+
+# このプロセスを識別するID（ホスト名・PID・乱数）
+def create_worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+
+# ジョブストアの待機中ジョブを取得してエグゼキューターで実行するクラス
+#   - エグゼキューターに空きがある分だけ claim_next で原子的に取得する（どのワーカーが受け付けたジョブでも実行できる）
+#   - offline_executor を渡した場合、offline のジョブ（バッチAPIの結果を数分〜数時間待つもの）はそちらで実行し、
+#     通常のジョブの同時実行数を使わない
+#   - 実行中のジョブの生存時刻を定期的に更新する
+#   - 生存時刻が古いジョブ（停止したワーカーのジョブ）は on_orphaned で待機中に戻す
+class JobDispatcher:
+    def __init__(self, store: JobStore, executor: JobExecutor,
+                 run_job: Callable[[Dict[str, Any]], Awaitable[None]],
+                 on_orphaned: Callable[[Dict[str, Any]], None],
+                 offline_executor: Optional[JobExecutor] = None,
+                 worker_id: Optional[str] = None,
+                 poll_interval: float = 0.5,
+                 heartbeat_interval: float = 5.0,
+                 stale_after: float = 30.0):
+        self.store = store
+        self.executor = executor
+        self.offline_executor = offline_executor
+        self.run_job = run_job
+        self.on_orphaned = on_orphaned
+        self.worker_id = worker_id or create_worker_id()
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.stale_after = stale_after
+        self._wakeup: Optional[asyncio.Event] = None
+        self._tasks = []
+
+    async def start(self):
+        if self._tasks:
+            return
+        for executor, _ in self._pools():
+            await executor.start()
+        self._wakeup = asyncio.Event()
+        self._tasks = [
+            asyncio.create_task(self._dispatch_loop(), name="lp-job-dispatcher"),
+            asyncio.create_task(self._heartbeat_loop(), name="lp-job-heartbeat"),
+        ]
+
+    # 停止時は実行中のジョブをキャンセルし、待機中に戻して他のワーカーに引き継ぐ
+    async def shutdown(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        for executor, _ in self._pools():
+            await executor.shutdown()
+        for job in self.store.find_orphaned(worker_id=self.worker_id):
+            self.on_orphaned(job)
+
+    # 新しいジョブが投入されたことを通知する（次のポーリングを待たずに取得する）
+    def notify(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    # エグゼキューターと、そこで実行するジョブの実行方法（None は全て）
+    def _pools(self) -> List[Tuple[JobExecutor, Optional[bool]]]:
+        if self.offline_executor is None:
+            return [(self.executor, None)]
+        return [(self.executor, False), (self.offline_executor, True)]
+
+    def _dispatch(self):
+        for executor, offline in self._pools():
+            while executor.available_slots() > 0:
+                job = self.store.claim_next(self.worker_id, offline=offline)
+                if job is None:
+                    break
+                executor.submit(job["jobId"], self.run_job, job)
+
+    def _requeue_orphaned(self):
+        for job in self.store.find_orphaned(heartbeat_before=time.time() - self.stale_after):
+            logger.warning(f"停止したワーカーのジョブを待機中に戻します: {job['jobId']}")
+            self.on_orphaned(job)
+
+    async def _dispatch_loop(self):
+        last_orphan_check = 0.0
+        while True:
+            try:
+                now = time.monotonic()
+                if now - last_orphan_check >= self.heartbeat_interval:
+                    last_orphan_check = now
+                    self._requeue_orphaned()
+                self._dispatch()
+            except Exception as e:
+                logger.error(f"ジョブの取得中にエラー: {e}")
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def _heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                self.store.heartbeat(self.worker_id)
+            except Exception as e:
+                logger.error(f"ジョブの生存時刻の更新中にエラー: {e}")
+
+
+# 環境変数から設定を読み込んでディスパッチャーを作成する
+def create_job_dispatcher_from_env(store: JobStore, executor: JobExecutor,
+                                   run_job: Callable[[Dict[str, Any]], Awaitable[None]],
+                                   on_orphaned: Callable[[Dict[str, Any]], None],
+                                   offline_executor: Optional[JobExecutor] = None) -> JobDispatcher:
+    return JobDispatcher(
+        store, executor, run_job, on_orphaned,
+        offline_executor=offline_executor,
+        poll_interval=float(os.environ.get("LP_DISPATCH_INTERVAL", "0.5")),
+        heartbeat_interval=float(os.environ.get("LP_HEARTBEAT_INTERVAL", "5")),
+        stale_after=float(os.environ.get("LP_HEARTBEAT_TIMEOUT", "30")),
+    )
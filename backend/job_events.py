@@ -0,0 +1,216 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional, Set
+
+######################################
+## ジョブイベント配信（SSE / WebSocket 用）
+######################################
+
+# 終端イベント（これを受け取ったら購読を終了する）
+TERMINAL_EVENTS = ("completed", "error")
+
+# ジョブごとの購読者にイベントを配信するクラス
+# 状態全体ではなく、ステップの遷移や差分のみを配信する
+# publish はスレッドからも呼べる（購読者への受け渡しはイベントループで行う）
+class JobEventBroker:
+    def __init__(self, max_queue_size: int = 1000):
+        self.max_queue_size = max_queue_size
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        self._sequence: Dict[str, int] = {}
+        self._sequence_lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def publish(self, job_id: str, event_type: str, data: Dict[str, Any]):
+        with self._sequence_lock:
+            sequence = self._sequence.get(job_id, 0) + 1
+            self._sequence[job_id] = sequence
+            if event_type in TERMINAL_EVENTS:
+                self._sequence.pop(job_id, None)
+        self._deliver_threadsafe(job_id, {"id": sequence, "type": event_type, "data": data})
+
+    # イベントループ以外のスレッドから呼ばれた場合は、イベントループで購読者に渡す
+    def _deliver_threadsafe(self, job_id: str, event: Dict[str, Any]):
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            self._deliver(job_id, event)
+        else:
+            loop.call_soon_threadsafe(self._deliver, job_id, event)
+
+    # このプロセスの購読者にイベントを渡す
+    def _deliver(self, job_id: str, event: Dict[str, Any]):
+        for queue in self._subscribers.get(job_id, ()):
+            if queue.full():
+                # 受信が追いつかない購読者には古いイベントを捨てて最新を優先する
+                queue.get_nowait()
+            queue.put_nowait(event)
+
+    def subscriber_count(self, job_id: str) -> int:
+        return len(self._subscribers.get(job_id, ()))
+
+    # 購読中のジョブの、購読者に渡し済みの最後のイベントID（スナップショットのIDにする）
+    def position(self, job_id: str) -> int:
+        return 0
+
+    # 再接続した購読者が受け取っていないイベント（after_id より後で、購読開始までに渡し済みのもの）
+    # 再現できない場合（イベントログがない・削除済み）はNone（スナップショットから受信し直す）
+    def replay(self, job_id: str, after_id: int) -> Optional[List[Dict[str, Any]]]:
+        return None
+
+    def close(self):
+        pass
+
+    @asynccontextmanager
+    async def subscribe(self, job_id: str) -> AsyncIterator[asyncio.Queue]:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._loop = asyncio.get_running_loop()
+        self._subscribers.setdefault(job_id, set()).add(queue)
+        try:
+            yield queue
+        finally:
+            subscribers = self._subscribers.get(job_id)
+            if subscribers is not None:
+                subscribers.discard(queue)
+                if not subscribers:
+                    del self._subscribers[job_id]
+
+
+# SQLiteのイベントログを介してプロセス間でイベントを配信するクラス
+# ジョブを実行しているワーカーとSSE / WebSocketを受けたワーカーが異なっていても届く
+#   - publish: イベントログに追記する（イベントIDはログの連番）
+#   - 購読中のジョブのログを poll_interval ごとに読み、このプロセスの購読者に渡す
+#   - retention_seconds を過ぎたイベントは削除する
+class SQLiteJobEventBroker(JobEventBroker):
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS job_events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        job_id TEXT NOT NULL,
+        type TEXT NOT NULL,
+        data TEXT NOT NULL,
+        created_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_job_events_job ON job_events (job_id, id);
+    CREATE INDEX IF NOT EXISTS idx_job_events_created ON job_events (created_at);
+    """
+    # 古いイベントを削除する間隔（追記回数）
+    PRUNE_EVERY = 1000
+
+    def __init__(self, path: str, poll_interval: float = 0.1,
+                 retention_seconds: float = 3600, max_queue_size: int = 1000):
+        super().__init__(max_queue_size)
+        self.path = os.path.abspath(path)
+        self.poll_interval = poll_interval
+        self.retention_seconds = retention_seconds
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self.SCHEMA)
+        # 購読中のジョブ → 配信済みの最後のイベントID
+        self._cursors: Dict[str, int] = {}
+        self._poller: Optional[asyncio.Task] = None
+        self._published = 0
+
+    def publish(self, job_id: str, event_type: str, data: Dict[str, Any]):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO job_events (job_id, type, data, created_at) VALUES (?, ?, ?, ?)",
+                (job_id, event_type, json.dumps(data, ensure_ascii=False), now),
+            )
+            self._published += 1
+            if self._published % self.PRUNE_EVERY == 0:
+                self._conn.execute(
+                    "DELETE FROM job_events WHERE created_at < ?",
+                    (now - self.retention_seconds,),
+                )
+
+    # 購読開始以降に追記されたイベントのみを配信する
+    @asynccontextmanager
+    async def subscribe(self, job_id: str) -> AsyncIterator[asyncio.Queue]:
+        if job_id not in self._cursors:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT MAX(id) FROM job_events WHERE job_id = ?", (job_id,)
+                ).fetchone()
+            self._cursors[job_id] = row[0] or 0
+
+        async with super().subscribe(job_id) as queue:
+            if self._poller is None or self._poller.done():
+                self._poller = asyncio.create_task(self._poll(), name="lp-job-events-poller")
+            try:
+                yield queue
+            finally:
+                if self.subscriber_count(job_id) <= 1:
+                    self._cursors.pop(job_id, None)
+
+    def position(self, job_id: str) -> int:
+        return self._cursors.get(job_id, 0)
+
+    # 購読の登録後、イベントループに制御を返す前に呼ぶ（以降のイベントはポーリングで届く）
+    def replay(self, job_id: str, after_id: int) -> Optional[List[Dict[str, Any]]]:
+        cursor = self._cursors.get(job_id, 0)
+        with self._lock:
+            if after_id > 0 and self._conn.execute(
+                "SELECT 1 FROM job_events WHERE job_id = ? AND id = ?", (job_id, after_id)
+            ).fetchone() is None:
+                return None
+            rows = self._conn.execute(
+                "SELECT id, type, data FROM job_events WHERE job_id = ? AND id > ? AND id <= ? ORDER BY id",
+                (job_id, after_id, cursor),
+            ).fetchall()
+        return [{"id": event_id, "type": event_type, "data": json.loads(data)} for event_id, event_type, data in rows]
+
+    async def _poll(self):
+        while self._subscribers:
+            await asyncio.sleep(self.poll_interval)
+            for job_id, cursor in list(self._cursors.items()):
+                with self._lock:
+                    rows = self._conn.execute(
+                        "SELECT id, type, data FROM job_events WHERE job_id = ? AND id > ? ORDER BY id",
+                        (job_id, cursor),
+                    ).fetchall()
+                if not rows:
+                    continue
+                if job_id in self._cursors:
+                    self._cursors[job_id] = rows[-1][0]
+                for event_id, event_type, data in rows:
+                    self._deliver(job_id, {"id": event_id, "type": event_type, "data": json.loads(data)})
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# 環境変数から設定を読み込んでイベント配信を作成する
+#   LP_EVENT_BACKEND=sqlite（既定）: 複数のワーカープロセス間で共有
+#   LP_EVENT_BACKEND=memory: 単一プロセス用（プロセス内でのみ配信）
+def create_job_event_broker_from_env(jobs_dir: str) -> JobEventBroker:
+    backend = os.environ.get("LP_EVENT_BACKEND", "sqlite")
+    if backend == "memory":
+        return JobEventBroker()
+    if backend == "sqlite":
+        path = os.environ.get("LP_EVENT_STORE_PATH", os.path.join(jobs_dir, "events.db"))
+        poll_interval = float(os.environ.get("LP_EVENT_POLL_INTERVAL", "0.1"))
+        return SQLiteJobEventBroker(path, poll_interval=poll_interval)
+    raise ValueError(f"Unknown event backend: {backend}")
+
+
+# Server-Sent Events の形式に変換する
+def format_sse(event: Dict[str, Any]) -> str:
+    return (
+        f"id: {event['id']}\n"
+        f"event: {event['type']}\n"
+        f"data: {json.dumps(event['data'], ensure_ascii=False)}\n\n"
+    )
@@ -0,0 +1,103 @@
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+######################################
+## ジョブ実行サブシステム
+######################################
+
+# 同時実行数を制限してジョブを実行するクラス
+#   - 実行中のジョブは最大 max_concurrency 件
+#   - 待機中のジョブの上限はジョブストアで数える（main.check_queue_capacity）。ここに投入されるのは
+#     ディスパッチャーが空き（available_slots）の分だけ取得したジョブのみ
+#   - 同期関数はスレッドプールで実行し、イベントループをブロックしない
+class JobExecutor:
+    def __init__(self, max_concurrency: int):
+        self.max_concurrency = max(1, max_concurrency)
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._thread_pool: Optional[ThreadPoolExecutor] = None
+        self._pending: Dict[str, float] = {}
+        self._running: Dict[str, float] = {}
+        self._counters = {
+            "accepted": 0,
+            "completed": 0,
+            "failed": 0,
+        }
+
+    async def start(self):
+        if self._workers:
+            return
+        self._queue = asyncio.Queue()
+        self._thread_pool = ThreadPoolExecutor(
+            max_workers=self.max_concurrency,
+            thread_name_prefix="lp-job",
+        )
+        self._workers = [
+            asyncio.create_task(self._worker(), name=f"lp-job-worker-{i}")
+            for i in range(self.max_concurrency)
+        ]
+
+    async def shutdown(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        if self._thread_pool is not None:
+            self._thread_pool.shutdown(wait=False, cancel_futures=True)
+            self._thread_pool = None
+
+    # ジョブを投入する（空いているワーカーが順に実行する）
+    def submit(self, job_id: str, func: Callable[..., Any], *args: Any):
+        if self._queue is None:
+            raise RuntimeError("JobExecutor has not been started")
+        self._pending[job_id] = time.monotonic()
+        self._counters["accepted"] += 1
+        self._queue.put_nowait((job_id, func, args))
+
+    # 今すぐ実行を開始できるジョブ数（空いているワーカー数）
+    def available_slots(self) -> int:
+        return max(0, self.max_concurrency - len(self._running) - len(self._pending))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending": len(self._pending),
+            "running": len(self._running),
+            "maxConcurrency": self.max_concurrency,
+            **self._counters,
+        }
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            job_id, func, args = await self._queue.get()
+            self._pending.pop(job_id, None)
+            self._running[job_id] = time.monotonic()
+            try:
+                if asyncio.iscoroutinefunction(func):
+                    await func(*args)
+                else:
+                    await loop.run_in_executor(self._thread_pool, func, *args)
+                self._counters["completed"] += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._counters["failed"] += 1
+                logger.exception(f"ジョブ実行中に予期しないエラー ({job_id}): {e}")
+            finally:
+                self._running.pop(job_id, None)
+                self._queue.task_done()
+
+
+# 環境変数から設定を読み込んでエグゼキューターを作成する
+# offline=True の場合は offline のジョブ用（ほとんどの時間をバッチAPIの結果の待機に使うため、同時実行数を大きくする）
+def create_job_executor_from_env(offline: bool = False) -> JobExecutor:
+    if offline:
+        return JobExecutor(int(os.environ.get("LP_MAX_CONCURRENT_OFFLINE_JOBS", "100")))
+    max_concurrency = int(os.environ.get("LP_MAX_CONCURRENT_JOBS", "4"))
+    return JobExecutor(max_concurrency)
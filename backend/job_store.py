@@ -0,0 +1,404 @@
+import base64
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+######################################
+## ジョブストア（ジョブ状態の永続化）
+######################################
+
+# ページングのカーソルが不正な場合の例外
+class InvalidCursorError(ValueError):
+    pass
+
+
+# 実行中のジョブが待機中に戻され、他のワーカー（または再実行）に引き継がれた場合の例外
+class JobOwnershipLostError(Exception):
+    pass
+
+
+# ジョブストアのインターフェース
+# ジョブは辞書（APIのレスポンスと同じ形）で扱い、生成結果（result）は別に保存する
+class JobStore(ABC):
+    # 新しいジョブを保存する
+    @abstractmethod
+    def create(self, job: Dict[str, Any]):
+        ...
+
+    # ジョブを取得する（なければNone）。include_result=False の場合は生成結果を含めない
+    @abstractmethod
+    def get(self, job_id: str, include_result: bool = True) -> Optional[Dict[str, Any]]:
+        ...
+
+    # ジョブを原子的に更新し、更新前のジョブ（生成結果を除く）を返す（なければNone）
+    #   changes: 上書きするフィールド（"result" を含めると生成結果も保存する）
+    #   remove_fields: 削除するフィールド
+    #   expected_status: 指定した場合、現在の状態が一致するときのみ更新する（一致しなければNone）
+    #   expected_worker: 指定した場合、そのワーカーが取得したジョブのときのみ更新する（一致しなければNone）
+    # 待機中に戻したジョブは、取得したワーカーの記録を消す（以前に取得していたワーカーは更新できない）
+    @abstractmethod
+    def update(self, job_id: str, changes: Dict[str, Any],
+               remove_fields: Iterable[str] = (),
+               expected_status: Optional[str] = None,
+               expected_worker: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        ...
+
+    # 作成日時の新しい順にジョブを返す（生成結果は含めない）
+    # 戻り値は (ジョブのリスト, 次のページのカーソル or None)
+    @abstractmethod
+    def list(self, status: Optional[str] = None, limit: int = 20,
+             cursor: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        ...
+
+    # ジョブを削除する
+    @abstractmethod
+    def delete(self, job_id: str):
+        ...
+
+    # 指定した状態のジョブを作成日時の古い順に返す（生成結果は含めない）
+    @abstractmethod
+    def find_by_status(self, statuses: Iterable[str]) -> List[Dict[str, Any]]:
+        ...
+
+    # 指定した状態のジョブ数。queued_before=(待機の開始日時, ジョブID) を指定するとそれより前のものだけを数える
+    # priority / offline を指定した場合は、その優先度 / 実行方法のジョブだけを数える
+    @abstractmethod
+    def count_by_status(self, status: str, queued_before: Optional[Tuple[str, str]] = None,
+                        priority: Optional[str] = None, offline: Optional[bool] = None) -> int:
+        ...
+
+    # 待機中のジョブを原子的に取得して処理中にする（なければNone）
+    # 優先度の高いジョブ（interactive → batch）から、同じ優先度では待機を始めた順（queuedAt、なければ作成日時）に取得する
+    # offline を指定した場合は、その実行方法（バッチAPIを使うかどうか）のジョブのみを取得する
+    # 複数のワーカープロセスが同時に呼んでも、1件のジョブを取得できるのは1つのワーカーのみ
+    @abstractmethod
+    def claim_next(self, worker_id: str, offline: Optional[bool] = None) -> Optional[Dict[str, Any]]:
+        ...
+
+    # ワーカーが処理中のジョブの生存時刻を更新する
+    @abstractmethod
+    def heartbeat(self, worker_id: str):
+        ...
+
+    # 処理中のジョブのうち、生存時刻が heartbeat_before より古いもの（停止したワーカーのジョブ）を返す
+    # worker_id を指定した場合は、そのワーカーが処理中のジョブを全て返す
+    @abstractmethod
+    def find_orphaned(self, heartbeat_before: Optional[float] = None,
+                      worker_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        ...
+
+    # バッチ（複数のジョブをまとめたもの）を保存する
+    @abstractmethod
+    def create_batch(self, batch: Dict[str, Any]):
+        ...
+
+    # バッチを取得する（なければNone）
+    @abstractmethod
+    def get_batch(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    # バッチに含まれるジョブをバッチ内の順番で返す（生成結果は含めない）
+    @abstractmethod
+    def find_by_batch(self, batch_id: str) -> List[Dict[str, Any]]:
+        ...
+
+    def close(self):
+        pass
+
+
+def encode_cursor(created_at: str, job_id: str) -> str:
+    raw = json.dumps([created_at, job_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    try:
+        created_at, job_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return str(created_at), str(job_id)
+    except (ValueError, TypeError) as e:
+        raise InvalidCursorError(f"Invalid cursor: {cursor}") from e
+
+
+# SQLiteによるジョブストア（状態・作成日時にインデックスを張る）
+class SQLiteJobStore(JobStore):
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS jobs (
+        job_id TEXT PRIMARY KEY,
+        status TEXT NOT NULL,
+        created_at TEXT NOT NULL,
+        updated_at TEXT NOT NULL,
+        data TEXT NOT NULL,
+        result TEXT,
+        worker_id TEXT,
+        heartbeat_at REAL,
+        priority TEXT,
+        batch_id TEXT,
+        offline INTEGER,
+        queued_at TEXT
+    );
+    CREATE TABLE IF NOT EXISTS batches (
+        batch_id TEXT PRIMARY KEY,
+        created_at TEXT NOT NULL,
+        data TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_jobs_created ON jobs (created_at DESC, job_id DESC);
+    CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs (status, created_at DESC, job_id DESC);
+    """
+    # 列の追加（_migrate）の後に作成する索引
+    INDEXES = """
+    CREATE INDEX IF NOT EXISTS idx_jobs_batch ON jobs (batch_id) WHERE batch_id IS NOT NULL;
+    CREATE INDEX IF NOT EXISTS idx_jobs_status_queued ON jobs (status, queued_at, job_id);
+    """
+    # 優先度の順位（claim_next で小さいものから取得する。未設定は interactive として扱う）
+    PRIORITY_RANK = "CASE priority WHEN 'batch' THEN 1 ELSE 0 END"
+
+    def __init__(self, path: str):
+        self.path = os.path.abspath(path)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self.SCHEMA)
+        self._migrate()
+        self._conn.executescript(self.INDEXES)
+
+    # 以前のバージョンで作成されたテーブルに不足している列を追加する
+    def _migrate(self):
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        for name, column_type in (("worker_id", "TEXT"), ("heartbeat_at", "REAL"),
+                                  ("priority", "TEXT"), ("batch_id", "TEXT"), ("offline", "INTEGER"),
+                                  ("queued_at", "TEXT")):
+            if name not in columns:
+                self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {name} {column_type}")
+        if "offline" not in columns:
+            self._conn.execute(
+                "UPDATE jobs SET offline = COALESCE(json_extract(data, '$.originalData.offline'), 0)"
+            )
+        if "queued_at" not in columns:
+            self._conn.execute("UPDATE jobs SET queued_at = COALESCE(json_extract(data, '$.queuedAt'), created_at)")
+
+    def create(self, job: Dict[str, Any]):
+        job = dict(job)
+        result = job.pop("result", None)
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (job_id, status, created_at, updated_at, data, result, priority, batch_id, offline, "
+                "queued_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    job["jobId"],
+                    job["status"],
+                    job["createdAt"],
+                    datetime.now().isoformat(),
+                    json.dumps(job, ensure_ascii=False),
+                    json.dumps(result, ensure_ascii=False) if result is not None else None,
+                    job.get("priority", "interactive"),
+                    job.get("batchId"),
+                    int(bool(job.get("offline"))),
+                    job.get("queuedAt", job["createdAt"]),
+                ),
+            )
+
+    def get(self, job_id: str, include_result: bool = True) -> Optional[Dict[str, Any]]:
+        column = "data, result" if include_result else "data, NULL"
+        with self._lock:
+            row = self._conn.execute(f"SELECT {column} FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = json.loads(row[0])
+        if row[1] is not None:
+            job["result"] = json.loads(row[1])
+        return job
+
+    def update(self, job_id: str, changes: Dict[str, Any],
+               remove_fields: Iterable[str] = (),
+               expected_status: Optional[str] = None,
+               expected_worker: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        changes = dict(changes)
+        has_result = "result" in changes
+        result = changes.pop("result", None)
+        remove_fields = set(remove_fields)
+
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT status, data, worker_id FROM jobs WHERE job_id = ?", (job_id,)
+                ).fetchone()
+                if (row is None or (expected_status is not None and row[0] != expected_status)
+                        or (expected_worker is not None and row[2] != expected_worker)):
+                    self._conn.execute("ROLLBACK")
+                    return None
+
+                previous = json.loads(row[1])
+                job = {key: value for key, value in previous.items() if key not in remove_fields}
+                job.update(changes)
+
+                assignments = ["status = ?", "updated_at = ?", "data = ?"]
+                params: List[Any] = [job["status"], datetime.now().isoformat(), json.dumps(job, ensure_ascii=False)]
+                if has_result:
+                    assignments.append("result = ?")
+                    params.append(json.dumps(result, ensure_ascii=False) if result is not None else None)
+                elif "result" in remove_fields:
+                    assignments.append("result = NULL")
+                if job["status"] == "pending":
+                    assignments.append("worker_id = NULL")
+                if "queuedAt" in changes:
+                    assignments.append("queued_at = ?")
+                    params.append(changes["queuedAt"])
+
+                self._conn.execute(
+                    f"UPDATE jobs SET {', '.join(assignments)} WHERE job_id = ?",
+                    (*params, job_id),
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return previous
+
+    def list(self, status: Optional[str] = None, limit: int = 20,
+             cursor: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        conditions = []
+        params: List[Any] = []
+        if status is not None:
+            conditions.append("status = ?")
+            params.append(status)
+        if cursor is not None:
+            conditions.append("(created_at, job_id) < (?, ?)")
+            params.extend(decode_cursor(cursor))
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        # 次のページの有無を判定するため1件多く取得する
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT data, created_at, job_id FROM jobs {where} "
+                "ORDER BY created_at DESC, job_id DESC LIMIT ?",
+                (*params, limit + 1),
+            ).fetchall()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1][1], rows[-1][2])
+        return [json.loads(row[0]) for row in rows], next_cursor
+
+    def delete(self, job_id: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+
+    def find_by_status(self, statuses: Iterable[str]) -> List[Dict[str, Any]]:
+        statuses = list(statuses)
+        if not statuses:
+            return []
+        placeholders = ", ".join("?" for _ in statuses)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT data FROM jobs WHERE status IN ({placeholders}) ORDER BY created_at, job_id",
+                statuses,
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def count_by_status(self, status: str, queued_before: Optional[Tuple[str, str]] = None,
+                        priority: Optional[str] = None, offline: Optional[bool] = None) -> int:
+        query = "SELECT COUNT(*) FROM jobs WHERE status = ?"
+        params: List[Any] = [status]
+        if queued_before is not None:
+            query += " AND (queued_at, job_id) < (?, ?)"
+            params.extend(queued_before)
+        if priority is not None:
+            query += " AND COALESCE(priority, 'interactive') = ?"
+            params.append(priority)
+        if offline is not None:
+            query += " AND COALESCE(offline, 0) = ?"
+            params.append(int(offline))
+        with self._lock:
+            return self._conn.execute(query, params).fetchone()[0]
+
+    def claim_next(self, worker_id: str, offline: Optional[bool] = None) -> Optional[Dict[str, Any]]:
+        condition = "" if offline is None else f" AND COALESCE(offline, 0) = {int(offline)}"
+        with self._lock:
+            # BEGIN IMMEDIATE で書き込みロックを取得し、他のプロセスと同じジョブを取得しないようにする
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    f"SELECT job_id, data FROM jobs WHERE status = 'pending'{condition} "
+                    f"ORDER BY {self.PRIORITY_RANK}, queued_at, job_id LIMIT 1"
+                ).fetchone()
+                if row is None:
+                    self._conn.execute("ROLLBACK")
+                    return None
+
+                job = json.loads(row[1])
+                job["status"] = "processing"
+                now = time.time()
+                self._conn.execute(
+                    "UPDATE jobs SET status = 'processing', updated_at = ?, data = ?, worker_id = ?, heartbeat_at = ? "
+                    "WHERE job_id = ?",
+                    (datetime.now().isoformat(), json.dumps(job, ensure_ascii=False), worker_id, now, row[0]),
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return job
+
+    def heartbeat(self, worker_id: str):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET heartbeat_at = ? WHERE status = 'processing' AND worker_id = ?",
+                (time.time(), worker_id),
+            )
+
+    def find_orphaned(self, heartbeat_before: Optional[float] = None,
+                      worker_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        query = "SELECT data FROM jobs WHERE status = 'processing'"
+        params: List[Any] = []
+        if worker_id is not None:
+            query += " AND worker_id = ?"
+            params.append(worker_id)
+        if heartbeat_before is not None:
+            # 生存時刻のないジョブ（単一プロセス時代に中断されたもの）も対象にする
+            query += " AND (heartbeat_at IS NULL OR heartbeat_at < ?)"
+            params.append(heartbeat_before)
+        with self._lock:
+            rows = self._conn.execute(query + " ORDER BY created_at, job_id", params).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def create_batch(self, batch: Dict[str, Any]):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO batches (batch_id, created_at, data) VALUES (?, ?, ?)",
+                (batch["batchId"], batch["createdAt"], json.dumps(batch, ensure_ascii=False)),
+            )
+
+    def get_batch(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM batches WHERE batch_id = ?", (batch_id,)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def find_by_batch(self, batch_id: str) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT data FROM jobs WHERE batch_id = ? ORDER BY created_at, job_id", (batch_id,)
+            ).fetchall()
+        jobs = [json.loads(row[0]) for row in rows]
+        return sorted(jobs, key=lambda job: job.get("batchIndex", 0))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# 環境変数から設定を読み込んでジョブストアを作成する
+def create_job_store_from_env(jobs_dir: str) -> JobStore:
+    backend = os.environ.get("LP_JOB_STORE", "sqlite")
+    if backend == "sqlite":
+        path = os.environ.get("LP_JOB_STORE_PATH", os.path.join(jobs_dir, "jobs.db"))
+        return SQLiteJobStore(path)
+    raise ValueError(f"Unknown job store backend: {backend}")
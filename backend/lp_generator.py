@@ -1,65 +1,235 @@
 import os
-import google.generativeai as genai
+import asyncio
 import json
+import logging
 import re
-import ray
-from collections import defaultdict
-from PIL import Image
-from io import BytesIO
+import shutil
 import time
+from collections import defaultdict
 from dotenv import load_dotenv
+from workspace import JobWorkspace
+import providers
+from response_cache import SingleFlight, cache_bypass, create_response_cache_from_env, make_cache_key
+from image_fanout import create_image_fanout_from_env, save_gradient_placeholder
+from image_optimizer import create_image_optimizer_from_env, rewrite_image_references, variant_source_stem
+from image_library import create_image_library_from_env
+from placeholders import PlaceholderResolver, ensure_hero_background, extract_placeholders
+from context_compaction import summarize_css, summarize_html
+from wireframe_sections import build_page, clean_section_fragment, fill_page, max_placeholder_number, normalize_outline
+from wireframe_sections import renumber_placeholders, split_page
+from incremental import replace_html_text, sections_to_regenerate, stale_js_selectors, unstyled_classes
+from incremental import update_outline_text
+from rate_limiter import RatePermit, create_rate_limiter_from_env, estimate_tokens, record_token_usage, request_priority
+from provider_batch import create_provider_batcher_from_env, offline_batch
+from observability import configure_logging, provider_call, record_bytes_written, record_cache_lookup, traced_stage
 
 # 環境変数の読み込み
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 ######################################
 ## AIモデル選択
 ######################################
 
 ## geminiを使う場合
-from google import genai as genai_img
-from google.genai import types
-genai.configure(api_key=os.environ.get("GEMINI_API_KEY"))
+## （クライアントは providers で共有し、呼び出しごとに作成しない）
 generation_config = {
     "temperature": 1,
     "top_p": 0.95,
     "top_k": 64,
-    "max_output_tokens": 128000,
+    "max_output_tokens": 8192,
     "response_mime_type": "text/plain",
 }
 
+## Claudeの出力トークン数の上限
+CLAUDE_MAX_TOKENS = 8192
+
+## 画像生成のプロンプト作成（JSONで、プレースホルダーごとに fileName と prompt を返す）
+IMAGE_PROMPT_CONFIG = {
+    "temperature": 1,
+    "max_output_tokens": 4096,
+    "response_mime_type": "application/json",
+    "response_schema": {
+        "type": "ARRAY",
+        "items": {
+            "type": "OBJECT",
+            "properties": {
+                "fileName": {"type": "STRING"},
+                "prompt": {"type": "STRING"},
+            },
+            "required": ["fileName", "prompt"],
+        },
+    },
+}
+## 1回のプロンプト作成でまとめるプレースホルダーの数
+IMAGE_PROMPT_BATCH_SIZE = 8
+
+## ワイヤーフレームの作成方法（single: 1回の呼び出しでページ全体を作成 / sections: アウトラインを作成し、セクションごとに並行に作成）
+WIREFRAME_MODE = os.environ.get("LP_WIREFRAME_MODE", "single")
+## セクションごとに作成したアウトラインとHTMLを保存するファイル（ジョブディレクトリ内。部分的な再生成で使う）
+WIREFRAME_SECTIONS_FILE = "wireframe_sections.json"
+## セクションごとの作成の出力トークン数の上限
+WIREFRAME_SECTION_MAX_TOKENS = 4096
+## アウトラインの作成（JSONで、ページのタイトルとセクションの一覧を返す）
+WIREFRAME_OUTLINE_CONFIG = {
+    "temperature": 1,
+    "max_output_tokens": 2048,
+    "response_mime_type": "application/json",
+    "response_schema": {
+        "type": "OBJECT",
+        "properties": {
+            "title": {"type": "STRING"},
+            "siteName": {"type": "STRING"},
+            "copyright": {"type": "STRING"},
+            "sections": {
+                "type": "ARRAY",
+                "items": {
+                    "type": "OBJECT",
+                    "properties": {
+                        "id": {"type": "STRING"},
+                        "name": {"type": "STRING"},
+                        "content": {"type": "STRING"},
+                        "sources": {"type": "ARRAY", "items": {"type": "STRING"}},
+                    },
+                    "required": ["id", "name", "content"],
+                },
+            },
+        },
+        "required": ["title", "siteName", "sections"],
+    },
+}
+
+## 画像の適用方法（rule: プレースホルダーを生成した画像に割り当てるのみ / llm: Geminiでセクションごとの背景画像を追加）
+APPLY_IMAGE_MODE = os.environ.get("LP_APPLY_IMAGE_MODE", "rule")
+
+## 後段のエージェントに、全文の代わりにHTML / CSSの要約を渡す（入力トークンの削減。LP_CONTEXT_COMPACTION=0 で全文を渡す）
+CONTEXT_COMPACTION = os.environ.get("LP_CONTEXT_COMPACTION", "1") not in ("0", "false", "off")
+
+## 応答キャッシュ（同じモデル・プロンプト・設定の呼び出しは再実行しない）
+response_cache = create_response_cache_from_env()
+## 実行中の同じ呼び出しの重複排除（同時に投入された同じプロンプトは1回だけ実行する）
+single_flight = SingleFlight()
+## プロバイダー・モデルごとのレート制限（全ジョブの呼び出しが通る）
+rate_limiter = create_rate_limiter_from_env()
+## 画像生成の実行方式（既定はプロセス内の非同期実行、LP_IMAGE_FANOUT=ray でRayクラスター）
+image_fanout = create_image_fanout_from_env(rate_limiter)
+## 生成済みの画像のライブラリ（似たプロンプトの画像はImagenを呼び出さずに再利用する。LP_IMAGE_LIBRARY=0 で無効）
+image_library = create_image_library_from_env()
+## 生成画像の最適化（WebP / AVIF と srcset 用の縮小版。プロセスプールで実行）
+image_optimizer = create_image_optimizer_from_env()
+## プロバイダーのバッチAPIへの送信（offline のジョブのClaude呼び出しをまとめる）
+claude_batcher = create_provider_batcher_from_env()
+
 ## claudeを使う場合
-import anthropic
-client = anthropic.Anthropic(
-    api_key=os.environ.get("ANTHROPIC_API_KEY")
-)
-def claude(system_prompt, prompt):
-    message = client.messages.create(
-        # model = "claude-3-5-sonnet-20241022",
-        model = "claude-3-7-sonnet-20250219",
-        max_tokens = 8192,
-        temperature = 1,
-        system = system_prompt,
-        messages = [
-            {
-                "role": "user",
-                "content": [
-                    {
-                        "type": "text",
-                        "text": prompt
-                    }
-                ]
-            }
-        ]
+## on_text を渡すとストリーミングで受信したテキスト片が逐次通知される
+## context を渡すと、複数のエージェントで共通の入力（HTMLなど）としてシステムプロンプトの前に置く
+## （プロンプトキャッシュにより、同じ context の2回目以降の呼び出しは入力の読み込みが安くなる）
+async def claude(system_prompt, prompt, on_text=None, context=None, max_tokens=CLAUDE_MAX_TOKENS):
+    # model = "claude-3-5-sonnet-20241022",
+    cache_key = make_cache_key(
+        "claude",
+        model=providers.CLAUDE_MODEL,
+        system=system_prompt,
+        context=context,
+        prompt=prompt,
+        config={"max_tokens": max_tokens, "temperature": 1},
+    )
+    cached = await asyncio.to_thread(response_cache.get_text, cache_key)
+    if cached is not None:
+        logger.info("【キャッシュ済みのClaudeの応答を使用します】")
+        record_cache_lookup("claude", "hit")
+        if on_text is not None:
+            on_text(cached)
+        return cached
+    record_cache_lookup("claude", "miss")
+
+    ## 入力の概算と出力の上限を予約し、実際の使用量で精算する
+    reserved_tokens = estimate_tokens(system_prompt, context or "", prompt) + max_tokens
+
+    async def call():
+        if offline_batch.get():
+            ## バッチAPIはレート制限が別枠のため、使用量の集計のみ行う
+            permit = RatePermit("anthropic", providers.CLAUDE_MODEL, reserved_tokens, request_priority.get(), 0.0)
+            with provider_call(permit):
+                response = await claude_batcher.claude(
+                    system_prompt, prompt, max_tokens=max_tokens, on_usage=permit.record_usage,
+                    context=context,
+                )
+            record_token_usage(permit)
+        else:
+            async with rate_limiter.limit("anthropic", providers.CLAUDE_MODEL, reserved_tokens) as permit:
+                if on_text is not None:
+                    response = await providers.claude_stream(
+                        system_prompt, prompt, on_text=on_text,
+                        max_tokens=max_tokens, on_usage=permit.record_usage, context=context,
+                    )
+                else:
+                    response = await providers.claude_messages(
+                        system_prompt, prompt,
+                        max_tokens=max_tokens, on_usage=permit.record_usage, context=context,
+                    )
+        await asyncio.to_thread(response_cache.set_text, cache_key, response)
+        return response
+
+    ## キャッシュを参照しないリクエストは、実行中の同じ呼び出しにも相乗りしない
+    ## バッチAPIの呼び出しは完了まで時間がかかるため、同じ実行方法（offline かどうか）の呼び出しにのみ相乗りする
+    if cache_bypass.get():
+        response, leader = await call(), True
+    else:
+        flight_key = f"{cache_key}:offline" if offline_batch.get() else cache_key
+        response, leader = await single_flight.run(flight_key, call)
+        if not leader:
+            record_cache_lookup("claude", "shared")
+    ## ストリーミングしなかった場合（バッチAPI・他のジョブの呼び出しの結果）は全文をまとめて通知する
+    if on_text is not None and (offline_batch.get() or not leader):
+        on_text(response)
+    return response
+
+## geminiでテキストを生成する
+## config を渡すと generation_config の代わりに使う（JSON出力など）
+async def gemini(system_instruction, prompt, config=None):
+    config = config or generation_config
+    cache_key = make_cache_key(
+        "gemini",
+        model=providers.GEMINI_MODEL,
+        system=system_instruction,
+        prompt=prompt,
+        config=config,
     )
-    # print(message.content[0].text)
-    return message.content[0].text
+    cached = await asyncio.to_thread(response_cache.get_text, cache_key)
+    if cached is not None:
+        logger.info("【キャッシュ済みのGeminiの応答を使用します】")
+        record_cache_lookup("gemini", "hit")
+        return cached
+    record_cache_lookup("gemini", "miss")
+
+    reserved_tokens = estimate_tokens(system_instruction, prompt) + config["max_output_tokens"]
+
+    async def call():
+        async with rate_limiter.limit("google", providers.GEMINI_MODEL, reserved_tokens) as permit:
+            response = await providers.gemini_generate(
+                system_instruction, prompt, config, on_usage=permit.record_usage,
+            )
+        await asyncio.to_thread(response_cache.set_text, cache_key, response)
+        return response
+
+    if cache_bypass.get():
+        return await call()
+    response, leader = await single_flight.run(cache_key, call)
+    if not leader:
+        record_cache_lookup("gemini", "shared")
+    return response
 
 
 ######################################
 ## 補助関数
 ######################################
 
+## CSS / JS エージェントで共通の context（同じ文字列にしてプロンプトキャッシュを共有する）
+def html_context(html_data):
+    return f"**HTML**:\n{html_data}"
+
 def safe_json_loads(text):
     text = text.strip()
     if text.startswith("```"):
@@ -119,85 +289,125 @@ def extract_code_blocks_by_type(text):
 
     return html_code, css_code
 
-## ファイルに書き込む
-def save_to_file(html_content, file_name):
+## ファイルに書き込む（ワークスペース内の絶対パスに保存）
+def save_to_file(workspace, html_content, file_name):
     try:
-        with open(file_name, "w", encoding="utf-8") as f:
-            f.write(html_content)
-        print(f"{file_name}にコンテンツを保存しました。")
+        workspace.write_text(file_name, html_content)
+        logger.info(f"{workspace.path(file_name)}にコンテンツを保存しました。")
     except Exception as e:
-        print(html_content)
-        print(f"エラーが発生しました: {e}")
-
-## APIを使って画像生成するコード
-@ray.remote
-def generate_image_by_imagen3(prompt, file_name, aspect_ratio=None):
-    # APIクライアントの初期化
-    client = genai_img.Client(api_key=os.environ.get("GOOGLE_IMAGEN_API_KEY"))
-    
-    # ファイル名に基づいてアスペクト比を決定
-    if aspect_ratio is None:
-        if 'html' in file_name.lower():
-            aspect_ratio = '16:9'
-        elif 'css' in file_name.lower():
-            aspect_ratio = '16:9'
-        else:
-            aspect_ratio = '1:1'  # デフォルト値
-
-    # 生成設定
-    config = types.GenerateImagesConfig(
-        number_of_images=1,
+        logger.debug(html_content)
+        logger.error(f"エラーが発生しました: {e}")
+
+## ファイル名に基づいてアスペクト比を決定
+def decide_aspect_ratio(file_name):
+    if 'html' in file_name.lower():
+        return '16:9'
+    elif 'css' in file_name.lower():
+        return '16:9'
+    return '1:1'  # デフォルト値
+
+## 1枚の画像を生成してワークスペースに保存する（キャッシュがあれば再利用）
+## 戻り値は画像ごとの結果（status: generated / cached / reused / failed）
+## 失敗しても例外は送出しない（他の画像の生成を止めず、後で代替画像を割り当てる）
+async def generate_image(workspace, image_prompt, file_name):
+    aspect_ratio = decide_aspect_ratio(file_name)
+    cache_key = make_cache_key(
+        "imagen",
+        model=providers.IMAGEN_MODEL,
+        prompt=image_prompt,
         aspect_ratio=aspect_ratio,
-        personGeneration = "ALLOW_ADULT"
-    )
-    
-    # 画像生成
-    response = client.models.generate_images(
-        model='imagen-3.0-generate-002',
-        prompt=prompt,
-        config=config
     )
+    cached = await asyncio.to_thread(response_cache.get_bytes, cache_key)
+    if cached is not None:
+        logger.info(f"【キャッシュ済みの画像を使用します: {file_name}】")
+        record_cache_lookup("imagen", "hit")
+        await asyncio.to_thread(workspace.write_bytes, file_name, cached)
+        return {"fileName": file_name, "status": "cached", "aspectRatio": aspect_ratio}
+    record_cache_lookup("imagen", "miss")
+
+    ## 似たプロンプトで生成済みの画像があれば再利用する
+    if image_library is not None and not cache_bypass.get():
+        match = await asyncio.to_thread(image_library.find, image_prompt, aspect_ratio)
+        record_cache_lookup("image-library", "miss" if match is None else "hit")
+        if match is not None:
+            logger.info(f"【ライブラリの画像を再利用します: {file_name}（類似度 {match.similarity:.2f}: {match.prompt}）】")
+            await asyncio.to_thread(shutil.copyfile, match.path, workspace.path(file_name))
+            return {"fileName": file_name, "status": "reused", "aspectRatio": aspect_ratio,
+                    "similarity": round(match.similarity, 3)}
+
+    ## 生成した画像のパスを返す（同じ画像を生成中の他のジョブはそのファイルをコピーする）
+    async def call():
+        started = time.monotonic()
+        await image_fanout.generate(image_prompt, workspace.path(file_name), aspect_ratio)
+        elapsed = time.monotonic() - started
+        image_bytes = await asyncio.to_thread(workspace.read_bytes, file_name)
+        record_bytes_written("image", len(image_bytes))
+        await asyncio.to_thread(response_cache.set_bytes, cache_key, image_bytes)
+        if image_library is not None:
+            await asyncio.to_thread(image_library.add, image_prompt, aspect_ratio, workspace.path(file_name), elapsed)
+        return workspace.path(file_name)
 
-    # レスポンスのデバッグ情報を出力
-    print(f"Response type: {type(response)}")
-    print(f"Response dir: {dir(response)}")
-    
-    if hasattr(response, 'generated_images'):
-        print(f"Generated images count: {len(response.generated_images) if response.generated_images else 0}")
-        if response.generated_images:
-            print(f"First image type: {type(response.generated_images[0])}")
-            print(f"First image dir: {dir(response.generated_images[0])}")
-            
-            if hasattr(response.generated_images[0], 'image'):
-                print(f"Image object type: {type(response.generated_images[0].image)}")
-                print(f"Image object dir: {dir(response.generated_images[0].image)}")
-                if hasattr(response.generated_images[0].image, 'image_bytes'):
-                    image_bytes = response.generated_images[0].image.image_bytes
-                    print(f"Image bytes type: {type(image_bytes)}")
-                    print(f"Image bytes length: {len(image_bytes) if image_bytes else 'None'}")
-                    if image_bytes:
-                        print(f"First 50 bytes: {image_bytes[:50]}")
-    
-    # 画像の保存
-    image_bytes = response.generated_images[0].image.image_bytes
-    
-    # Base64エンコードされている場合はデコード
-    if isinstance(image_bytes, bytes) and image_bytes.startswith(b'iVBORw0KGgo'):
-        # Base64デコード
-        import base64
-        try:
-            decoded_bytes = base64.b64decode(image_bytes)
-            image = Image.open(BytesIO(decoded_bytes))
-        except Exception as e:
-            print(f"Base64デコードエラー: {e}")
-            # Base64デコードに失敗した場合、直接試す
-            image = Image.open(BytesIO(image_bytes))
-    else:
-        # バイナリデータとして直接処理
-        image = Image.open(BytesIO(image_bytes))
-    image.save(file_name)
-    print(f"画像を保存しました: {file_name}")
-    return file_name
+    try:
+        if cache_bypass.get():
+            await call()
+        else:
+            image_path, leader = await single_flight.run(cache_key, call)
+            if not leader and image_path != workspace.path(file_name):
+                logger.info(f"【生成中の同じ画像を使用します: {file_name}】")
+                record_cache_lookup("imagen", "shared")
+                await asyncio.to_thread(shutil.copyfile, image_path, workspace.path(file_name))
+                return {"fileName": file_name, "status": "cached", "aspectRatio": aspect_ratio}
+    except Exception as e:
+        logger.warning(f"画像の生成に失敗しました ({file_name}): {e!r}")
+        return {"fileName": file_name, "status": "failed", "aspectRatio": aspect_ratio, "error": repr(e)}
+
+    return {"fileName": file_name, "status": "generated", "aspectRatio": aspect_ratio}
+
+## 生成に失敗した画像に代替画像を割り当てる
+##   1. 同じジョブで生成できた、同じアスペクト比の画像
+##   2. プロンプトから決まる色のグラデーション画像
+async def apply_image_fallbacks(workspace, image_results, prompts):
+    succeeded = [result for result in image_results if result["status"] != "failed"]
+    for result, image_prompt in zip(image_results, prompts):
+        if result["status"] != "failed":
+            continue
+        similar = next((s for s in succeeded if s["aspectRatio"] == result["aspectRatio"]), None)
+        if similar is not None:
+            await asyncio.to_thread(
+                shutil.copyfile, workspace.path(similar["fileName"]), workspace.path(result["fileName"])
+            )
+            result.update({"status": "fallback", "fallback": "similar", "source": similar["fileName"]})
+        else:
+            await asyncio.to_thread(
+                save_gradient_placeholder, workspace.path(result["fileName"]), result["aspectRatio"], image_prompt
+            )
+            result.update({"status": "fallback", "fallback": "gradient"})
+        logger.info(f"代替画像を割り当てました: {result['fileName']} ({result['fallback']})")
+
+## 画像と、その最適化した画像（WebP / AVIF）を削除する
+def remove_images(workspace, file_names):
+    stems = {os.path.splitext(file_name)[0] for file_name in file_names}
+    for file_name in file_names:
+        workspace.remove(file_name)
+    for file_name in workspace.glob("placeholder_*"):
+        if variant_source_stem(file_name) in stems:
+            workspace.remove(file_name)
+    if file_names:
+        logger.info(f"参照されなくなった画像を削除しました: {list(file_names)}")
+
+## 画像を最適化し、作成した画像の一覧を結果に加える（variants）
+## 最適化に失敗した画像は元のPNGのまま使う
+async def optimize_images(workspace, image_results):
+    manifests = await asyncio.gather(
+        *(image_optimizer.optimize(workspace, result["fileName"]) for result in image_results),
+        return_exceptions=True,
+    )
+    for result, manifest in zip(image_results, manifests):
+        if isinstance(manifest, Exception):
+            logger.warning(f"画像の最適化に失敗しました ({result['fileName']}): {manifest!r}")
+        elif manifest is not None:
+            record_bytes_written("image-variant", sum(variant["bytes"] for variant in manifest["variants"]))
+            result.update({"bytes": manifest["bytes"], "width": manifest["width"], "variants": manifest["variants"]})
 
 
 ######################################
@@ -205,9 +415,19 @@ def generate_image_by_imagen3(prompt, file_name, aspect_ratio=None):
 ######################################
 
 ## ワイヤーフレーム作成エージェント
-def wireframe_generate_agent(section_idea):
-    print("\n===ワイヤーフレーム作成エージェント===")
-    print("【ClaudeでHTMLを作成しています．．．】")
+## LP_WIREFRAME_MODE=sections の場合は、アウトラインを作成してからセクションごとに並行に作成する
+## （アウトラインの作成に失敗した場合は、1回の呼び出しでページ全体を作成する）
+@traced_stage("wireframe")
+async def wireframe_generate_agent(workspace, section_idea, on_text=None):
+    logger.info("===ワイヤーフレーム作成エージェント===")
+    if WIREFRAME_MODE == "sections":
+        outline = await write_wireframe_outline(section_idea)
+        if outline is not None:
+            data = await generate_wireframe_sections(workspace, section_idea, outline, on_text=on_text)
+            save_to_file(workspace, data, "index.html")
+            return data
+
+    logger.info("【ClaudeでHTMLを作成しています．．．】")
     
 #     system_prompt = (
 # """あなたは、ランディングページ（LP）のワイヤーフレーム作成に特化したエージェントです。
@@ -259,19 +479,140 @@ LPの構成案が与えられます。
 *   `<body>`タグの最下部には、<script src="script.js"></script>を含めてください。
 """
     )
-    response = claude(system_prompt, str(section_idea))
+    response = await claude(system_prompt, str(section_idea), on_text=on_text)
     data = extract_html_code(response)
 
     ## htmlファイルとして保存
-    save_to_file(data, "index.html")
+    save_to_file(workspace, data, "index.html")
+
+    ## 部分的な再生成のため、最上位の <section> ごとに分けて保存する（<section> がなければ再生成では全体を作成し直す）
+    sections_data = split_page(data)
+    if sections_data is not None:
+        workspace.write_json(WIREFRAME_SECTIONS_FILE, sections_data)
+    else:
+        workspace.remove(WIREFRAME_SECTIONS_FILE)
 
     return data
 
+## ワイヤーフレームのアウトライン（ページのタイトルとセクションの一覧）を作成する（失敗した場合は None）
+async def write_wireframe_outline(section_idea):
+    logger.info("【Geminiでセクション構成を作成しています．．．】")
+    system_instruction = (
+        "あなたは、ランディングページ（LP）の構成案からセクション構成（アウトライン）を作成するエージェントです。"
+        "あなたには、LPの構成案が与えられます。"
+
+        "**出力**:"
+        "*   ページの上から順に、ヘッダー・フッターを除くセクションの一覧を出力してください。最初のセクションはヒーローセクションとし、id は hero としてください。"
+        "*   各セクションには、id（HTMLのidに使う英小文字）、name（日本語の名前）、content（そのセクションに載せる内容の要約）、"
+        "sources（そのセクションが基にする構成案の項目の番号。例：「④」）を含めてください。"
+        "*   title（ページのタイトル）、siteName（ヘッダーに表示するサービス名）、copyright（フッターに表示する著作権表示）を含めてください。"
+    )
+    try:
+        response_text = await gemini(system_instruction, str(section_idea), config=WIREFRAME_OUTLINE_CONFIG)
+        outline = normalize_outline(safe_json_loads(response_text))
+    except Exception as e:
+        logger.warning(f"セクション構成の作成に失敗しました。ページ全体を1回で作成します: {e!r}")
+        return None
+    logger.info(f"セクション構成: {[section['id'] for section in outline['sections']]}")
+    return outline
+
+## 1つのセクションのHTMLを作成する
+async def generate_wireframe_section(section_idea, outline, section):
+    system_prompt = (
+"""あなたは、ランディングページ（LP）の1つのセクションのHTMLを作成するエージェントです。
+
+**タスク:**
+
+LPの構成案とページ全体のセクション構成を基に、指定された1つのセクションのHTMLを作成してください。他のセクションは別に作成され、共通のヘッダー・フッターとともに1つのページにまとめられます。
+
+**入力:**
+
+LPの構成案、ページ全体のセクションの一覧、作成するセクション（id・名前・内容）が与えられます。
+
+**出力:**
+
+*   指定されたセクションの要素（<section id="(セクションのid)">〜</section>）のhtmlコードのみを出力としてください。<html>・<head>・<body>、ヘッダー・フッター、<script>は含めないでください。
+*   CSSやJavaScriptによるデザインコードはここでは含めず、後に追加することを想定してください。
+*   class名には、他のセクションと重ならないように、セクションのidを接頭辞として付けてください。
+*   画像を適度に使用して、デザインを向上させてください。（画像ファイル名はプレースホルダーにしてください。画像のアスペクト比は、'横16:縦9'想定です。形式は、必ず次のようにしてください。形式："placeholder_html_(番号).png"）ただし、ヒーローセクションだけは画像を入れてはいけません。
+*   アイコンは <i data-lucide="(アイコン名)"></i> の形式で使用できます。
+"""
+    )
+    prompt = (
+        f"**LPの構成案**:\n{section_idea}\n\n"
+        "**ページ全体のセクション**:\n"
+        + "\n".join(f"- {item['id']}: {item['name']}" for item in outline["sections"])
+        + f"\n\n**作成するセクション**:\nid: {section['id']}\n名前: {section['name']}\n内容: {section['content']}"
+    )
+    response = await claude(system_prompt, prompt, max_tokens=WIREFRAME_SECTION_MAX_TOKENS)
+    return clean_section_fragment(extract_html_code(response), section["id"])
+
+## セクションごとに並行にHTMLを作成し、共通の骨組み（head・ヘッダー・フッター）にまとめる
+## on_text にはセクションが完成した順にそのHTMLを通知する（並行に受信するテキスト片は混ざるため逐次には通知しない）
+## アウトラインとセクションごとのHTML（プレースホルダーの番号を振り直したもの）は wireframe_sections.json に保存する
+async def generate_wireframe_sections(workspace, section_idea, outline, on_text=None):
+    logger.info(f"【Claudeで{len(outline['sections'])}個のセクションのHTMLを並行に作成しています．．．】")
+
+    async def generate(section):
+        fragment = await generate_wireframe_section(section_idea, outline, section)
+        if on_text is not None:
+            on_text(f"{fragment}\n\n")
+        return fragment
+
+    fragments = renumber_placeholders(await asyncio.gather(*(generate(section) for section in outline["sections"])))
+    workspace.write_json(WIREFRAME_SECTIONS_FILE, {"outline": outline, "fragments": fragments})
+    return build_page(outline, fragments)
+
+## ワイヤーフレームの部分的な再生成（wireframe_sections.json を保存したジョブのみ）
+## 変更した項目（①〜⑥）を基にするセクションのみを作成し直し、他のセクションは前回のHTMLを使う
+## 1回で作成したページ（骨組みを保存したもの）は、その骨組みにセクションを組み込む
+## replacements（変更前の値 → 変更後の値）はヘッダー・フッターと前回のセクションの文字列を置き換える（サービス名など）
+## 作成し直したセクションの画像のプレースホルダーには、前回と重ならない番号を振る（前回の画像を取り違えない）
+## 戻り値は (ページ全体のHTML, 作成し直したセクションのHTMLの一覧)
+@traced_stage("wireframe")
+async def regenerate_wireframe_agent(workspace, section_idea, sections_data, changed_items, replacements, on_text=None):
+    logger.info("===ワイヤーフレーム作成エージェント（部分的な再生成）===")
+    outline = update_outline_text(sections_data["outline"], replacements)
+    shell = sections_data.get("shell")
+    if shell is not None:
+        shell = replace_html_text(shell, replacements)
+    previous = {
+        section["id"]: fragment for section, fragment in zip(outline["sections"], sections_data["fragments"])
+    }
+    previous = {section_id: replace_html_text(fragment, replacements) for section_id, fragment in previous.items()}
+
+    targets = [section for section in outline["sections"] if section["id"] in sections_to_regenerate(outline, changed_items)]
+    logger.info(f"【Claudeで{len(targets)}個のセクションのHTMLを作成し直しています．．．】 {[s['id'] for s in targets]}")
+
+    async def generate(section):
+        fragment = await generate_wireframe_section(section_idea, outline, section)
+        if on_text is not None:
+            on_text(f"{fragment}\n\n")
+        return fragment
+
+    regenerated = dict(zip(
+        (section["id"] for section in targets),
+        renumber_placeholders(
+            await asyncio.gather(*map(generate, targets)),
+            start=max_placeholder_number([*sections_data["fragments"], shell or ""]),
+        ),
+    ))
+    fragments = [regenerated.get(section["id"], previous[section["id"]]) for section in outline["sections"]]
+    if shell is not None:
+        workspace.write_json(WIREFRAME_SECTIONS_FILE, {"outline": outline, "fragments": fragments, "shell": shell})
+        data = fill_page(shell, outline, fragments)
+    else:
+        workspace.write_json(WIREFRAME_SECTIONS_FILE, {"outline": outline, "fragments": fragments})
+        data = build_page(outline, fragments)
+    save_to_file(workspace, data, "index.html")
+    return data, list(regenerated.values())
+
 ## デザイン提案エージェント（CSS）
-def design_css_agent(html_data):
-    print("\n===デザイン提案エージェント（CSS）===")
+@traced_stage("css")
+async def design_css_agent(workspace, html_data, on_text=None):
+    logger.info("===デザイン提案エージェント（CSS）===")
 
-    print("【ClaudeでCSSを作成しています．．．】")
+    logger.info("【ClaudeでCSSを作成しています．．．】")
     system_prompt = (
 """あなたは、HTMLで構築されたランディングページ（LP）にCSSでデザインを提案するエージェントです。
 
@@ -290,18 +631,63 @@ def design_css_agent(html_data):
 *   ヒーローセクションには、背景画像を適用してください。（画像ファイル名はプレースホルダーにしてください。形式："placeholder_css_(番号).png"）画像上のテキストの可読性に注意して、テキストに影を加えたり、画像上に暗いオーバーレイを入れたりと、工夫してください。
 """    
     )
-    response = claude(system_prompt, html_data)
+    ## HTMLは JS エージェントと共通の context として渡す（プロンプトキャッシュで2回目の読み込みを安くする）
+    response = await claude(
+        system_prompt, "上記のHTMLに対するCSSコードを出力してください。", on_text=on_text, context=html_context(html_data),
+    )
     data = extract_css_code(response)
 
+    ## ヒーローセクションに背景画像がなければ追加（後の画像生成で生成される）
+    data = ensure_hero_background(html_data, data)
+
     ## cssファイルとして保存
-    save_to_file(data, "style.css")
+    save_to_file(workspace, data, "style.css")
 
     return data
 
+## CSSの部分的な再生成
+## 前回のCSSを残し、作成し直したセクションのうちスタイルのないclassの規則のみをClaudeで追加する
+@traced_stage("css")
+async def update_css_agent(workspace, html_data, css_data, fragments, on_text=None):
+    logger.info("===デザイン提案エージェント（CSS・部分的な再生成）===")
+    missing = unstyled_classes("\n".join(fragments), css_data)
+    if missing:
+        logger.info(f"【Claudeで作成し直したセクションのCSSを追加しています．．．】 {missing}")
+        system_prompt = (
+"""あなたは、ランディングページ（LP）の既存のCSSに、新しく作成したセクションのスタイルを追加するエージェントです。
+
+**タスク:**
+
+既存のCSSのデザイン（色・フォント・余白・アニメーション）に合わせて、新しく作成したセクションのうち、スタイルのないclassの規則を追加してください。
+
+**入力:**
+
+*   既存のCSSコード、新しく作成したセクションのHTML、スタイルのないclassの一覧が与えられます。
+
+**出力:**
+
+*   追加するCSSの規則のみを出力してください。既存の規則や余分な説明文を含めないでください。
+"""
+        )
+        prompt = (
+            f"**既存のCSS**:\n{css_data}\n\n"
+            "**新しく作成したセクションのHTML**:\n" + "\n\n".join(fragments)
+            + "\n\n**スタイルのないclass**:\n" + ", ".join(missing)
+        )
+        response = await claude(system_prompt, prompt, on_text=on_text, max_tokens=WIREFRAME_SECTION_MAX_TOKENS)
+        css_data = f"{css_data.rstrip()}\n\n/* 作成し直したセクション */\n{extract_css_code(response)}\n"
+    else:
+        logger.info("前回のCSSをそのまま使用します")
+
+    css_data = ensure_hero_background(html_data, css_data)
+    save_to_file(workspace, css_data, "style.css")
+    return css_data
+
 ## デザイン提案エージェント（JS）
-def design_js_agent(html_data, css_data):
-    print("\n===デザイン提案エージェント（JS）===")
-    print("【ClaudeでJSを作成しています．．．】")
+@traced_stage("js")
+async def design_js_agent(workspace, html_data, css_data, on_text=None):
+    logger.info("===デザイン提案エージェント（JS）===")
+    logger.info("【ClaudeでJSを作成しています．．．】")
     system_prompt = (
 """あなたは、HTMLで構築されたランディングページ（LP）にJavaScriptを用いて動的なデザイン要素を追加するエージェントです。
 
@@ -311,7 +697,7 @@ def design_js_agent(html_data, css_data):
 
 **入力:**
 
-*   セクション構成が既に構築されたHTMLコードと、CSSコードが与えられます。
+*   セクション構成が既に構築されたHTMLコードと、CSSコード（またはその要約：セレクター、メディアクエリ、アニメーション、JavaScriptで付け外しする状態のclass）が与えられます。
 
 **出力:**
 
@@ -319,106 +705,140 @@ def design_js_agent(html_data, css_data):
 *   デザイン性を重視して、ユーザーエクスペリエンスの向上を目指してください。"""
 
     )
+    ## JavaScriptに必要なのはセレクターと状態のclassのため、既定ではCSSの要約を渡す
     prompt = (
-        "**HTML**:"
-        f"{html_data}"
-        ""
-        "**CSS**:"
-        f"{css_data}"
+        "**CSS**:\n"
+        f"{summarize_css(css_data, html_data) if CONTEXT_COMPACTION else css_data}"
     )
-    response = claude(system_prompt, prompt)
+    response = await claude(system_prompt, prompt, on_text=on_text, context=html_context(html_data))
     data = extract_js_code(response)
 
     ## cssファイルとして保存
-    save_to_file(data, "script.js")
+    save_to_file(workspace, data, "script.js")
 
     return data
 
-## 画像を作成するエージェント
-def image_generate_agent(html_data, css_data):
-    print("\n===画像を作成するエージェント===")
-    
-    ## まずは必要な画像の情報を取得する
-    model = genai.GenerativeModel(
-        model_name = "gemini-2.0-flash",
-        generation_config = generation_config,
-        system_instruction = (
-            "あなたは、画像生成のプロンプトを作成するエージェントです。"
-            "あなたには、ランディングページのHTMLコード及びCSSコードが与えられます。"
-
-            "**出力**:"
-            "HTMLコード及びCSSコードの中から、画像のプレースホルダーを検索してください。"
-            "また、各画像に対して、その画像を生成AIで生成するためのプロンプトを英語で考えてください。文字の入るような画像は避けてください。（プロンプト内で、「子供」を連想させるフレーズは使わないでください。）"
-            "出力形式は、厳密なJSON形式で、キーをプレースホルダー名、バリューをプロンプトにしてください。"
-        )
+## JSの部分的な再生成
+## 前回のJavaScriptが参照するclass / id がHTMLからなくなった場合のみ作成し直し、それ以外は前回のものを使う
+async def update_js_agent(workspace, html_data, css_data, previous_html, previous_js, on_text=None):
+    stale = stale_js_selectors(previous_js, previous_html, html_data) if previous_js is not None else None
+    if stale is None or stale:
+        logger.info(f"JavaScriptを作成し直します（HTMLからなくなったセレクター: {stale}）")
+        return await design_js_agent(workspace, html_data, css_data, on_text=on_text)
+    logger.info("前回のJavaScriptをそのまま使用します")
+    save_to_file(workspace, previous_js, "script.js")
+    return previous_js
+
+## 画像生成のプロンプトを作成する（プレースホルダーと周辺のテキストのみを渡し、JSONで受け取る）
+## 戻り値は ファイル名 → プロンプト。応答に含まれなかった画像は周辺のテキストから決まるプロンプトを使う
+async def write_image_prompts(placeholders):
+    system_instruction = (
+        "あなたは、画像生成のプロンプトを作成するエージェントです。"
+        "あなたには、ランディングページの画像プレースホルダーの一覧（ファイル名と、画像が置かれる場所の周辺のテキスト）が与えられます。"
+
+        "**出力**:"
+        "各画像に対して、その画像を生成AIで生成するためのプロンプトを英語で考えてください。文字の入るような画像は避けてください。（プロンプト内で、「子供」を連想させるフレーズは使わないでください。）"
+        "全てのファイル名について、fileName と prompt を出力してください。"
+    )
+    prompt = json.dumps(
+        [{"fileName": p["fileName"], "context": p["context"]} for p in placeholders], ensure_ascii=False, indent=1
     )
-    
-    response = model.generate_content(str(f"""
-```html
-{html_data}
-```
-```css
-{css_data}
-```
-    """))
-    image_information_json = safe_json_loads(response.text)
-    print(image_information_json)
-
-    ## プレースホルダーのファイル名とプロンプトをそれぞれリストにまとめる
-    file_name_data = list(image_information_json.keys())
-    prompt_data = list(image_information_json.values())
-    print(f"生成する画像ファイル: {file_name_data}")
-    print(f"使用するプロンプト: {prompt_data}")
-
-    generated_files = []
-    ## リストの順番で画像生成
     try:
-        if not ray.is_initialized():
-            ray.init()
-        
-        image_tasks = [
-            generate_image_by_imagen3.remote(image_prompt, file_name)
-            for image_prompt, file_name in zip(prompt_data, file_name_data)
-        ]
-        
-        generated_files = ray.get(image_tasks)
-        print(f"生成された画像ファイル: {generated_files}")
-        time.sleep(0.5)
-
+        response_text = await gemini(system_instruction, prompt, config=IMAGE_PROMPT_CONFIG)
+        prompts = {item["fileName"]: item["prompt"] for item in safe_json_loads(response_text)}
     except Exception as e:
-        print(f"画像生成タスクの作成中にエラーが発生しました: {e}")
-    
-    return generated_files
+        logger.warning(f"画像のプロンプトの作成に失敗しました: {e!r}")
+        prompts = {}
+
+    return {
+        p["fileName"]: prompts.get(p["fileName"])
+        or f"A high-quality professional photograph for a landing page, without any text. Theme: {p['context']}"
+        for p in placeholders
+    }
+
+## 画像を作成するエージェント
+## プレースホルダーはHTML・CSSから直接抽出し、プロンプトは IMAGE_PROMPT_BATCH_SIZE 件ずつ作成する
+## （プロンプトができたまとまりから順に画像の生成を始める）
+## reuse（前回の画像の生成結果）を渡すと、参照され続けている画像は生成せずに再利用し（carriedOver を付ける）、参照されなくなった画像は削除する
+## （代替画像を割り当てた画像は生成し直す）
+@traced_stage("image")
+async def image_generate_agent(workspace, html_data, css_data, reuse=None):
+    logger.info("===画像を作成するエージェント===")
+
+    ## 必要な画像（プレースホルダー）と周辺のテキストを取得する
+    placeholders = extract_placeholders(html_data, css_data)
+    reusable = {
+        result["fileName"]: result for result in reuse or []
+        if isinstance(result, dict) and result.get("status") != "fallback" and workspace.exists(result["fileName"])
+    }
+    reused = [{**reusable[p["fileName"]], "carriedOver": True} for p in placeholders if p["fileName"] in reusable]
+    if reuse is not None:
+        referenced = {p["fileName"] for p in placeholders}
+        remove_images(workspace, [
+            result["fileName"] for result in reuse if isinstance(result, dict) and result["fileName"] not in referenced
+        ])
+        logger.info(f"再利用する画像ファイル: {[r['fileName'] for r in reused]}")
+    placeholders = [p for p in placeholders if p["fileName"] not in reusable]
+    logger.info(f"生成する画像ファイル: {[p['fileName'] for p in placeholders]}")
+
+    ## プロンプトを作成し、できたものから全ての画像を並行に生成（1枚の失敗・遅延が他の画像に影響しない）
+    async def generate_batch(batch):
+        prompts = await write_image_prompts(batch)
+        logger.info(f"使用するプロンプト: {prompts}")
+        results = await asyncio.gather(
+            *(generate_image(workspace, prompts[p["fileName"]], p["fileName"]) for p in batch)
+        )
+        return list(zip(results, prompts.values()))
+
+    batches = [
+        placeholders[i:i + IMAGE_PROMPT_BATCH_SIZE] for i in range(0, len(placeholders), IMAGE_PROMPT_BATCH_SIZE)
+    ]
+    generated = [item for batch in await asyncio.gather(*map(generate_batch, batches)) for item in batch]
+    image_results = [result for result, _ in generated]
+    prompt_data = [image_prompt for _, image_prompt in generated]
+
+    ## 失敗した画像は代替画像で埋める
+    await apply_image_fallbacks(workspace, image_results, prompt_data)
+    logger.info(f"画像の生成結果: {[(r['fileName'], r['status']) for r in image_results]}")
+
+    ## WebP / AVIF・レスポンシブ用の縮小版を作成（画像ごとに並行）
+    await optimize_images(workspace, image_results)
+
+    return reused + image_results
 
 ## 画像を適用するエージェント
-def apply_image(html_data, css_data):
-    print("\n===画像を適用するエージェント===")
-    print("【Geminiでコードを修正中です．．．】")
-
-    # model = genai.GenerativeModel(
-    #     model_name = "gemini-2.0-flash",
-    #     generation_config = generation_config,
-    #     system_instruction = (
-    #         "あなたは、HTMLとCSSに画像を適用するエージェントです。"
-    #         "あなたには、htmlコードとcssコードが与えられます。"
-
-    #         "**出力**:"
-    #         """*   画像は'background-image: url(${imageBase64})'の形式で挿入されることを想定し、htmlコードとcssコードを修正してください。"""
-    #         "*   出力は、入力のコードを修正したhtmlコード全文、cssコード全文としてください。"
-    #         "*   CSSでは、background-imageのURLを'${imageBase64}'というプレースホルダーで指定してください。これは後でJavaScriptによって実際の画像データに置き換えられます。"
-
-    #         "**注意点**:"
-    #         "*   変更はヒーローセクションに限定してください。他のセクションには手を加えないでください。"
-    #         "*   画像上のテキストの可読性に注意して、テキストに影を加えたり、画像上に暗いオーバーレイを入れたりと、工夫してください。"
-    #         "*   画像のアスペクト比は16:9の想定です。コンテナーサイズは画像の高さに合わせて変更してください（800pxほど）。"
-    #     )
-    # )
-    model = genai.GenerativeModel(
-        model_name = "gemini-2.0-flash",
-        generation_config = generation_config,
+## 既定（LP_APPLY_IMAGE_MODE=rule）はHTML・CSSのプレースホルダーを生成した画像に割り当てるのみで、モデルを呼び出さない
+## （ヒーローセクションの背景画像は design_css_agent で規則に従って追加済み）
+## llm の場合は、Geminiでセクションごとの背景画像を追加してから割り当てる
+@traced_stage("apply-image")
+async def apply_image(workspace, html_data, css_data, image_results):
+    logger.info("===画像を適用するエージェント===")
+    css_code = css_data
+
+    if APPLY_IMAGE_MODE == "llm":
+        logger.info("【Geminiでコードを修正中です．．．】")
+
+        # model = genai.GenerativeModel(
+        #     model_name = "gemini-2.0-flash",
+        #     generation_config = generation_config,
+        #     system_instruction = (
+        #         "あなたは、HTMLとCSSに画像を適用するエージェントです。"
+        #         "あなたには、htmlコードとcssコードが与えられます。"
+
+        #         "**出力**:"
+        #         """*   画像は'background-image: url(${imageBase64})'の形式で挿入されることを想定し、htmlコードとcssコードを修正してください。"""
+        #         "*   出力は、入力のコードを修正したhtmlコード全文、cssコード全文としてください。"
+        #         "*   CSSでは、background-imageのURLを'${imageBase64}'というプレースホルダーで指定してください。これは後でJavaScriptによって実際の画像データに置き換えられます。"
+
+        #         "**注意点**:"
+        #         "*   変更はヒーローセクションに限定してください。他のセクションには手を加えないでください。"
+        #         "*   画像上のテキストの可読性に注意して、テキストに影を加えたり、画像上に暗いオーバーレイを入れたりと、工夫してください。"
+        #         "*   画像のアスペクト比は16:9の想定です。コンテナーサイズは画像の高さに合わせて変更してください（800pxほど）。"
+        #     )
+        # )
         system_instruction = (
             "あなたは、HTMLとCSSに画像を適用するエージェントです。"
-            "あなたには、htmlコードとcssコードが与えられます。"
+            "あなたには、htmlコード（またはセクションごとの構造の要約）とcssコードが与えられます。"
 
             "**出力**:"
             "*   画像は'background-image: url('placeholder_css_[番号].jpg')'の形式で挿入されることを想定し、cssコードを修正してください。"
@@ -430,82 +850,82 @@ def apply_image(html_data, css_data):
             "*   画像上のテキストの可読性に注意して、テキストに影を加えたり、画像上に暗いオーバーレイを入れたりと、工夫してください。"
             "*   画像のアスペクト比は16:9の想定です。コンテナーサイズは画像の高さに合わせて変更してください（800pxほど）。"
         )
-    )
-    prompt = (
-        "**HTML**:"
-        f"{html_data}"
+        ## 修正するのはCSSのみのため、既定ではHTMLはセクションの構造の要約を渡す
+        prompt = (
+            "**HTML**:"
+            f"{summarize_html(html_data) if CONTEXT_COMPACTION else html_data}"
         
-        "**CSS**:"
-        f"{css_data}"
-    )
-    response = model.generate_content(prompt)
-    # save_to_file(response.text, "result.txt")
+            "**CSS**:"
+            f"{css_data}"
+        )
+        response_text = await gemini(system_instruction, prompt)
+        # save_to_file(workspace, response_text, "result.txt")
 
-    ## responseをhtmlコードとcssコードに分割
-    html_code = extract_code_blocks_by_type(response.text)[0]
-    css_code = extract_code_blocks_by_type(response.text)[1]
+        ## responseからcssコードを取り出す
+        css_code = extract_code_blocks_by_type(response_text)[1] or css_data
+
+    ## プレースホルダーを、実際に生成された画像ファイル（ワークスペースからの相対名）に割り当てる
+    resolver = PlaceholderResolver(
+        result["fileName"] for result in image_results if isinstance(result, dict)
+    )
+    html_code, html_bindings = resolver.bind(html_data)
+    updated_css, css_bindings = resolver.bind(css_code)
+    logger.info(f"画像の割り当て: {html_bindings | css_bindings}")
 
     ## ファイル保存
-    # save_to_file(html_code, "index.html")
-    
-    # 画像パスを修正: placeholder_css_*.jpg -> placeholder_html_*.png
-    # 実際に生成されたファイルに合わせて修正
-    import glob
-    import re
-    
-    # 生成されたPNGファイルのリストを取得
-    png_files = glob.glob("placeholder_*.png")
-    print(f"生成されたPNGファイル: {png_files}")
-    
-    # CSSの中のJPG参照をPNG参照に置換
-    updated_css = css_code
-    
-    # 一番最初のPNGファイルをフォールバック用画像として使用
-    if png_files:
-        fallback_image = png_files[0]
-        print(f"フォールバック画像として使用: {fallback_image}")
-        
-        # placeholder_css_*.jpg の参照を存在するPNGファイルに置換
-        jpg_pattern = r"placeholder_css_\d+\.jpg"
-        updated_css = re.sub(jpg_pattern, fallback_image, updated_css)
-        
-        # 一般的なJPG参照もPNGに置換
-        jpg_pattern2 = r"placeholder_.*\.jpg"
-        updated_css = re.sub(jpg_pattern2, fallback_image, updated_css)
-        
-        print("CSS内の画像参照を修正しました")
-    
-    save_to_file(updated_css, "style.css")
+    if html_code != html_data:
+        save_to_file(workspace, html_code, "index.html")
+    save_to_file(workspace, updated_css, "style.css")
 
     return html_code, updated_css
 
+## 成果物の画像参照を最適化した画像に書き換える（srcset / image-set）
+## 全ての段階が完了した後に実行する（script.js も対象にするため）
+@traced_stage("responsive-images")
+async def apply_responsive_images(workspace, image_results):
+    manifests = [
+        {"fileName": result["fileName"], "width": result["width"], "variants": result["variants"]}
+        for result in image_results
+        if isinstance(result, dict) and result.get("variants")
+    ]
+    rewritten = await asyncio.to_thread(rewrite_image_references, workspace, manifests)
+    if rewritten:
+        logger.info(f"画像の参照を最適化した画像に書き換えました: {rewritten}")
+    return rewritten
+
 
 ######################################
 ## メイン
 ######################################
 
-def main(section_idea):
+async def main(section_idea, output_dir="."):
+    ## 出力先のワークスペース
+    workspace = JobWorkspace(output_dir)
+
     ## ワイヤーフレーム作成エージェントに接続
-    html_data = wireframe_generate_agent(section_idea)
+    html_data = await wireframe_generate_agent(workspace, section_idea)
 
     ## デザインエージェントに接続（CSS）
-    css_data = design_css_agent(html_data)
+    css_data = await design_css_agent(workspace, html_data)
 
     ## デザインエージェントに接続（JS）
-    # design_js_agent(html_data, css_data)
+    # await design_js_agent(workspace, html_data, css_data)
 
     ## 画像生成エージェントに接続
-    generated_images = image_generate_agent(html_data, css_data)
-    print(f"生成された画像: {generated_images}")
+    generated_images = await image_generate_agent(workspace, html_data, css_data)
+    logger.info(f"生成された画像: {generated_images}")
 
     ## 画像適用エージェントに接続
-    # apply_image(html_data, css_data)
+    # await apply_image(workspace, html_data, css_data, generated_images)
+
+    ## 画像参照を最適化した画像に書き換え
+    await apply_responsive_images(workspace, generated_images)
 
-    ## rayを使用している場合は終了
-    if ray.is_initialized():
-        ray.shutdown()
+    await image_fanout.close()
+    image_optimizer.close()
+    await providers.aclose()
 
-    print("\n【完了しました！　動作を終了します。】")
+    logger.info("【完了しました！　動作を終了します。】")
 
 
 if __name__ == "__main__":
@@ -524,4 +944,5 @@ LP構成
 
 提供：株式会社アブソリュート"""
 
-    main(section_idea)
\ No newline at end of file
+    configure_logging()
+    asyncio.run(main(section_idea))
\ No newline at end of file
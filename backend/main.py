@@ -3,25 +3,91 @@ import asyncio
 import uuid
 import json
 import time
-import base64
+import mimetypes
+import email.utils
+import itertools
+import logging
+import tempfile
+from contextlib import asynccontextmanager
 from datetime import datetime
-from typing import Dict, List, Optional, Any
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from typing import Dict, Iterable, List, Literal, Optional, Any
+from fastapi import FastAPI, HTTPException, Query, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.responses import JSONResponse, FileResponse, Response, StreamingResponse
 from pydantic import BaseModel
-import shutil
 
 # もとのPythonスクリプトから関数をインポート
 from lp_generator import (
     wireframe_generate_agent,
+    regenerate_wireframe_agent,
     design_css_agent,
+    update_css_agent,
     design_js_agent,
+    update_js_agent,
     image_generate_agent,
-    apply_image
+    remove_images,
+    apply_image,
+    apply_responsive_images,
+    response_cache,
+    single_flight,
+    rate_limiter,
+    image_fanout,
+    image_library,
+    image_optimizer,
+    claude_batcher,
+    WIREFRAME_SECTIONS_FILE,
 )
+from response_cache import cache_bypass
+from provider_batch import offline_batch
+from rate_limiter import request_priority, token_usage
+from workspace import JobWorkspace
+from zip_stream import iter_zip, zip_etag
+from image_optimizer import SOURCE_EXTENSIONS, variant_source_stem
+import providers
+from job_executor import create_job_executor_from_env
+from job_dispatcher import create_job_dispatcher_from_env
+from job_events import TERMINAL_EVENTS, create_job_event_broker_from_env, format_sse
+from pipeline import PipelineScheduler, Stage
+from job_store import InvalidCursorError, JobOwnershipLostError, create_job_store_from_env
+from observability import (
+    configure_logging,
+    configure_tracing,
+    job_span,
+    prepare_multiprocess_metrics,
+    record_job_transition,
+    render_metrics,
+    shutdown_metrics,
+)
+
+# ログとトレースの出力先（ワーカープロセスごとに設定する）
+configure_logging()
+configure_tracing()
+logger = logging.getLogger(__name__)
+
+# ジョブ実行エグゼキューター（このプロセスの同時実行数を制限）
+job_executor = create_job_executor_from_env()
+# offline のジョブ（Claudeの呼び出しをバッチAPIで行うもの）は別枠で実行する
+# 結果を待つ間も実行枠を使い続けるため、通常のジョブの枠を使わず、多くのジョブの呼び出しを1つのバッチに集められるようにする
+offline_job_executor = create_job_executor_from_env(offline=True)
+# SSE / WebSocket のキープアライブ間隔（秒）
+EVENT_KEEPALIVE_INTERVAL = 15
 
-app = FastAPI(title="LP Generator API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await job_dispatcher.start()
+    yield
+    await job_dispatcher.shutdown()
+    await image_fanout.close()
+    image_optimizer.close()
+    if image_library is not None:
+        image_library.close()
+    await claude_batcher.close()
+    await providers.aclose()
+    job_events.close()
+    job_store.close()
+    shutdown_metrics()
+
+app = FastAPI(title="LP Generator API", lifespan=lifespan)
 
 # CORS設定
 app.add_middleware(
@@ -40,6 +106,32 @@ class LPGenerationRequest(BaseModel):
     features: str
     testimonials: str
     companyName: str
+    # Trueの場合は応答キャッシュを使わずに新しく生成する
+    noCache: bool = False
+    # レート制限での優先度（interactive: 画面からの生成、batch: まとめて行う生成）
+    priority: Literal["interactive", "batch"] = "interactive"
+    # Trueの場合はClaudeの呼び出しをプロバイダーのバッチAPIで行う（安価だが完了まで時間がかかる）
+    offline: bool = False
+
+# 部分的な再生成のリクエスト（変更する項目のみを指定する）
+class LPRegenerationRequest(BaseModel):
+    serviceName: Optional[str] = None
+    serviceType: Optional[str] = None
+    targetAudience: Optional[str] = None
+    features: Optional[str] = None
+    testimonials: Optional[str] = None
+    companyName: Optional[str] = None
+
+# バッチ生成のリクエスト
+#   - requests: 生成するリクエストの一覧
+#   - base + variations: base の項目を variations の値の全ての組み合わせで置き換えたリクエスト
+#     （例: {"serviceName": ["A", "B"], "targetAudience": ["学生", "社会人"]} → 4件）
+class LPBatchRequest(BaseModel):
+    requests: List[LPGenerationRequest] = []
+    base: Optional[LPGenerationRequest] = None
+    variations: Dict[str, List[str]] = {}
+    # Trueの場合は全てのジョブのClaudeの呼び出しをプロバイダーのバッチAPIで行う
+    offline: bool = False
 
 class GenerationStep(BaseModel):
     id: str
@@ -57,232 +149,48 @@ class JobStatus(BaseModel):
     error: Optional[str] = None
     result: Optional[Dict[str, Any]] = None
 
-# ジョブの状態を保存する辞書
-jobs = {}
-
-# ジョブディレクトリの準備
-os.makedirs("jobs", exist_ok=True)
-
-# セクションアイデアをフォーマットする関数
-def format_section_idea(data: LPGenerationRequest) -> str:
-    return f"""①：{data.serviceName}
-
-②：{data.serviceType}
+# ストリーミング進捗の更新間隔（秒）
+STREAM_UPDATE_INTERVAL = 0.25
+# 各ステップの想定出力トークン数（進捗率の計算に使用）
+EXPECTED_STEP_TOKENS = {
+    "wireframe": 5000,
+    "css": 4000,
+    "js": 2500,
+}
+# 受信した文字数からトークン数を概算する係数
+CHARS_PER_TOKEN = 3
 
-③：{data.targetAudience}
+# 部分的な再生成の元にする前回の成果物（段階ごとのチェックポイントとセクションごとのHTML）を保存するファイル名
+REGENERATION_BASE_FILE = "regeneration_base.json"
 
-④：{data.features}
+# ストリーミング中の生成途中の成果物を保存するファイル名（ジョブディレクトリ内）
+PARTIAL_FILE = "partial.json"
 
-⑤：{data.testimonials}
+# ジョブディレクトリの準備（カレントディレクトリに依存しないよう絶対パスで扱う）
+# 複数のワーカープロセス（や複数のホスト）で共有するディレクトリを LP_JOBS_DIR で指定できる
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+JOBS_DIR = os.path.abspath(os.environ.get("LP_JOBS_DIR", os.path.join(BASE_DIR, "jobs")))
+os.makedirs(JOBS_DIR, exist_ok=True)
 
-⑥：{data.companyName}"""
+# ジョブの状態を保存するストア（既定はSQLite。状態・作成日時で索引付け）
+# ジョブの状態・イベント・成果物は全てワーカープロセス間で共有されるため、
+# どのワーカーでもどのジョブの問い合わせにも応答でき、待機中のジョブを実行できる
+job_store = create_job_store_from_env(JOBS_DIR)
+# ジョブイベントの配信（SSE / WebSocket）
+job_events = create_job_event_broker_from_env(JOBS_DIR)
 
-# ジョブの状態を更新する関数
-def update_job_status(job_id: str, status: str, progress: float, current_step: str, 
-                      steps: List[GenerationStep], error: Optional[str] = None, 
-                      result: Optional[Dict[str, Any]] = None):
-    if job_id in jobs:
-        jobs[job_id].update({
-            "status": status,
-            "progress": progress,
-            "currentStep": current_step,
-            "steps": [step.dict() for step in steps],
-        })
-        
-        if error:
-            jobs[job_id]["error"] = error
-            
-        if result:
-            jobs[job_id]["result"] = result
-            
-        # ジョブ状態をファイルに保存
-        job_dir = f"jobs/{job_id}"
-        os.makedirs(job_dir, exist_ok=True)
-        
-        with open(f"{job_dir}/status.json", "w") as f:
-            json.dump(jobs[job_id], f)
+# バッチ生成で置き換えられる項目
+BATCH_VARIABLE_FIELDS = ("serviceName", "serviceType", "targetAudience", "features", "testimonials", "companyName")
+# 1つのバッチで生成できるLPの数
+MAX_BATCH_SIZE = int(os.environ.get("LP_MAX_BATCH_SIZE", "100"))
+# 待機できるジョブ数（全ワーカー合計。超えると429を返す）
+MAX_QUEUED_JOBS = int(os.environ.get("LP_MAX_QUEUED_JOBS", "20"))
+# 待機できるバッチのジョブ数（全ワーカー合計。通常のジョブの待機数とは別に数える）
+MAX_QUEUED_BATCH_JOBS = int(os.environ.get("LP_MAX_QUEUED_BATCH_JOBS", "200"))
 
-# バックグラウンドでLPを生成する関数
-async def generate_lp_background(job_id: str, data: LPGenerationRequest):
-    try:
-        # ジョブディレクトリを作成
-        job_dir = f"jobs/{job_id}"
-        os.makedirs(job_dir, exist_ok=True)
-        os.chdir(job_dir)
-        
-        # 初期ステップの設定
-        steps = [
-            GenerationStep(
-                id="wireframe",
-                name="ワイヤーフレーム作成",
-                description="HTML構造の生成",
-                status="pending",
-                progress=0,
-            ),
-            GenerationStep(
-                id="css",
-                name="デザイン適用",
-                description="CSSスタイルの生成",
-                status="pending",
-                progress=0,
-            ),
-            GenerationStep(
-                id="js",
-                name="インタラクション追加",
-                description="JavaScript機能の実装",
-                status="pending",
-                progress=0,
-            ),
-            GenerationStep(
-                id="image",
-                name="画像生成",
-                description="AIによる画像の生成",
-                status="pending",
-                progress=0,
-            ),
-            GenerationStep(
-                id="apply-image",
-                name="画像適用",
-                description="生成された画像の適用",
-                status="pending",
-                progress=0,
-            ),
-        ]
-        
-        # セクションアイデアをフォーマット
-        section_idea = format_section_idea(data)
-        
-        # 1. ワイヤーフレーム作成
-        steps[0].status = "processing"
-        update_job_status(job_id, "processing", 10, "wireframe", steps)
-        
-        html_data = wireframe_generate_agent(section_idea)
-        
-        steps[0].status = "completed"
-        steps[0].progress = 100
-        steps[1].status = "processing"
-        update_job_status(job_id, "processing", 30, "css", steps)
-        
-        # 2. デザイン適用（CSS）
-        css_data = design_css_agent(html_data)
-        
-        steps[1].status = "completed"
-        steps[1].progress = 100
-        steps[2].status = "processing"
-        update_job_status(job_id, "processing", 50, "js", steps)
-        
-        # 3. デザイン適用（JS）
-        js_data = design_js_agent(html_data, css_data)
-        
-        steps[2].status = "completed"
-        steps[2].progress = 100
-        steps[3].status = "processing"
-        update_job_status(job_id, "processing", 70, "image", steps)
-        
-        # 4. 画像生成
-        image_generate_agent(html_data, css_data)
-        
-        steps[3].status = "completed"
-        steps[3].progress = 100
-        steps[4].status = "processing"
-        update_job_status(job_id, "processing", 90, "apply-image", steps)
-        
-        # 5. 画像適用
-        final_html_data, final_css_data = apply_image(html_data, css_data)
-        
-        steps[4].status = "completed"
-        steps[4].progress = 100
-        
-        # ファイルを読み取り、結果を準備
-        with open("index.html", "r", encoding="utf-8") as f:
-            final_html = f.read()
-            
-        with open("style.css", "r", encoding="utf-8") as f:
-            final_css = f.read()
-            
-        with open("script.js", "r", encoding="utf-8") as f:
-            final_js = f.read()
-            
-        # 画像をBase64エンコード
-        image_base64 = ""
-        image_files = ["placeholder_css_1.png", "placeholder_css_1.jpg", "placeholder_html_1.png"]
-        
-        for image_file_name in image_files:
-            try:
-                with open(image_file_name, "rb") as image_file:
-                    image_base64 = base64.b64encode(image_file.read()).decode('utf-8')
-                    print(f"画像を読み込みました: {image_file_name}")
-                    break
-            except Exception as e:
-                print(f"画像エンコード中にエラー ({image_file_name}): {e}")
-                continue
-            
-        # 結果を作成
-        result = {
-            "jobId": job_id,
-            "html": final_html,
-            "css": final_css,
-            "js": final_js,
-            "imageBase64": f"data:image/jpeg;base64,{image_base64}" if image_base64 else "",
-            "createdAt": datetime.now().isoformat(),
-        }
-        
-        # 圧縮用ディレクトリを準備
-        zip_dir = f"../zip-{job_id}"
-        os.makedirs(zip_dir, exist_ok=True)
-        
-        # 結果ファイルをコピー
-        shutil.copy("index.html", f"{zip_dir}/index.html")
-        shutil.copy("style.css", f"{zip_dir}/style.css")
-        shutil.copy("script.js", f"{zip_dir}/script.js")
-        
-        # 画像ファイルがあればコピー
-        image_files_for_zip = ["placeholder_css_1.png", "placeholder_css_1.jpg"]
-        for img_file in image_files_for_zip:
-            if os.path.exists(img_file):
-                shutil.copy(img_file, f"{zip_dir}/{img_file}")
-                print(f"ZIPに画像ファイルを追加: {img_file}")
-        
-        # 生成された全てのPNGファイルをコピー
-        import glob
-        png_files = glob.glob("placeholder_*.png")
-        for png_file in png_files:
-            if os.path.exists(png_file):
-                shutil.copy(png_file, f"{zip_dir}/{png_file}")
-                print(f"ZIPに画像ファイルを追加: {png_file}")
-        
-        # ファイルを圧縮（backend直下に保存）
-        shutil.make_archive(f"../../download-{job_id}", "zip", zip_dir)
-        
-        # 一時ディレクトリを削除
-        shutil.rmtree(zip_dir)
-        
-        # 状態を完了に更新
-        update_job_status(job_id, "completed", 100, "completed", steps, result=result)
-        
-    except Exception as e:
-        print(f"Error in job {job_id}: {str(e)}")
-        
-        # エラー状態を更新
-        steps_with_error = []
-        for step in steps:
-            if step.status == "processing":
-                step.status = "error"
-            steps_with_error.append(step)
-            
-        update_job_status(job_id, "error", 0, "", steps_with_error, error=str(e))
-        
-    finally:
-        # 作業ディレクトリを元に戻す
-        os.chdir("../..")
-
-# エンドポイント
-@app.post("/api/generate")
-async def generate_lp(data: LPGenerationRequest, background_tasks: BackgroundTasks):
-    job_id = str(uuid.uuid4())
-    
-    # 初期ステップの設定
-    steps = [
+# 生成ステップの初期状態を作成する関数
+def create_generation_steps() -> List[GenerationStep]:
+    return [
         GenerationStep(
             id="wireframe",
             name="ワイヤーフレーム作成",
@@ -319,153 +227,1025 @@ async def generate_lp(data: LPGenerationRequest, background_tasks: BackgroundTas
             progress=0,
         ),
     ]
+
+# セクションアイデアの項目の番号と、対応するリクエストの項目
+SECTION_IDEA_ITEMS = [
+    ("①", "serviceName"),
+    ("②", "serviceType"),
+    ("③", "targetAudience"),
+    ("④", "features"),
+    ("⑤", "testimonials"),
+    ("⑥", "companyName"),
+]
+# 部分的な再生成で、セクションを作成し直さずに文字列を置き換える項目（名前）
+REPLACEABLE_FIELDS = ("serviceName", "companyName")
+
+# セクションアイデアをフォーマットする関数
+def format_section_idea(data: LPGenerationRequest) -> str:
+    return "\n\n".join(f"{item}：{getattr(data, field)}" for item, field in SECTION_IDEA_ITEMS)
+
+# このワーカーが実行中のジョブを更新する
+# 生存時刻の更新が遅れて待機中に戻されたジョブ（他のワーカーが取得したもの）は更新しない（Noneを返す）
+def update_owned_job(job_id: str, changes: Dict[str, Any],
+                     remove_fields: Iterable[str] = ()) -> Optional[Dict[str, Any]]:
+    return job_store.update(job_id, changes, remove_fields=remove_fields, expected_worker=job_dispatcher.worker_id)
+
+# ジョブの状態を更新する関数
+# 処理中・完了の状態を書き込めない場合（他のワーカーに引き継がれた場合）は JobOwnershipLostError で生成を中止する
+def update_job_status(job_id: str, status: str, progress: float, current_step: str, 
+                      steps: List[GenerationStep], error: Optional[str] = None, 
+                      result: Optional[Dict[str, Any]] = None,
+                      timing: Optional[Dict[str, Any]] = None):
+    changes = {
+        "status": status,
+        "progress": progress,
+        "currentStep": current_step,
+        "steps": [step.dict() for step in steps],
+    }
     
-    # ジョブ初期化
-    jobs[job_id] = {
+    if error:
+        changes["error"] = error
+        
+    if result:
+        changes["result"] = result
+
+    if timing:
+        changes["timing"] = timing
+
+    # ストアを原子的に更新（完了した部分的な再生成の指定は消す。再試行・再開で再び部分的な再生成にしない）
+    previous_job = update_owned_job(job_id, changes, remove_fields=("regenerate",) if status == "completed" else ())
+    if previous_job is None:
+        if status != "error":
+            raise JobOwnershipLostError(f"Job {job_id} was taken over by another worker")
+        return
+    if previous_job["status"] != status:
+        record_job_transition(job_id, status, error)
+    previous_steps = {step["id"]: step for step in previous_job.get("steps", [])}
+
+    # 状態が変化したステップのみを配信
+    for step in steps:
+        previous = previous_steps.get(step.id)
+        if previous is None or previous["status"] != step.status or previous["progress"] != step.progress:
+            job_events.publish(job_id, "step", step.dict())
+    job_events.publish(job_id, "status", {
+        "status": status,
+        "progress": progress,
+        "currentStep": current_step,
+    })
+
+    if status == "completed":
+        job_events.publish(job_id, "completed", {
+            "resultUrl": f"/api/jobs/{job_id}/result",
+            "downloadUrl": f"/api/jobs/{job_id}/download",
+        })
+    elif status == "error":
+        job_events.publish(job_id, "error", {"error": error})
+
+# ストリーミング中のステップ進捗を更新する関数
+def update_job_progress(job_id: str, progress: float, step_id: str, steps: List[GenerationStep]):
+    previous_job = update_owned_job(job_id, {
+        "progress": progress,
+        "steps": [step.dict() for step in steps],
+    })
+    if previous_job is None:
+        return
+
+    step_progress = {step.id: step.progress for step in steps}
+    job_events.publish(job_id, "progress", {
+        "progress": progress,
+        "stepId": step_id,
+        "stepProgress": step_progress.get(step_id, 0),
+    })
+
+# ストリーミングで受信したトークン数からステップ進捗を計算するクラス
+# 生成途中の成果物・進捗の保存と配信（ファイル・SQLiteへの書き込み）はスレッドで行い、イベントループを止めない
+#   - 書き込みは同時に1つまで。書き込み中に受信したテキストは次の書き込みでまとめて保存・配信する
+#   - async with で使い、抜けるときに実行中の書き込みの完了を待つ（段階の完了・エラーの状態より後に書き込まないため）
+class StreamingStepTracker:
+    def __init__(self, job_id: str, workspace: JobWorkspace, steps: List[GenerationStep], step_id: str):
+        self.job_id = job_id
+        self.workspace = workspace
+        self.steps = steps
+        self.step = next(step for step in steps if step.id == step_id)
+        self.expected_chars = EXPECTED_STEP_TOKENS.get(self.step.id, 4000) * CHARS_PER_TOKEN
+        self.chunks: List[str] = []
+        self.received_chars = 0
+        self.published_chars = 0
+        self.last_update = 0.0
+        self._flushing: Optional[asyncio.Future] = None
+
+    async def __aenter__(self) -> "StreamingStepTracker":
+        return self
+
+    async def __aexit__(self, *exc_info):
+        if self._flushing is not None:
+            await asyncio.gather(self._flushing, return_exceptions=True)
+
+    # 受信したテキスト片ごとに呼ばれる
+    def __call__(self, text: str):
+        self.chunks.append(text)
+        self.received_chars += len(text)
+
+        now = time.monotonic()
+        if self._flushing is not None or now - self.last_update < STREAM_UPDATE_INTERVAL:
+            return
+        self.last_update = now
+
+        # 完了までは100%にしない
+        self.step.progress = round(min(95, self.received_chars / self.expected_chars * 100), 1)
+        content = "".join(self.chunks)
+        self.chunks = [content]
+        # 前回配信以降に受信した差分のみを配信
+        delta = {
+            "stepId": self.step.id,
+            "offset": self.published_chars,
+            "text": content[self.published_chars:],
+        }
+        self.published_chars = len(content)
+        self._flushing = asyncio.ensure_future(asyncio.to_thread(self._write, content, delta))
+        self._flushing.add_done_callback(self._flushed)
+
+    def _write(self, content: str, delta: Dict[str, Any]):
+        self.workspace.write_json(PARTIAL_FILE, {
+            "stepId": self.step.id,
+            "content": content,
+        })
+        job_events.publish(self.job_id, "delta", delta)
+        update_job_progress(self.job_id, calculate_overall_progress(self.steps), self.step.id, self.steps)
+
+    def _flushed(self, future: asyncio.Future):
+        self._flushing = None
+        if not future.cancelled() and future.exception() is not None:
+            logger.warning(f"生成途中の成果物の保存に失敗しました ({self.job_id}): {future.exception()!r}")
+
+# 待機中のジョブ数（全ワーカー合計）に adding 件を加えると上限を超える場合は429を返す
+# 上限は優先度ごと（interactive: LP_MAX_QUEUED_JOBS、batch: LP_MAX_QUEUED_BATCH_JOBS）
+def check_queue_capacity(priority: str = "interactive", adding: int = 1):
+    max_size = MAX_QUEUED_JOBS if priority == "interactive" else MAX_QUEUED_BATCH_JOBS
+    pending = job_store.count_by_status("pending", priority=priority)
+    if pending + adding > max_size:
+        raise HTTPException(
+            status_code=429,
+            detail=f"Job queue is full ({pending}/{max_size})",
+            headers={"Retry-After": "30"},
+        )
+
+# 待機中のジョブを作成し、ジョブIDを返す（いずれかのワーカーのディスパッチャーが取得して実行する）
+def create_pending_job(original_data: Dict[str, Any], **fields: Any) -> str:
+    job_id = str(uuid.uuid4())
+    job_store.create({
         "jobId": job_id,
         "status": "pending",
         "progress": 0,
         "currentStep": "",
-        "steps": [step.dict() for step in steps],
+        "steps": [step.dict() for step in create_generation_steps()],
         "createdAt": datetime.now().isoformat(),
+        "originalData": original_data,
+        "priority": original_data.get("priority", "interactive"),
+        "offline": original_data.get("offline", False),
+        **fields,
+    })
+    record_job_transition(job_id, "pending")
+    return job_id
+
+# ZIPに含める成果物（ジョブディレクトリからの相対名）
+def list_package_files(workspace: JobWorkspace) -> List[str]:
+    files = ["index.html", "style.css", "script.js"]
+    images = workspace.glob("placeholder_*")
+    # 最適化した画像（WebP / AVIF）。これがある元画像は参照が書き換えられているため含めない
+    optimized = {variant_source_stem(name) for name in images} - {None}
+    for img_file in images:
+        stem, extension = os.path.splitext(img_file)
+        if variant_source_stem(img_file) is not None:
+            files.append(img_file)
+        elif extension.lower() in SOURCE_EXTENSIONS and stem not in optimized:
+            files.append(img_file)
+    return files
+
+# 成果物のURL
+def job_file_url(job_id: str, file_name: str) -> str:
+    return f"/api/jobs/{job_id}/files/{file_name}"
+
+# 成果物の一覧（ファイル名・URL・サイズ・Content-Type）
+def list_job_files(workspace: JobWorkspace, job_id: str) -> List[Dict[str, Any]]:
+    return [
+        {
+            "name": file_name,
+            "url": job_file_url(job_id, file_name),
+            "size": os.path.getsize(workspace.path(file_name)),
+            "contentType": mimetypes.guess_type(file_name)[0] or "application/octet-stream",
+        }
+        for file_name in list_package_files(workspace)
+    ]
+
+# ジョブのZIPに含めるファイル（ZIP内の名前, パス）。ZIPは配信時に成果物から直接生成する
+def job_zip_entries(workspace: JobWorkspace, prefix: str = "") -> List[tuple]:
+    return [(f"{prefix}{file_name}", workspace.path(file_name)) for file_name in list_package_files(workspace)]
+
+# ZIPをストリーミングで返す（ETagが一致すれば304）
+def stream_zip_response(request: Request, file_name: str, entries: List[tuple],
+                        extra_files: Iterable[tuple] = ()) -> Response:
+    etag = zip_etag(entries, extra_files)
+    headers = {"ETag": etag, "Cache-Control": FILE_CACHE_CONTROL}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return StreamingResponse(
+        iter_zip(entries, extra_files),
+        media_type="application/zip",
+        headers={**headers, "Content-Disposition": f'attachment; filename="{file_name}"'},
+    )
+
+# 全ステップの進捗から、ジョブ全体の進捗率を計算する関数
+def calculate_overall_progress(steps: List[GenerationStep]) -> float:
+    return round(sum(step.progress for step in steps) / len(steps), 1)
+
+# 実行中のステップのうち、最後に開始したもの（なければ空文字）
+def get_current_step_id(steps: List[GenerationStep]) -> str:
+    processing = [step.id for step in steps if step.status == "processing"]
+    return processing[-1] if processing else ""
+
+# バックグラウンドでLPを生成する関数
+# 各ステップは入力と出力を宣言した段階として定義し、入力が揃ったものから並行に実行する
+#   wireframe → css → js
+#                   ↘ image → apply-image
+# 各段階の出力はジョブディレクトリにチェックポイントとして保存され、
+# resume=True の場合は最初の未完了の段階から再開する
+# regenerate（変更した項目と変更前の値）を渡した場合は、前回の成果物のうち変更した項目に関係する部分のみを作り直す
+#   - セクションごとに作成したジョブ: 関係するセクション・スタイルのないclassのCSSのみを作成し、残りのセクション・CSS・画像は再利用
+#   - 1回で作成したジョブ: HTML・CSS・画像を作成し直す
+#   - どちらも、JavaScriptは参照しているclass / id がHTMLからなくなった場合のみ作成し直す
+async def generate_lp_background(job_id: str, data: LPGenerationRequest, resume: bool = False,
+                                 regenerate: Optional[Dict[str, Any]] = None):
+    steps = create_generation_steps()
+    steps_by_id = {step.id: step for step in steps}
+    # このジョブ（と各段階のタスク）でのみキャッシュの参照を無効にする
+    cache_bypass_token = cache_bypass.set(data.noCache)
+    priority_token = request_priority.set(data.priority)
+    offline_token = offline_batch.set(data.offline)
+    # このジョブのプロバイダー呼び出しのトークン使用量（再開時は前回までの使用量に加算する）
+    usage: Dict[str, Dict[str, int]] = {}
+    if resume:
+        previous_job = job_store.get(job_id, include_result=False) or {}
+        usage = {model: dict(entry) for model, entry in previous_job.get("tokenUsage", {}).items()}
+    usage_token = token_usage.set(usage)
+    # ジョブのワークスペースを作成
+    workspace = JobWorkspace(os.path.join(JOBS_DIR, job_id))
+
+    try:
+        if regenerate is not None and not resume:
+            # 前回の成果物を再生成の元として保存してからチェックポイントを消す（中断された場合も同じ元から再開する）
+            workspace.write_json(REGENERATION_BASE_FILE, {
+                "checkpoints": {stage_id: workspace.load_checkpoint(stage_id) for stage_id in ("wireframe", "css", "js", "image")},
+                "sections": workspace.read_json(WIREFRAME_SECTIONS_FILE),
+            })
+        if not resume:
+            workspace.clear_checkpoints()
+        base = workspace.read_json(REGENERATION_BASE_FILE) if regenerate is not None else None
+        # セクションごとに分けたHTMLを保存したジョブは、変更しなかったセクションとその画像・CSSを再利用できる
+        # （1回で作成したページも最上位の <section> ごとに分けて保存している。<section> のないページは全体を作り直す）
+        incremental = base is not None and base["sections"] is not None
+
+        def previous(stage_id: str, name: str) -> Any:
+            outputs = base["checkpoints"].get(stage_id) if base is not None else None
+            return outputs.get(name) if outputs else None
+
+        if regenerate is not None:
+            changed_fields = regenerate["changedFields"]
+            changed_items = [
+                item for item, field in SECTION_IDEA_ITEMS
+                if field in changed_fields and field not in REPLACEABLE_FIELDS
+            ]
+            replacements = {
+                regenerate["previousData"][field]: getattr(data, field)
+                for field in REPLACEABLE_FIELDS if field in changed_fields
+            }
+        
+        # セクションアイデアをフォーマット
+        section_idea = format_section_idea(data)
+
+        # 1. ワイヤーフレーム作成
+        async def run_wireframe(inputs):
+            async with StreamingStepTracker(job_id, workspace, steps, "wireframe") as on_text:
+                if incremental and previous("wireframe", "html") is not None:
+                    html_data, _ = await regenerate_wireframe_agent(
+                        workspace, inputs["section_idea"], base["sections"], changed_items, replacements,
+                        on_text=on_text,
+                    )
+                else:
+                    html_data = await wireframe_generate_agent(workspace, inputs["section_idea"], on_text=on_text)
+            return {"html": html_data}
+
+        # 2. デザイン適用（CSS）
+        async def run_css(inputs):
+            async with StreamingStepTracker(job_id, workspace, steps, "css") as on_text:
+                if incremental and previous("css", "css") is not None:
+                    # 前回から変わったセクション（作成し直したもの・文字列を置き換えたもの）
+                    previous_fragments = set(base["sections"]["fragments"])
+                    fragments = [
+                        fragment for fragment in workspace.read_json(WIREFRAME_SECTIONS_FILE)["fragments"]
+                        if fragment not in previous_fragments
+                    ]
+                    css_data = await update_css_agent(
+                        workspace, inputs["html"], previous("css", "css"), fragments, on_text=on_text,
+                    )
+                else:
+                    css_data = await design_css_agent(workspace, inputs["html"], on_text=on_text)
+            return {"css": css_data}
+
+        # 3. デザイン適用（JS）
+        async def run_js(inputs):
+            async with StreamingStepTracker(job_id, workspace, steps, "js") as on_text:
+                if base is not None:
+                    js_data = await update_js_agent(
+                        workspace, inputs["html"], inputs["css"], previous("wireframe", "html"), previous("js", "js"),
+                        on_text=on_text,
+                    )
+                else:
+                    js_data = await design_js_agent(workspace, inputs["html"], inputs["css"], on_text=on_text)
+            return {"js": js_data}
+
+        # 4. 画像生成（JSと並行に実行される）
+        async def run_image(inputs):
+            previous_images = previous("image", "images")
+            if base is not None and not incremental and previous_images:
+                # HTMLを1回で作成し直した場合、同じ番号の画像でも内容が異なるため再利用しない
+                remove_images(workspace, [image["fileName"] for image in previous_images if isinstance(image, dict)])
+            image_results = await image_generate_agent(
+                workspace, inputs["html"], inputs["css"], reuse=previous_images if incremental else None,
+            )
+            return {"images": image_results}
+
+        # 5. 画像適用
+        async def run_apply_image(inputs):
+            final_html_data, final_css_data = await apply_image(
+                workspace, inputs["html"], inputs["css"], inputs["images"]
+            )
+            return {"final_html": final_html_data, "final_css": final_css_data}
+
+        stages = [
+            Stage("wireframe", run_wireframe, inputs=["section_idea"], outputs=["html"]),
+            Stage("css", run_css, inputs=["html"], outputs=["css"]),
+            Stage("js", run_js, inputs=["html", "css"], outputs=["js"]),
+            Stage("image", run_image, inputs=["html", "css"], outputs=["images"]),
+            Stage("apply-image", run_apply_image, inputs=["html", "css", "images"], outputs=["final_html", "final_css"]),
+        ]
+
+        def on_stage_start(stage: Stage):
+            steps_by_id[stage.id].status = "processing"
+            update_job_status(job_id, "processing", calculate_overall_progress(steps), stage.id, steps)
+
+        def on_stage_complete(stage: Stage, outputs: Dict[str, Any]):
+            steps_by_id[stage.id].status = "completed"
+            steps_by_id[stage.id].progress = 100
+            update_job_status(job_id, "processing", calculate_overall_progress(steps),
+                              get_current_step_id(steps), steps)
+
+        scheduler = PipelineScheduler(stages, on_stage_start=on_stage_start,
+                                      on_stage_complete=on_stage_complete,
+                                      save_checkpoint=workspace.save_checkpoint,
+                                      load_checkpoint=workspace.load_checkpoint)
+        context = await scheduler.run({"section_idea": section_idea})
+        timing = scheduler.timing_report()
+        if scheduler.restored_stages:
+            logger.info(f"ジョブ {job_id} をチェックポイントから再開しました（復元: {scheduler.restored_stages}）")
+        logger.info(f"ジョブ {job_id} のクリティカルパス: {timing['criticalPath']} ({timing['criticalPathSeconds']}秒)")
+
+        # HTML / CSS / JS の画像参照を最適化した画像（srcset / image-set）に書き換える
+        await apply_responsive_images(workspace, context["images"])
+        optimized_images = [image for image in context["images"] if isinstance(image, dict) and image.get("variants")]
+        
+        # 結果を作成（成果物の本体は含めず、/api/jobs/{job_id}/files/{name} のURLとサイズのみ）
+        result = {
+            "jobId": job_id,
+            "previewUrl": job_file_url(job_id, "index.html"),
+            "files": list_job_files(workspace, job_id),
+            "downloadUrl": f"/api/jobs/{job_id}/download",
+            # 生成に失敗し、代替画像を使った画像（ファイル名・代替方法・失敗の理由）
+            "imageFallbacks": [
+                {key: image[key] for key in ("fileName", "fallback", "source", "error") if key in image}
+                for image in context["images"]
+                if isinstance(image, dict) and image.get("status") == "fallback"
+            ],
+            # 画像ライブラリから再利用した画像（ファイル名・プロンプトの類似度）
+            "reusedImages": [
+                {"fileName": image["fileName"], "similarity": image["similarity"]}
+                for image in context["images"]
+                if isinstance(image, dict) and image.get("status") == "reused" and not image.get("carriedOver")
+            ],
+            # 部分的な再生成で、前回の成果物からそのまま引き継いだ画像
+            "carriedOverImages": [
+                {"fileName": image["fileName"]}
+                for image in context["images"]
+                if isinstance(image, dict) and image.get("carriedOver")
+            ],
+            # 最適化した画像の合計サイズ（元画像と、元画像と同じ幅で最も小さい最適化した画像）
+            "imageBytes": {
+                "original": sum(image["bytes"] for image in optimized_images),
+                "optimized": sum(
+                    min(variant["bytes"] for variant in image["variants"] if variant["width"] == image["width"])
+                    for image in optimized_images
+                ),
+            },
+            "createdAt": datetime.now().isoformat(),
+        }
+        if regenerate is not None:
+            result["changedFields"] = regenerate["changedFields"]
+        
+        # 状態を完了に更新
+        update_job_status(job_id, "completed", 100, "completed", steps, result=result, timing=timing)
+        workspace.remove(REGENERATION_BASE_FILE)
+        
+    except JobOwnershipLostError as e:
+        logger.warning(f"ジョブ {job_id} の生成を中止します: {e}")
+
+    except Exception as e:
+        logger.exception(f"Error in job {job_id}: {str(e)}")
+        
+        # エラー状態を更新
+        steps_with_error = []
+        for step in steps:
+            if step.status == "processing":
+                step.status = "error"
+            steps_with_error.append(step)
+            
+        update_job_status(job_id, "error", 0, "", steps_with_error, error=str(e))
+
+    finally:
+        workspace.remove(PARTIAL_FILE)
+        update_owned_job(job_id, {"tokenUsage": usage})
+        token_usage.reset(usage_token)
+        offline_batch.reset(offline_token)
+        request_priority.reset(priority_token)
+        cache_bypass.reset(cache_bypass_token)
+
+# ディスパッチャーが取得したジョブを実行する
+# resume=True のジョブは保存済みのチェックポイントから再開する
+# ジョブ全体を1つのスパンとし、各段階・プロバイダー呼び出しはその子スパンになる
+async def run_claimed_job(job: Dict[str, Any]):
+    data = LPGenerationRequest(**job["originalData"])
+    # 再開・再試行では完了済みの段階の応答をキャッシュから再利用する
+    if job.get("resume") or job.get("retryOf"):
+        data.noCache = False
+    resume = job.get("resume", False)
+    # 待機時間（再開したジョブは作成日時が前回の実行より前のため計測しない。部分的な再生成は待機に戻した日時から）
+    queued_at = job.get("queuedAt", job["createdAt"])
+    queue_wait = None if resume else (datetime.now() - datetime.fromisoformat(queued_at)).total_seconds()
+    with job_span(job["jobId"], data.priority, resume=resume, queue_wait_seconds=queue_wait):
+        # 待機中 → 処理中の変化はディスパッチャーが取得した時点でストアに反映されている
+        record_job_transition(job["jobId"], "processing")
+        await generate_lp_background(job["jobId"], data, resume=resume, regenerate=job.get("regenerate"))
+
+# 既存のジョブを待機中に戻し、保存済みのチェックポイントから再開させる
+# expected_status を指定した場合は、現在の状態が一致するときのみ戻す（戻せなければFalse）
+# requeue=True の場合は待機中のジョブの最後に並べる（False の場合は最初に待機を始めた順番のまま）
+def resume_job(job_id: str, job: Dict[str, Any], expected_status: Optional[str] = None,
+               requeue: bool = False) -> bool:
+    changes = {
+        "status": "pending",
+        "progress": 0,
+        "currentStep": "",
+        "steps": [step.dict() for step in create_generation_steps()],
+        "retryCount": job.get("retryCount", 0) + 1,
+        "resume": True,
     }
+    if requeue:
+        changes["queuedAt"] = datetime.now().isoformat()
+    previous_job = job_store.update(job_id, changes, remove_fields=("error", "result", "timing"),
+                                    expected_status=expected_status)
+    if previous_job is None:
+        return False
+
+    job_events.publish(job_id, "status", {"status": "pending", "progress": 0, "currentStep": ""})
+    job_dispatcher.notify()
+    return True
+
+# 停止したワーカー（前回のプロセスを含む）が処理中のまま残したジョブを再開する
+def requeue_orphaned_job(job: Dict[str, Any]):
+    job_id = job["jobId"]
+    if "originalData" not in job:
+        logger.error(f"中断されたジョブを再開できませんでした ({job_id}): Original data not found for resume")
+        job_store.update(job_id, {"status": "error", "error": "Interrupted: Original data not found for resume"})
+        return
+    if resume_job(job_id, job, expected_status="processing"):
+        logger.warning(f"中断されたジョブを再開します: {job_id}")
+
+# 共有ジョブキューから待機中のジョブを取得して実行する
+job_dispatcher = create_job_dispatcher_from_env(job_store, job_executor, run_claimed_job, requeue_orphaned_job,
+                                                offline_executor=offline_job_executor)
+
+# エンドポイント
+@app.post("/api/generate")
+async def generate_lp(data: LPGenerationRequest):
+    check_queue_capacity(data.priority)
     
-    # バックグラウンドタスク開始
-    background_tasks.add_task(generate_lp_background, job_id, data)
+    # ジョブ初期化
+    job_id = create_pending_job(data.dict())
+    job_dispatcher.notify()
     
     return {"jobId": job_id}
 
+# 待機中のジョブの順番（先頭が0、全ワーカー共通）
+# batch のジョブは、待機中の interactive のジョブが全て取得された後に取得される
+# offline のジョブは別枠で取得されるため、同じ実行方法のジョブの中での順番
+def get_queue_position(job: Dict[str, Any]) -> int:
+    priority = job.get("priority", "interactive")
+    offline = bool(job.get("offline", False))
+    queued_at = job.get("queuedAt", job["createdAt"])
+    position = job_store.count_by_status("pending", queued_before=(queued_at, job["jobId"]),
+                                         priority=priority, offline=offline)
+    if priority == "batch":
+        position += job_store.count_by_status("pending", priority="interactive", offline=offline)
+    return position
+
+# 状態・一覧で既定では返さないジョブの入力（?include=input で含める）
+JOB_INPUT_FIELDS = ("originalData", "regenerate")
+
+def check_include(include: Optional[str]) -> bool:
+    if include not in (None, "input"):
+        raise HTTPException(status_code=400, detail="include must be 'input'")
+    return include == "input"
+
+def omit_job_input(job: Dict[str, Any]) -> Dict[str, Any]:
+    return {key: value for key, value in job.items() if key not in JOB_INPUT_FIELDS}
+
+# ジョブの状態（生成結果は含めず、完了後は resultUrl で成果物の一覧を取得する）
 @app.get("/api/jobs/{job_id}")
-async def get_job_status(job_id: str):
-    if job_id not in jobs:
-        raise HTTPException(status_code=404, detail="Job not found")
-        
-    return jobs[job_id]
+async def get_job_status(job_id: str, include: Optional[str] = None):
+    return get_job_snapshot(job_id, include_input=check_include(include))
 
+# ジョブ一覧（最新順、カーソルによるページング。生成結果は含めない）
 @app.get("/api/jobs")
-async def get_jobs():
-    # 最新順にソート
-    sorted_jobs = sorted(
-        [job for job in jobs.values()],
-        key=lambda x: x.get("createdAt", ""), 
-        reverse=True
-    )
+async def get_jobs(status: Optional[str] = None,
+                   limit: int = Query(20, ge=1, le=100),
+                   cursor: Optional[str] = None,
+                   include: Optional[str] = None):
+    include_input = check_include(include)
+    try:
+        page, next_cursor = job_store.list(status=status, limit=limit, cursor=cursor)
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
-    return {"jobs": sorted_jobs}
+    if not include_input:
+        page = [omit_job_input(job) for job in page]
+    return {"jobs": page, "nextCursor": next_cursor}
 
-@app.post("/api/jobs/{job_id}/retry")
-async def retry_job(job_id: str, background_tasks: BackgroundTasks):
-    if job_id not in jobs:
+# 完了したジョブの生成結果
+@app.get("/api/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    job = job_store.get(job_id)
+    if job is None:
         raise HTTPException(status_code=404, detail="Job not found")
-        
+
+    if job["status"] != "completed" or "result" not in job:
+        raise HTTPException(status_code=400, detail="Job is not completed yet")
+
+    return job["result"]
+
+# 成果物の Cache-Control（キャッシュは保持させつつ、再生成に備えて毎回 ETag で再検証させる）
+FILE_CACHE_CONTROL = "public, no-cache"
+
+# ファイルのサイズと更新時刻から決まるETag
+def file_etag(stat: os.stat_result) -> str:
+    return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+# If-None-Match が etag と一致するか
+def etag_matches(request: Request, etag: str) -> bool:
+    tags = [tag.strip() for tag in request.headers.get("if-none-match", "").split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+# 条件付きリクエスト（If-None-Match / If-Modified-Since）がファイルの現在の内容と一致するか
+def is_not_modified(request: Request, etag: str, stat: os.stat_result) -> bool:
+    if "if-none-match" in request.headers:
+        return etag_matches(request, etag)
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            since = email.utils.parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        return int(stat.st_mtime) <= since.timestamp()
+    return False
+
+# ジョブの成果物（HTML / CSS / JS / 画像）を配信する
+# ETag・Last-Modified による条件付きリクエスト（304）と、Range による部分取得に対応する
+@app.api_route("/api/jobs/{job_id}/files/{file_name}", methods=["GET", "HEAD"])
+async def get_job_file(job_id: str, file_name: str, request: Request):
+    if job_store.get(job_id, include_result=False) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    workspace = JobWorkspace(os.path.join(JOBS_DIR, job_id))
+    # 成果物以外（チェックポイント・生成途中の状態など）は配信しない
+    if file_name not in list_package_files(workspace) or not workspace.exists(file_name):
+        raise HTTPException(status_code=404, detail="File not found")
+
+    path = workspace.path(file_name)
+    stat = os.stat(path)
+    etag = file_etag(stat)
+    headers = {"ETag": etag, "Cache-Control": FILE_CACHE_CONTROL}
+    if is_not_modified(request, etag, stat):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, headers=headers, stat_result=stat)
+
+# 購読開始時に送るジョブの状態（生成結果は含めない）
+def get_job_snapshot(job_id: str, include_input: bool = False) -> Dict[str, Any]:
+    snapshot = job_store.get(job_id, include_result=False)
+    if snapshot is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if not include_input:
+        snapshot = omit_job_input(snapshot)
+
+    if snapshot["status"] == "pending":
+        snapshot["queuePosition"] = get_queue_position(snapshot)
+    if snapshot["status"] == "completed":
+        snapshot["resultUrl"] = f"/api/jobs/{job_id}/result"
+        snapshot["downloadUrl"] = f"/api/jobs/{job_id}/download"
+    return snapshot
+
+# 購読開始時に送るイベント（購読の登録後、イベントループに制御を返す前に呼ぶ）
+#   - last_event_id（再接続した購読者が最後に受け取ったイベントID）があれば、それより後のイベントを再送する
+#   - 初回の接続や再送できない場合は、現在の状態（スナップショット）を送る
+#     （スナップショットのIDはイベントログの位置とし、その直後に再接続しても取りこぼさないようにする）
+def initial_job_events(job_id: str, last_event_id: Optional[int] = None) -> List[Dict[str, Any]]:
+    if last_event_id is not None:
+        missed = job_events.replay(job_id, last_event_id)
+        if missed is not None:
+            return missed
+    snapshot = get_job_snapshot(job_id)
+    return [{"id": job_events.position(job_id), "type": "snapshot", "data": snapshot}]
+
+# 購読を終了するイベントか（終端イベント、または終了したジョブのスナップショット）
+def is_final_event(event: Dict[str, Any]) -> bool:
+    if event["type"] == "snapshot":
+        return event["data"]["status"] in TERMINAL_EVENTS
+    return event["type"] in TERMINAL_EVENTS
+
+def parse_event_id(value: Optional[str]) -> Optional[int]:
+    try:
+        return int(value) if value else None
+    except ValueError:
+        return None
+
+# ジョブの状態変化をServer-Sent Eventsで配信する
+# EventSource が再接続時に送る Last-Event-ID より後のイベントから再開する
+@app.get("/api/jobs/{job_id}/events")
+async def stream_job_events(job_id: str, request: Request):
+    get_job_snapshot(job_id)
+    last_event_id = parse_event_id(request.headers.get("last-event-id"))
+
+    async def event_stream():
+        async with job_events.subscribe(job_id) as queue:
+            # 購読開始後に取得し、取りこぼしを防ぐ
+            for event in initial_job_events(job_id, last_event_id):
+                yield format_sse(event)
+                if is_final_event(event):
+                    return
+
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=EVENT_KEEPALIVE_INTERVAL)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+
+                yield format_sse(event)
+                if event["type"] in TERMINAL_EVENTS:
+                    return
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+        },
+    )
+
+# ジョブの状態変化をWebSocketで配信する（SSEと同じイベントをJSONで送信）
+# 再接続時はクエリパラメーター lastEventId で最後に受け取ったイベントIDを指定する
+@app.websocket("/api/jobs/{job_id}/ws")
+async def job_events_websocket(websocket: WebSocket, job_id: str):
+    await websocket.accept()
+    last_event_id = parse_event_id(websocket.query_params.get("lastEventId"))
+    try:
+        async with job_events.subscribe(job_id) as queue:
+            try:
+                events = initial_job_events(job_id, last_event_id)
+            except HTTPException as e:
+                await websocket.close(code=4404, reason=e.detail)
+                return
+
+            for event in events:
+                await websocket.send_json(event)
+                if is_final_event(event):
+                    await websocket.close()
+                    return
+
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=EVENT_KEEPALIVE_INTERVAL)
+                except asyncio.TimeoutError:
+                    await websocket.send_json({"type": "keep-alive"})
+                    continue
+
+                await websocket.send_json(event)
+                if event["type"] in TERMINAL_EVENTS:
+                    await websocket.close()
+                    return
+    except WebSocketDisconnect:
+        pass
+
+# ストリーミング中の生成途中の成果物（生成中のHTML/CSS/JS）
+@app.get("/api/jobs/{job_id}/partial")
+async def get_job_partial(job_id: str):
+    job = job_store.get(job_id, include_result=False)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    current_step = job["currentStep"]
+
+    partial = None
+    if job["status"] == "processing":
+        partial = JobWorkspace(os.path.join(JOBS_DIR, job_id)).read_json(PARTIAL_FILE)
+    if partial is None:
+        return {"stepId": current_step, "content": ""}
+    return partial
+
+# 応答キャッシュの状態（ヒット数・ミス数・使用量）
+@app.get("/api/cache")
+async def get_cache_status():
+    return {
+        **response_cache.stats(),
+        "singleFlight": single_flight.stats(),
+        "imageLibrary": image_library.stats() if image_library is not None else None,
+    }
+
+# Prometheus のメトリクス（段階・プロバイダー呼び出しの所要時間、トークン数・費用、キャッシュのヒットなど）
+@app.get("/metrics")
+async def get_metrics():
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+# レート制限の状態（モデルごとの上限・残量・待機数・待ち時間）
+@app.get("/api/limits")
+async def get_rate_limits():
+    return rate_limiter.stats()
+
+# ジョブキューの状態（全ワーカーの待機中・処理中の件数と、このワーカーの実行状況）
+@app.get("/api/queue")
+async def get_queue_status():
+    return {
+        "queued": job_store.count_by_status("pending"),
+        "queuedByPriority": {
+            priority: job_store.count_by_status("pending", priority=priority)
+            for priority in ("interactive", "batch")
+        },
+        "processing": job_store.count_by_status("processing"),
+        "maxQueueSize": MAX_QUEUED_JOBS,
+        "maxBatchQueueSize": MAX_QUEUED_BATCH_JOBS,
+        "workerId": job_dispatcher.worker_id,
+        "worker": job_executor.stats(),
+        "offlineWorker": offline_job_executor.stats(),
+        "providerBatches": claude_batcher.stats(),
+    }
+
+# ジョブを再実行する
+#   mode=resume（既定）: 同じジョブを最初の未完了の段階から再開する
+#   mode=restart: 新しいジョブとして最初から生成し直す
+@app.post("/api/jobs/{job_id}/retry")
+async def retry_job(job_id: str, mode: str = "resume"):
+    if mode not in ("resume", "restart"):
+        raise HTTPException(status_code=400, detail="mode must be 'resume' or 'restart'")
+
     # 元のジョブから必要なデータを取得
-    original_job = jobs[job_id]
+    original_job = job_store.get(job_id, include_result=False)
+    if original_job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
     
     if "originalData" not in original_job:
         raise HTTPException(status_code=400, detail="Original data not found for retry")
+
+    if mode == "resume":
+        if original_job["status"] in ("pending", "processing"):
+            raise HTTPException(status_code=409, detail="Job is already running")
+        check_queue_capacity(original_job.get("priority", "interactive"))
+        # 同時に別のワーカーが再開した場合は409
+        if not resume_job(job_id, original_job, expected_status=original_job["status"], requeue=True):
+            raise HTTPException(status_code=409, detail="Job is already running")
+        return {"jobId": job_id}
         
+    check_queue_capacity(original_job.get("priority", "interactive"))
     # 新しいジョブを作成
-    new_job_id = str(uuid.uuid4())
-    data = LPGenerationRequest(**original_job["originalData"])
+    new_job_id = create_pending_job(original_job["originalData"], retryOf=job_id)
+    job_dispatcher.notify()
     
-    # 初期ステップの設定
-    steps = [
-        GenerationStep(
-            id="wireframe",
-            name="ワイヤーフレーム作成",
-            description="HTML構造の生成",
-            status="pending",
-            progress=0,
-        ),
-        GenerationStep(
-            id="css",
-            name="デザイン適用",
-            description="CSSスタイルの生成",
-            status="pending",
-            progress=0,
-        ),
-        GenerationStep(
-            id="js",
-            name="インタラクション追加",
-            description="JavaScript機能の実装",
-            status="pending",
-            progress=0,
-        ),
-        GenerationStep(
-            id="image",
-            name="画像生成",
-            description="AIによる画像の生成",
-            status="pending",
-            progress=0,
-        ),
-        GenerationStep(
-            id="apply-image",
-            name="画像適用",
-            description="生成された画像の適用",
-            status="pending",
-            progress=0,
-        ),
-    ]
-    
-    # ジョブ初期化
-    jobs[new_job_id] = {
-        "jobId": new_job_id,
+    return {"jobId": new_job_id}
+
+# 完了したジョブの入力の一部を変更し、変更した項目に関係する部分のみを作り直す（部分的な再生成）
+# 同じジョブIDのまま待機中に戻し、変更しなかったセクション・CSSの規則・JavaScript・画像は前回のものを再利用する
+# 指定した値が全て前回と同じ場合は何もしない（changedFields が空）
+@app.patch("/api/jobs/{job_id}")
+async def regenerate_job(job_id: str, data: LPRegenerationRequest):
+    job = job_store.get(job_id, include_result=False)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    if "originalData" not in job:
+        raise HTTPException(status_code=400, detail="Original data not found for regeneration")
+
+    if job["status"] != "completed":
+        raise HTTPException(status_code=409, detail="Only completed jobs can be regenerated")
+
+    original_data = job["originalData"]
+    changes = {
+        field: value for field, value in data.dict(exclude_none=True).items() if value != original_data.get(field)
+    }
+    if not changes:
+        return {"jobId": job_id, "changedFields": []}
+
+    check_queue_capacity(job.get("priority", "interactive"))
+    previous_job = job_store.update(job_id, {
         "status": "pending",
         "progress": 0,
         "currentStep": "",
-        "steps": [step.dict() for step in steps],
-        "createdAt": datetime.now().isoformat(),
-        "originalData": original_job["originalData"],
-        "retryOf": job_id,
-    }
-    
-    # バックグラウンドタスク開始
-    background_tasks.add_task(generate_lp_background, new_job_id, data)
-    
-    return {"jobId": new_job_id}
+        "steps": [step.dict() for step in create_generation_steps()],
+        "originalData": {**original_data, **changes},
+        "queuedAt": datetime.now().isoformat(),
+        "resume": False,
+        "regenerate": {
+            "changedFields": list(changes),
+            "previousData": {field: original_data.get(field) for field in changes},
+        },
+    }, remove_fields=("error", "result", "timing"), expected_status="completed")
+    # 同時に別のリクエストが再実行・再生成した場合は409
+    if previous_job is None:
+        raise HTTPException(status_code=409, detail="Job is already running")
 
+    record_job_transition(job_id, "pending")
+    job_events.publish(job_id, "status", {"status": "pending", "progress": 0, "currentStep": ""})
+    job_dispatcher.notify()
+    return {"jobId": job_id, "changedFields": list(changes)}
+
+# 成果物をまとめたZIP（一時ファイルを作らず、ジョブディレクトリの成果物から直接生成して送信する）
 @app.get("/api/jobs/{job_id}/download")
-async def download_job(job_id: str):
-    if job_id not in jobs:
+async def download_job(job_id: str, request: Request):
+    job = job_store.get(job_id, include_result=False)
+    if job is None:
         raise HTTPException(status_code=404, detail="Job not found")
-        
-    job = jobs[job_id]
     
     if job["status"] != "completed":
         raise HTTPException(status_code=400, detail="Job is not completed yet")
-        
-    # 複数の可能な場所をチェック
-    download_paths = [
-        f"download-{job_id}.zip",                    # backend直下
-        f"jobs/download-{job_id}.zip",               # jobsサブディレクトリ
-        f"jobs/{job_id}/download-{job_id}.zip"       # 各ジョブディレクトリ内
+
+    workspace = JobWorkspace(os.path.join(JOBS_DIR, job_id))
+    entries = [(name, path) for name, path in job_zip_entries(workspace) if os.path.exists(path)]
+    if not entries:
+        raise HTTPException(status_code=404, detail="Job files not found")
+    return stream_zip_response(request, f"lp-{job_id}.zip", entries)
+
+# バッチのリクエストを展開し、(リクエスト, 置き換えた項目) の一覧を返す
+# バッチのジョブは全て batch の優先度で実行する
+def expand_batch_requests(batch: LPBatchRequest) -> List[tuple]:
+    items = [(data, {}) for data in batch.requests]
+    if batch.variations:
+        if batch.base is None:
+            raise HTTPException(status_code=400, detail="variations requires base")
+        unknown = [field for field in batch.variations if field not in BATCH_VARIABLE_FIELDS]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown variation fields: {unknown}")
+        fields = list(batch.variations)
+        size = 1
+        for field in fields:
+            size *= len(batch.variations[field])
+        if size > MAX_BATCH_SIZE:
+            raise HTTPException(status_code=400, detail=f"Batch is too large ({size}/{MAX_BATCH_SIZE})")
+        for values in itertools.product(*(batch.variations[field] for field in fields)):
+            variation = dict(zip(fields, values))
+            items.append((batch.base.copy(update=variation), variation))
+    elif batch.base is not None:
+        items.append((batch.base, {}))
+
+    if not items:
+        raise HTTPException(status_code=400, detail="Batch has no requests")
+    if len(items) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"Batch is too large ({len(items)}/{MAX_BATCH_SIZE})")
+    return [
+        (data.copy(update={"priority": "batch", "offline": data.offline or batch.offline}), variation)
+        for data, variation in items
     ]
-    
-    download_path = None
-    for path in download_paths:
-        if os.path.exists(path):
-            download_path = path
-            break
-    
-    if not download_path:
-        # デバッグ情報を提供
-        available_files = []
-        for path in download_paths:
-            if os.path.exists(os.path.dirname(path)):
-                available_files.extend([f for f in os.listdir(os.path.dirname(path)) if f.startswith(f"download-{job_id}")])
-        
-        raise HTTPException(
-            status_code=404, 
-            detail=f"Download file not found. Searched: {download_paths}. Available: {available_files}"
-        )
-        
-    return FileResponse(
-        path=download_path,
-        filename=f"lp-{job_id}.zip",
-        media_type="application/zip"
-    )
+
+# バッチ全体の状態（ジョブごとの状態・進捗率とその集計）
+def summarize_batch(batch: Dict[str, Any], jobs: List[Dict[str, Any]]) -> Dict[str, Any]:
+    counts = {status: 0 for status in ("pending", "processing", "completed", "error")}
+    usage: Dict[str, Dict[str, int]] = {}
+    for job in jobs:
+        counts[job["status"]] = counts.get(job["status"], 0) + 1
+        for model, entry in job.get("tokenUsage", {}).items():
+            total = usage.setdefault(model, {"requests": 0, "inputTokens": 0, "outputTokens": 0})
+            for key, value in entry.items():
+                total[key] = total.get(key, 0) + value
+
+    finished = counts["completed"] + counts["error"] == len(jobs)
+    if counts["pending"] == len(jobs):
+        status = "pending"
+    elif not finished:
+        status = "processing"
+    elif counts["error"] == 0:
+        status = "completed"
+    elif counts["completed"] == 0:
+        status = "error"
+    else:
+        status = "partial"
+
+    summary = {
+        "batchId": batch["batchId"],
+        "status": status,
+        "progress": round(sum(job["progress"] for job in jobs) / len(jobs), 1) if jobs else 0,
+        "size": len(jobs),
+        "counts": counts,
+        "offline": batch.get("offline", False),
+        "createdAt": batch["createdAt"],
+        "tokenUsage": usage,
+        "jobs": [
+            {
+                "jobId": job["jobId"],
+                "batchIndex": job.get("batchIndex"),
+                "status": job["status"],
+                "progress": job["progress"],
+                "currentStep": job["currentStep"],
+                "variation": job.get("variation", {}),
+                **({"error": job["error"]} if "error" in job else {}),
+            }
+            for job in jobs
+        ],
+    }
+    if finished and counts["completed"] > 0:
+        summary["downloadUrl"] = f"/api/batches/{batch['batchId']}/download"
+    return summary
+
+def get_batch_summary(batch_id: str) -> Dict[str, Any]:
+    batch = job_store.get_batch(batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return summarize_batch(batch, job_store.find_by_batch(batch_id))
+
+# 複数のLPをまとめて生成する（同じレート制限を通り、通常のジョブより後に実行される）
+@app.post("/api/batches")
+async def create_batch(batch: LPBatchRequest):
+    items = expand_batch_requests(batch)
+    check_queue_capacity("batch", adding=len(items))
+
+    batch_id = str(uuid.uuid4())
+    job_store.create_batch({
+        "batchId": batch_id,
+        "createdAt": datetime.now().isoformat(),
+        "size": len(items),
+        "offline": batch.offline,
+    })
+    job_ids = [
+        create_pending_job(data.dict(), batchId=batch_id, batchIndex=index, variation=variation)
+        for index, (data, variation) in enumerate(items)
+    ]
+    job_dispatcher.notify()
+
+    return {"batchId": batch_id, "jobIds": job_ids}
+
+# バッチ全体の進捗
+@app.get("/api/batches/{batch_id}")
+async def get_batch_status(batch_id: str):
+    return get_batch_summary(batch_id)
+
+# バッチの全ての成果物をまとめたZIP
+@app.get("/api/batches/{batch_id}/download")
+async def download_batch(batch_id: str, request: Request):
+    summary = get_batch_summary(batch_id)
+    if "downloadUrl" not in summary:
+        raise HTTPException(status_code=400, detail="Batch is not completed yet")
+
+    # 完了したジョブごとのディレクトリ（削除された成果物は含めない）と、バッチの状態（batch.json）
+    entries = []
+    for job in summary["jobs"]:
+        if job["status"] != "completed":
+            continue
+        workspace = JobWorkspace(os.path.join(JOBS_DIR, job["jobId"]))
+        prefix = f"{job['batchIndex'] + 1:03d}-{job['jobId']}/"
+        entries.extend((name, path) for name, path in job_zip_entries(workspace, prefix=prefix) if os.path.exists(path))
+    manifest = json.dumps(summary, ensure_ascii=False, indent=2).encode("utf-8")
+    return stream_zip_response(request, f"lp-batch-{batch_id}.zip", entries, [("batch.json", manifest)])
 
 # サーバー起動
+# python -m uvicorn に置き換えて起動する
+# （spawn で起動する子プロセス（ワーカー・画像の最適化）は起動元の __main__ を読み込み直すため、
+#   このモジュールを __main__ にすると、子プロセスごとにアプリ全体の初期化が走る）
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+    import sys
+    port = int(os.environ.get("LP_PORT", "8000"))
+    workers = int(os.environ.get("LP_WORKERS", "1"))
+    # 複数のワーカープロセスのメトリクスは、どのワーカーの /metrics でも合計を返す
+    if workers > 1:
+        prepare_multiprocess_metrics(os.path.join(tempfile.gettempdir(), f"lp-generator-metrics-{port}"))
+    # ジョブの状態は共有ストアにあるため、複数のワーカープロセスで起動できる
+    os.execv(sys.executable, [
+        sys.executable, "-m", "uvicorn", "main:app",
+        "--app-dir", BASE_DIR,
+        "--host", "0.0.0.0",
+        "--port", str(port),
+        "--workers", str(workers),
+    ])
\ No newline at end of file
@@ -0,0 +1,282 @@
+import asyncio
+import functools
+import glob
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from opentelemetry import trace
+from opentelemetry.trace import Status, StatusCode
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram
+from prometheus_client import generate_latest, multiprocess
+
+######################################
+## 計測（Prometheus のメトリクスと OpenTelemetry のトレース）
+######################################
+# ジョブ・段階・プロバイダー呼び出しごとに、所要時間・トークン数・費用・再試行・キャッシュのヒット・
+# 待ち時間・書き込んだバイト数を記録し、/metrics で公開する
+# トレースはジョブごとに1つ（段階・プロバイダー呼び出しはその子スパン）。LP_OTEL_EXPORTER で出力先を指定する
+# 複数のワーカープロセスで起動した場合は PROMETHEUS_MULTIPROC_DIR に各プロセスの値を書き、/metrics で合計する
+
+logger = logging.getLogger(__name__)
+tracer = trace.get_tracer("lp_generator")
+
+# 所要時間のヒストグラムの区切り（秒）
+STAGE_BUCKETS = (0.5, 1, 2.5, 5, 10, 20, 30, 45, 60, 90, 120, 180, 300, 600)
+PROVIDER_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 45, 60, 90, 120)
+WAIT_BUCKETS = (0.01, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+JOB_SECONDS = Histogram(
+    "lp_job_duration_seconds", "Time from a job being claimed to it finishing", buckets=STAGE_BUCKETS,
+)
+JOB_QUEUE_WAIT_SECONDS = Histogram(
+    "lp_job_queue_wait_seconds", "Time a job waited in the queue before a worker claimed it",
+    ["priority"], buckets=WAIT_BUCKETS,
+)
+JOB_TRANSITIONS = Counter(
+    "lp_job_status_transitions_total", "Job status transitions", ["status"],
+)
+JOBS_RUNNING = Gauge(
+    "lp_jobs_running", "Jobs currently running", multiprocess_mode="livesum",
+)
+STAGE_SECONDS = Histogram(
+    "lp_stage_duration_seconds", "Duration of each pipeline stage", ["stage", "outcome"], buckets=STAGE_BUCKETS,
+)
+PROVIDER_SECONDS = Histogram(
+    "lp_provider_request_duration_seconds", "Latency of provider calls (excluding rate limit waits)",
+    ["provider", "model", "outcome"], buckets=PROVIDER_BUCKETS,
+)
+RATE_LIMIT_WAIT_SECONDS = Histogram(
+    "lp_rate_limit_wait_seconds", "Time provider calls waited for the rate limiter",
+    ["provider", "model"], buckets=WAIT_BUCKETS,
+)
+PROVIDER_TOKENS = Counter(
+    "lp_provider_tokens_total", "Tokens used by provider calls (direction: input / output / cache_read / cache_write)",
+    ["provider", "model", "direction"],
+)
+PROVIDER_COST = Counter(
+    "lp_provider_cost_usd_total", "Estimated cost of provider calls (USD)", ["provider", "model"],
+)
+PROVIDER_RETRIES = Counter(
+    "lp_provider_retries_total", "Provider calls retried after a retryable error", ["provider", "model"],
+)
+CACHE_LOOKUPS = Counter(
+    "lp_cache_lookups_total", "Response cache, in-flight deduplication and image library lookups",
+    ["kind", "result"],
+)
+BYTES_WRITTEN = Counter(
+    "lp_bytes_written_total", "Bytes written to job workspaces", ["kind"],
+)
+
+# モデルごとの料金の既定値（USD。input / output: 100万トークンあたり、request: 1回あたり）
+# プロンプトキャッシュの読み込み（cacheRead）・書き込み（cacheWrite）は、指定がなければ入力の0.1倍・1.25倍
+DEFAULT_MODEL_PRICES = {
+    "claude-3-7-sonnet-20250219": {"input": 3.0, "output": 15.0},
+    "gemini-2.0-flash": {"input": 0.1, "output": 0.4},
+    "imagen-3.0-generate-002": {"request": float(os.environ.get("LP_IMAGEN_COST_PER_IMAGE", "0.03"))},
+}
+
+
+# 環境変数から料金を読み込む（LP_MODEL_PRICES のJSONで既定値を上書きできる）
+def load_model_prices() -> Dict[str, Dict[str, float]]:
+    prices = {model: dict(price) for model, price in DEFAULT_MODEL_PRICES.items()}
+    overrides = os.environ.get("LP_MODEL_PRICES")
+    if overrides:
+        prices.update(json.loads(overrides))
+    return prices
+
+
+MODEL_PRICES = load_model_prices()
+
+
+def estimate_cost(model: str, input_tokens: int, output_tokens: int,
+                  cache_read_tokens: int = 0, cache_write_tokens: int = 0) -> float:
+    price = MODEL_PRICES.get(model, {})
+    input_price = price.get("input", 0.0)
+    return (
+        input_tokens * input_price / 1e6
+        + cache_read_tokens * price.get("cacheRead", input_price * 0.1) / 1e6
+        + cache_write_tokens * price.get("cacheWrite", input_price * 1.25) / 1e6
+        + output_tokens * price.get("output", 0.0) / 1e6
+        + price.get("request", 0.0)
+    )
+
+
+######################################
+## 記録
+######################################
+
+def _outcome(error: BaseException) -> str:
+    return "cancelled" if isinstance(error, asyncio.CancelledError) else "error"
+
+
+# 1つのジョブの実行（スパンを作成し、実行中のジョブ数と所要時間を記録する）
+@contextmanager
+def job_span(job_id: str, priority: str, resume: bool = False,
+             queue_wait_seconds: Optional[float] = None) -> Iterator[trace.Span]:
+    attributes = {"lp.job_id": job_id, "lp.priority": priority, "lp.resume": resume}
+    if queue_wait_seconds is not None:
+        JOB_QUEUE_WAIT_SECONDS.labels(priority).observe(queue_wait_seconds)
+        attributes["lp.queue_wait_seconds"] = round(queue_wait_seconds, 3)
+    started = time.perf_counter()
+    JOBS_RUNNING.inc()
+    try:
+        with tracer.start_as_current_span("job", attributes=attributes) as span:
+            yield span
+    finally:
+        JOBS_RUNNING.dec()
+        JOB_SECONDS.observe(time.perf_counter() - started)
+
+
+# ジョブの状態の変化（現在のスパンにイベントとして残す。エラーの場合はスパンをエラーにする）
+def record_job_transition(job_id: str, status: str, error: Optional[str] = None):
+    JOB_TRANSITIONS.labels(status).inc()
+    span = trace.get_current_span()
+    span.add_event("status", {"lp.job_id": job_id, "lp.status": status})
+    if status == "error":
+        span.set_status(Status(StatusCode.ERROR, error))
+
+
+# パイプラインの段階（エージェント）の関数に付けるデコレーター
+def traced_stage(stage_id: str):
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            outcome = "ok"
+            try:
+                with tracer.start_as_current_span(f"stage {stage_id}", attributes={"lp.stage": stage_id}):
+                    return await func(*args, **kwargs)
+            except BaseException as e:
+                outcome = _outcome(e)
+                raise
+            finally:
+                STAGE_SECONDS.labels(stage_id, outcome).observe(time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+# プロバイダーの呼び出し（permit はレート制限の RatePermit。トークン使用量は呼び出し中に記録される）
+@contextmanager
+def provider_call(permit) -> Iterator[trace.Span]:
+    RATE_LIMIT_WAIT_SECONDS.labels(permit.provider, permit.model).observe(permit.wait_seconds)
+    started = time.perf_counter()
+    outcome = "ok"
+    with tracer.start_as_current_span(f"{permit.provider} {permit.model}", attributes={
+        "gen_ai.system": permit.provider,
+        "gen_ai.request.model": permit.model,
+        "lp.priority": permit.priority,
+        "lp.rate_limit_wait_seconds": round(permit.wait_seconds, 3),
+    }) as span:
+        try:
+            yield span
+        except BaseException as e:
+            outcome = _outcome(e)
+            raise
+        finally:
+            PROVIDER_SECONDS.labels(permit.provider, permit.model, outcome).observe(time.perf_counter() - started)
+            if outcome == "ok":
+                record_provider_usage(permit, span)
+
+
+# トークン使用量と費用の見積もり
+def record_provider_usage(permit, span: Optional[trace.Span] = None):
+    tokens = {
+        "input": permit.input_tokens or 0,
+        "output": permit.output_tokens or 0,
+        "cache_read": permit.cache_read_tokens,
+        "cache_write": permit.cache_write_tokens,
+    }
+    for direction, count in tokens.items():
+        if count:
+            PROVIDER_TOKENS.labels(permit.provider, permit.model, direction).inc(count)
+    cost = estimate_cost(permit.model, tokens["input"], tokens["output"], tokens["cache_read"], tokens["cache_write"])
+    PROVIDER_COST.labels(permit.provider, permit.model).inc(cost)
+    (span or trace.get_current_span()).set_attributes({
+        "gen_ai.usage.input_tokens": tokens["input"],
+        "gen_ai.usage.output_tokens": tokens["output"],
+        "lp.usage.cache_read_tokens": tokens["cache_read"],
+        "lp.usage.cache_write_tokens": tokens["cache_write"],
+        "lp.cost_usd": round(cost, 6),
+    })
+
+
+def record_retry(provider: str, model: str, error: BaseException):
+    PROVIDER_RETRIES.labels(provider, model).inc()
+    trace.get_current_span().add_event("retry", {"gen_ai.request.model": model, "error": repr(error)})
+
+
+# キャッシュの参照結果（kind: claude / gemini / imagen / image-library、result: hit / miss / shared）
+def record_cache_lookup(kind: str, result: str):
+    CACHE_LOOKUPS.labels(kind, result).inc()
+
+
+def record_bytes_written(kind: str, size: int):
+    BYTES_WRITTEN.labels(kind).inc(size)
+
+
+######################################
+## 設定・公開
+######################################
+
+# ログの出力（LP_LOG_LEVEL=DEBUG でプロバイダーの応答などのデバッグ情報も出力する）
+def configure_logging():
+    logging.basicConfig(
+        level=os.environ.get("LP_LOG_LEVEL", "INFO").upper(),
+        format="%(asctime)s %(levelname)s [%(process)d] %(name)s: %(message)s",
+    )
+
+
+# トレースの出力先（LP_OTEL_EXPORTER）
+#   未設定: 設定しない（opentelemetry-instrument などで外部から設定された場合はそれに従う）
+#   console: 標準出力 / otlp: OTLP（OTEL_EXPORTER_OTLP_ENDPOINT に送信。opentelemetry-exporter-otlp が必要）
+def configure_tracing():
+    exporter_name = os.environ.get("LP_OTEL_EXPORTER", "").lower()
+    if not exporter_name:
+        return
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+
+    if exporter_name == "console":
+        exporter = ConsoleSpanExporter()
+    elif exporter_name == "otlp":
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        exporter = OTLPSpanExporter()
+    else:
+        raise ValueError(f"Unknown LP_OTEL_EXPORTER: {exporter_name}")
+    provider = TracerProvider(resource=Resource.create({
+        "service.name": os.environ.get("OTEL_SERVICE_NAME", "lp-generator"),
+    }))
+    provider.add_span_processor(BatchSpanProcessor(exporter))
+    trace.set_tracer_provider(provider)
+
+
+# 複数のワーカープロセスで起動する前に、メトリクスを共有するディレクトリを用意する
+# 前回の値（prometheus_client が書く *.db）のみを消す（PROMETHEUS_MULTIPROC_DIR で指定されたディレクトリの他のファイルは残す）
+def prepare_multiprocess_metrics(directory: str):
+    directory = os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", directory)
+    os.makedirs(directory, exist_ok=True)
+    for path in glob.glob(os.path.join(glob.escape(directory), "*.db")):
+        os.remove(path)
+
+
+# ワーカープロセスの終了時に呼ぶ（終了したプロセスの実行中のジョブ数を合計から外す）
+def shutdown_metrics():
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(os.getpid())
+    provider = trace.get_tracer_provider()
+    if hasattr(provider, "shutdown"):
+        provider.shutdown()
+
+
+# /metrics の本文と Content-Type
+def render_metrics() -> Tuple[bytes, str]:
+    registry = REGISTRY
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
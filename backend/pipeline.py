@@ -0,0 +1,183 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+######################################
+## 依存関係グラフ（DAG）によるパイプライン実行
+######################################
+
+# パイプラインの1段階
+#   - inputs: 実行に必要な値の名前（コンテキストのキー）
+#   - outputs: 実行結果としてコンテキストに追加される値の名前
+#   - func: inputs を辞書で受け取り、outputs をキーとする辞書を返すコルーチン関数
+class Stage:
+    def __init__(self, id: str, func: Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]],
+                 inputs: List[str], outputs: List[str]):
+        self.id = id
+        self.func = func
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+
+    def __repr__(self):
+        return f"Stage({self.id!r}, inputs={self.inputs}, outputs={self.outputs})"
+
+
+# 段階の定義に誤りがある場合の例外（未定義の入力、出力の重複、循環など）
+class PipelineDefinitionError(Exception):
+    pass
+
+
+# 入力が揃った段階から並行に実行するスケジューラー
+#   - save_checkpoint: 段階の完了時に出力を保存する関数
+#   - load_checkpoint: 保存済みの出力を返す関数（なければNone）
+#     依存する段階が全て復元できた段階は、実行せずに保存済みの出力を使う（再開）
+class PipelineScheduler:
+    def __init__(self, stages: List[Stage],
+                 on_stage_start: Optional[Callable[[Stage], None]] = None,
+                 on_stage_complete: Optional[Callable[[Stage, Dict[str, Any]], None]] = None,
+                 save_checkpoint: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+                 load_checkpoint: Optional[Callable[[str], Optional[Dict[str, Any]]]] = None):
+        self.stages = list(stages)
+        self.on_stage_start = on_stage_start
+        self.on_stage_complete = on_stage_complete
+        self.save_checkpoint = save_checkpoint
+        self.load_checkpoint = load_checkpoint
+        self._producers: Dict[str, Stage] = {}
+        for stage in self.stages:
+            for output in stage.outputs:
+                if output in self._producers:
+                    raise PipelineDefinitionError(f"Output '{output}' is produced by more than one stage")
+                self._producers[output] = stage
+        self._started_at: Optional[float] = None
+        self._timings: Dict[str, Dict[str, float]] = {}
+        self.restored_stages: List[str] = []
+
+    # 段階が依存している（入力を生成する）段階のID
+    def dependencies(self, stage: Stage) -> List[str]:
+        return sorted({
+            self._producers[name].id
+            for name in stage.inputs
+            if name in self._producers
+        })
+
+    def _validate(self, context: Dict[str, Any]):
+        for stage in self.stages:
+            for name in stage.inputs:
+                if name not in context and name not in self._producers:
+                    raise PipelineDefinitionError(f"Input '{name}' of stage '{stage.id}' is never produced")
+
+        self._topological_order()
+
+    # 依存関係の順に並べた段階（循環がある場合は例外）
+    def _topological_order(self) -> List[Stage]:
+        stages_by_id = {stage.id: stage for stage in self.stages}
+        remaining = {stage.id: set(self.dependencies(stage)) for stage in self.stages}
+        order: List[Stage] = []
+        while remaining:
+            ready = [stage_id for stage_id, deps in remaining.items() if not deps & remaining.keys()]
+            if not ready:
+                raise PipelineDefinitionError(f"Pipeline has a dependency cycle: {sorted(remaining)}")
+            for stage_id in ready:
+                del remaining[stage_id]
+                order.append(stages_by_id[stage_id])
+        return order
+
+    # 保存済みの出力から復元できる段階を、依存関係の順に復元する
+    # （上流の段階を再実行する場合、下流の保存済み出力は使わない）
+    def _restore_checkpoints(self, context: Dict[str, Any]) -> List[Stage]:
+        restored: List[Stage] = []
+        if self.load_checkpoint is None:
+            return restored
+
+        restored_ids = set()
+        for stage in self._topological_order():
+            if not set(self.dependencies(stage)) <= restored_ids:
+                continue
+            outputs = self.load_checkpoint(stage.id)
+            if outputs is None or any(name not in outputs for name in stage.outputs):
+                continue
+            context.update({name: outputs[name] for name in stage.outputs})
+            self._timings[stage.id] = {"start": 0.0, "end": 0.0, "restored": True}
+            restored_ids.add(stage.id)
+            restored.append(stage)
+            if self.on_stage_complete is not None:
+                self.on_stage_complete(stage, outputs)
+        return restored
+
+    # context に初期値を渡して全段階を実行し、全ての出力を含むコンテキストを返す
+    # いずれかの段階が失敗した場合は実行中の段階をキャンセルして例外を送出する
+    async def run(self, context: Dict[str, Any]) -> Dict[str, Any]:
+        self._validate(context)
+        context = dict(context)
+        self._started_at = time.monotonic()
+        self._timings = {}
+
+        restored = self._restore_checkpoints(context)
+        self.restored_stages = [stage.id for stage in restored]
+        pending = [stage for stage in self.stages if stage not in restored]
+        running: Dict[asyncio.Task, Stage] = {}
+        try:
+            while pending or running:
+                for stage in [s for s in pending if all(name in context for name in s.inputs)]:
+                    pending.remove(stage)
+                    self._timings[stage.id] = {"start": time.monotonic() - self._started_at}
+                    if self.on_stage_start is not None:
+                        self.on_stage_start(stage)
+                    inputs = {name: context[name] for name in stage.inputs}
+                    running[asyncio.create_task(stage.func(inputs), name=f"stage-{stage.id}")] = stage
+
+                done, _ = await asyncio.wait(running.keys(), return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    stage = running.pop(task)
+                    outputs = task.result()
+                    self._timings[stage.id]["end"] = time.monotonic() - self._started_at
+                    missing = [name for name in stage.outputs if name not in outputs]
+                    if missing:
+                        raise PipelineDefinitionError(f"Stage '{stage.id}' did not produce {missing}")
+                    context.update({name: outputs[name] for name in stage.outputs})
+                    if self.save_checkpoint is not None:
+                        self.save_checkpoint(stage.id, {name: outputs[name] for name in stage.outputs})
+                    if self.on_stage_complete is not None:
+                        self.on_stage_complete(stage, outputs)
+        finally:
+            for task in running:
+                task.cancel()
+            if running:
+                await asyncio.gather(*running.keys(), return_exceptions=True)
+
+        return context
+
+    # 段階ごとの実行時間とクリティカルパス（終了時刻を決めた依存関係の連鎖）を返す
+    def timing_report(self) -> Dict[str, Any]:
+        finished = {
+            stage.id: stage for stage in self.stages
+            if "end" in self._timings.get(stage.id, {})
+        }
+        stages = {
+            stage_id: {
+                "start": round(timing["start"], 3),
+                "end": round(timing["end"], 3),
+                "duration": round(timing["end"] - timing["start"], 3),
+                **({"restored": True} if timing.get("restored") else {}),
+            }
+            for stage_id, timing in self._timings.items()
+            if "end" in timing
+        }
+
+        critical_path: List[str] = []
+        if finished:
+            current = max(finished.values(), key=lambda s: self._timings[s.id]["end"])
+            while current is not None:
+                critical_path.append(current.id)
+                deps = [finished[d] for d in self.dependencies(current) if d in finished]
+                current = max(deps, key=lambda s: self._timings[s.id]["end"]) if deps else None
+            critical_path.reverse()
+
+        total = max((timing["end"] for timing in stages.values()), default=0)
+        return {
+            "stages": stages,
+            "restoredStages": list(self.restored_stages),
+            "criticalPath": critical_path,
+            "criticalPathSeconds": round(sum(stages[s]["duration"] for s in critical_path), 3),
+            "totalSeconds": round(total, 3),
+        }
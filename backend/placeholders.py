@@ -0,0 +1,194 @@
+import html as html_lib
+import os
+import re
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+######################################
+## 画像プレースホルダーの解決（生成した画像ファイルへの割り当て）
+######################################
+# ワイヤーフレーム（HTML）は placeholder_html_(番号).png、CSSは placeholder_css_(番号).png で画像を参照する
+# 生成した画像ファイルは同じ名前で保存されるため、参照ごとに対応するファイルを決めて置き換える
+
+PLACEHOLDER_PATTERN = re.compile(
+    r"placeholder_(?P<kind>html|css)_(?P<number>\d+)\.(?P<extension>png|jpe?g|webp|avif)\b", re.IGNORECASE
+)
+# ヒーローセクション（class / id に hero を含む要素）
+HERO_ELEMENT_PATTERN = re.compile(
+    r"<(?:section|header|div)\b[^>]*?\b(?P<attribute>class|id)\s*=\s*([\"'])(?P<value>[^\"']*\bhero\b[^\"']*)\2",
+    re.IGNORECASE,
+)
+
+# 画像の内容を決めるために渡す、周辺のテキストの最大文字数
+CONTEXT_CHARS = 300
+NON_CONTENT_PATTERN = re.compile(r"<(script|style|head)\b.*?</\1\s*>", re.IGNORECASE | re.DOTALL)
+TAG_PATTERN = re.compile(r"<[^>]+>")
+ALT_ATTRIBUTE_PATTERN = re.compile(r"""\balt\s*=\s*(["'])(?P<alt>[^"']*)\1""", re.IGNORECASE)
+CSS_RULE_PATTERN = re.compile(r"(?P<selector>[^{}]+)\{(?P<body>[^{}]*)\}")
+CSS_COMMENT_PATTERN = re.compile(r"/\*.*?\*/", re.DOTALL)
+
+
+# テキスト中のプレースホルダーのファイル名を出現順に返す（重複なし）
+def find_placeholders(text: str) -> List[str]:
+    return list(dict.fromkeys(match.group(0) for match in PLACEHOLDER_PATTERN.finditer(text or "")))
+
+
+def _placeholder_key(file_name: str) -> Optional[Tuple[str, int]]:
+    match = PLACEHOLDER_PATTERN.fullmatch(os.path.basename(file_name))
+    if match is None:
+        return None
+    return match.group("kind").lower(), int(match.group("number"))
+
+
+# プレースホルダーの参照を、生成した画像ファイルに割り当てるクラス
+#   1. 同じ名前のファイル
+#   2. 拡張子だけが異なるファイル（placeholder_css_1.jpg → placeholder_css_1.png）
+#   3. 同じ種類（html / css）の画像、続けて他の種類の画像を番号順に順番に割り当てる
+#      （生成されていない番号の参照が複数あっても、できるだけ別の画像になる）
+class PlaceholderResolver:
+    def __init__(self, file_names: Iterable[str]):
+        self.file_names = list(dict.fromkeys(file_names))
+        self._by_key: Dict[Tuple[str, int], str] = {}
+        self._by_kind: Dict[str, List[str]] = {}
+        for file_name in self.file_names:
+            key = _placeholder_key(file_name)
+            if key is None:
+                continue
+            self._by_key.setdefault(key, file_name)
+            self._by_kind.setdefault(key[0], []).append(file_name)
+        for names in self._by_kind.values():
+            names.sort(key=lambda name: _placeholder_key(name)[1])
+
+    def resolve(self, placeholder: str) -> Optional[str]:
+        if placeholder in self.file_names:
+            return placeholder
+        key = _placeholder_key(placeholder)
+        if key is None or not self.file_names:
+            return None
+        if key in self._by_key:
+            return self._by_key[key]
+        kind, number = key
+        same_kind = self._by_kind.get(kind, [])
+        candidates = same_kind + [name for name in self.file_names if name not in same_kind]
+        return candidates[(number - 1) % len(candidates)]
+
+    # テキスト中のプレースホルダーを置き換え、(置き換え後のテキスト, 参照 → ファイル名) を返す
+    def bind(self, text: str) -> Tuple[str, Dict[str, str]]:
+        bindings: Dict[str, str] = {}
+
+        def replace(match: re.Match) -> str:
+            resolved = self.resolve(match.group(0))
+            if resolved is None:
+                return match.group(0)
+            bindings[match.group(0)] = resolved
+            return resolved
+
+        return PLACEHOLDER_PATTERN.sub(replace, text), bindings
+
+
+# ヒーローセクションのCSSセレクター（見つからない場合は None）
+def find_hero_selector(html: str) -> Optional[str]:
+    match = HERO_ELEMENT_PATTERN.search(html or "")
+    if match is None:
+        return None
+    if match.group("attribute").lower() == "id":
+        return f"#{match.group('value').strip()}"
+    token = next(token for token in match.group("value").split() if re.search(r"\bhero\b", token))
+    return f".{token}"
+
+
+# CSSがヒーローセクションに背景画像を指定していなければ、規則に従って追加する
+# （暗いオーバーレイ・テキストの影で可読性を保つ。画像は次の番号の placeholder_css）
+def ensure_hero_background(html: str, css: str) -> str:
+    if any(_placeholder_key(name)[0] == "css" for name in find_placeholders(css)):
+        return css
+    selector = find_hero_selector(html)
+    if selector is None:
+        return css
+    numbers = [key[1] for key in map(_placeholder_key, find_placeholders(f"{html}\n{css}")) if key[0] == "css"]
+    image = f"placeholder_css_{max(numbers, default=0) + 1}.png"
+    return f"""{css.rstrip()}
+
+/* ヒーローセクションの背景画像 */
+{selector} {{
+  background-image: linear-gradient(rgba(0, 0, 0, 0.45), rgba(0, 0, 0, 0.45)), url('{image}');
+  background-size: cover;
+  background-position: center;
+  color: #fff;
+}}
+
+{selector} h1,
+{selector} h2,
+{selector} p {{
+  text-shadow: 0 2px 8px rgba(0, 0, 0, 0.6);
+}}
+"""
+
+
+######################################
+## 画像プレースホルダーの抽出（画像生成のプロンプト作成用）
+######################################
+
+# HTMLの一部からタグを除いたテキスト（最大 CONTEXT_CHARS 文字）
+def _visible_text(fragment: str) -> str:
+    text = TAG_PATTERN.sub(" ", NON_CONTENT_PATTERN.sub(" ", fragment))
+    return re.sub(r"\s+", " ", html_lib.unescape(text)).strip()[:CONTEXT_CHARS]
+
+
+# HTMLの position を含むセクション（<section>〜</section>）のテキスト。セクション外の場合は前後の文字
+def _section_text(html: str, position: int) -> str:
+    lower = html.lower()
+    start = lower.rfind("<section", 0, position)
+    end = lower.find("</section>", position)
+    if start < 0 or end < 0 or lower.rfind("</section>", start, position) >= 0:
+        start, end = max(0, position - CONTEXT_CHARS), position + CONTEXT_CHARS
+    return _visible_text(html[start:end])
+
+
+# CSSのセレクターに含まれる class / id の要素がHTMLで現れる位置
+def _selector_position(html: str, selector: str) -> Optional[int]:
+    for kind, name in re.findall(r"([.#])([\w-]+)", selector):
+        attribute = "class" if kind == "." else "id"
+        match = re.search(
+            rf"""\b{attribute}\s*=\s*(["'])(?:[^"']*\s)?{re.escape(name)}(?:\s[^"']*)?\1""", html, re.IGNORECASE
+        )
+        if match:
+            return match.start()
+    return None
+
+
+# HTML / CSS の画像プレースホルダーを出現順に抽出し、それぞれの周辺のテキストを添える
+#   - HTML: <img> の alt と、画像を含むセクションのテキスト
+#   - CSS: 背景画像を指定しているセレクターと、そのセレクターに一致する要素のセクションのテキスト
+# 戻り値は {"fileName", "kind", "context"} の一覧（ファイル名はワークスペース外を指さないよう名前部分のみ）
+def extract_placeholders(html: str, css: str) -> List[Dict[str, Any]]:
+    html = html or ""
+    placeholders: Dict[str, Dict[str, Any]] = {}
+
+    for match in PLACEHOLDER_PATTERN.finditer(html):
+        file_name = os.path.basename(match.group(0))
+        if file_name in placeholders:
+            continue
+        tag_start = html.rfind("<", 0, match.start())
+        tag = html[tag_start:html.find(">", match.end()) + 1] if tag_start >= 0 else ""
+        alt = ALT_ATTRIBUTE_PATTERN.search(tag)
+        context = _section_text(html, match.start())
+        placeholders[file_name] = {
+            "fileName": file_name,
+            "kind": "html",
+            "context": f"{alt.group('alt')} / {context}" if alt and alt.group("alt") else context,
+        }
+
+    for rule in CSS_RULE_PATTERN.finditer(CSS_COMMENT_PATTERN.sub("", css or "")):
+        selector = re.sub(r"\s+", " ", rule.group("selector")).strip()
+        for file_name in map(os.path.basename, find_placeholders(rule.group("body"))):
+            if file_name in placeholders:
+                continue
+            position = _selector_position(html, selector)
+            section = _section_text(html, position) if position is not None else ""
+            placeholders[file_name] = {
+                "fileName": file_name,
+                "kind": "css",
+                "context": f"background of `{selector}` / {section}".strip(" /"),
+            }
+
+    return list(placeholders.values())
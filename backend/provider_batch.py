@@ -0,0 +1,206 @@
+import asyncio
+import itertools
+import logging
+import os
+from abc import ABC, abstractmethod
+from contextvars import ContextVar
+from typing import Any, Dict, Optional, Set, Union
+
+import providers
+
+logger = logging.getLogger(__name__)
+
+######################################
+## プロバイダーのバッチAPIによるオフライン実行
+######################################
+
+# True の間は Claude の呼び出しを通常のAPIではなくバッチAPIで行う（ジョブごとに設定する）
+# バッチAPIは料金が安く上限も別枠だが、結果が返るまで数分〜数時間かかる
+offline_batch: ContextVar[bool] = ContextVar("offline_batch", default=False)
+
+
+# バッチ内の1件のリクエストが失敗した場合の例外
+class ProviderBatchError(Exception):
+    pass
+
+
+# バッチAPIの実行方式の基底クラス
+# run にはリクエストID → 呼び出しのパラメーター を渡し、
+# リクエストID → 結果（{"text", "usage": (入力, 出力, キャッシュの読み込み, キャッシュの書き込み)}）または例外 を返す
+class ProviderBatchBackend(ABC):
+    name = "base"
+
+    @abstractmethod
+    async def run(self, requests: Dict[str, Dict[str, Any]]) -> Dict[str, Union[Dict[str, Any], Exception]]:
+        ...
+
+
+def _message_result(message) -> Dict[str, Any]:
+    return {
+        "text": message.content[0].text,
+        "usage": providers.claude_usage(message.usage),
+    }
+
+
+# Anthropic の Message Batches API で実行する
+class AnthropicBatchBackend(ProviderBatchBackend):
+    name = "anthropic"
+
+    def __init__(self, poll_interval: float = 30.0):
+        self.poll_interval = poll_interval
+
+    async def run(self, requests: Dict[str, Dict[str, Any]]) -> Dict[str, Union[Dict[str, Any], Exception]]:
+        client = providers.get_anthropic_client()
+        batch = await client.messages.batches.create(
+            requests=[{"custom_id": custom_id, "params": params} for custom_id, params in requests.items()]
+        )
+        logger.info(f"Claudeのバッチを送信しました: {batch.id} ({len(requests)}件)")
+        try:
+            while batch.processing_status != "ended":
+                await asyncio.sleep(self.poll_interval)
+                batch = await client.messages.batches.retrieve(batch.id)
+        except asyncio.CancelledError:
+            # サーバーの停止時は処理中のバッチを取り消す（再開したジョブが改めて送信する）
+            await asyncio.shield(client.messages.batches.cancel(batch.id))
+            raise
+        logger.info(f"Claudeのバッチが完了しました: {batch.id} ({batch.request_counts})")
+
+        results: Dict[str, Union[Dict[str, Any], Exception]] = {}
+        async for entry in await client.messages.batches.results(batch.id):
+            if entry.result.type == "succeeded":
+                results[entry.custom_id] = _message_result(entry.result.message)
+            else:
+                error = getattr(entry.result, "error", None)
+                results[entry.custom_id] = ProviderBatchError(f"Batch request {entry.result.type}: {error}")
+        return results
+
+
+# バッチAPIを使わず、各リクエストを通常のAPIで並行に実行する
+# （バッチAPIを利用できない環境での動作確認用）
+class LocalBatchBackend(ProviderBatchBackend):
+    name = "local"
+
+    async def run(self, requests: Dict[str, Dict[str, Any]]) -> Dict[str, Union[Dict[str, Any], Exception]]:
+        client = providers.get_anthropic_client()
+
+        async def run_one(params: Dict[str, Any]) -> Dict[str, Any]:
+            return _message_result(await client.messages.create(**params))
+
+        outcomes = await asyncio.gather(*(run_one(params) for params in requests.values()), return_exceptions=True)
+        return dict(zip(requests.keys(), outcomes))
+
+
+# 複数のジョブの呼び出しを集めてまとめてバッチAPIに送信するクラス
+#   - 最初の呼び出しから window 秒の間に投入されたものを1つのバッチにまとめる
+#   - max_batch_size 件に達した場合はすぐに送信する
+class ProviderBatcher:
+    def __init__(self, backend: ProviderBatchBackend, max_batch_size: int = 100, window: float = 5.0):
+        self.backend = backend
+        self.max_batch_size = max(1, max_batch_size)
+        self.window = window
+        self._queued: Dict[str, tuple] = {}
+        self._sequence = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._batches: Set[asyncio.Task] = set()
+        self._counters = {"batches": 0, "requests": 0, "failed": 0}
+
+    # Claudeの呼び出しをバッチに追加し、結果のテキストを返す
+    # on_usage を渡すと (入力トークン数, 出力トークン数, キャッシュの読み込み, キャッシュの書き込み) が通知される
+    async def claude(self, system_prompt, prompt, model=providers.CLAUDE_MODEL, max_tokens=8192, temperature=1,
+                     on_usage=None, context=None) -> str:
+        params = providers.claude_message_params(system_prompt, prompt, model, max_tokens, temperature, context)
+        result = await self.submit(params)
+        if on_usage is not None:
+            on_usage(*result["usage"])
+        return result["text"]
+
+    async def submit(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        custom_id = f"lp-{os.getpid()}-{next(self._sequence)}"
+        self._queued[custom_id] = (params, future)
+        if len(self._queued) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+
+        try:
+            return await future
+        finally:
+            # 送信前にキャンセルされた呼び出しはバッチから除く
+            self._queued.pop(custom_id, None)
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        queued, self._queued = self._queued, {}
+        if not queued:
+            return
+        task = asyncio.create_task(self._run(queued), name="lp-provider-batch")
+        self._batches.add(task)
+        task.add_done_callback(self._batches.discard)
+
+    async def _run(self, queued: Dict[str, tuple]):
+        requests = {custom_id: params for custom_id, (params, future) in queued.items() if not future.done()}
+        if not requests:
+            return
+        self._counters["batches"] += 1
+        self._counters["requests"] += len(requests)
+        try:
+            results = await self.backend.run(requests)
+        except Exception as e:
+            logger.error(f"バッチの実行中にエラー ({self.backend.name}): {e}")
+            results = {custom_id: e for custom_id in requests}
+        except asyncio.CancelledError:
+            for _, future in queued.values():
+                future.cancel()
+            raise
+
+        for custom_id, (_, future) in queued.items():
+            if future.done():
+                continue
+            result = results.get(custom_id, ProviderBatchError("Missing result in provider batch"))
+            if isinstance(result, BaseException):
+                self._counters["failed"] += 1
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    async def close(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        for task in self._batches:
+            task.cancel()
+        await asyncio.gather(*self._batches, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": self.backend.name,
+            "queued": len(self._queued),
+            "running": len(self._batches),
+            **self._counters,
+        }
+
+
+# 環境変数から設定を読み込んでバッチ送信を作成する
+#   LP_PROVIDER_BATCH: anthropic（既定、Message Batches API） / local（通常のAPIで実行）
+#   LP_PROVIDER_BATCH_MAX_SIZE: 1つのバッチにまとめる最大件数
+#   LP_PROVIDER_BATCH_WINDOW_SECONDS: 呼び出しを集める時間
+#   LP_PROVIDER_BATCH_POLL_SECONDS: バッチの完了を確認する間隔
+def create_provider_batcher_from_env() -> ProviderBatcher:
+    backend_name = os.environ.get("LP_PROVIDER_BATCH", "anthropic")
+    if backend_name == "anthropic":
+        backend: ProviderBatchBackend = AnthropicBatchBackend(
+            poll_interval=float(os.environ.get("LP_PROVIDER_BATCH_POLL_SECONDS", "30")),
+        )
+    elif backend_name == "local":
+        backend = LocalBatchBackend()
+    else:
+        raise ValueError(f"Unknown provider batch backend: {backend_name}")
+    return ProviderBatcher(
+        backend,
+        max_batch_size=int(os.environ.get("LP_PROVIDER_BATCH_MAX_SIZE", "100")),
+        window=float(os.environ.get("LP_PROVIDER_BATCH_WINDOW_SECONDS", "5")),
+    )
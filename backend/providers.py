@@ -0,0 +1,267 @@
+import asyncio
+import base64
+import logging
+import os
+from typing import Any, Dict, Optional, Tuple
+
+import anthropic
+import httpx
+from dotenv import load_dotenv
+from google import genai
+from google.genai import types
+
+# 環境変数の読み込み
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+######################################
+## LLMプロバイダー層（非同期クライアント）
+######################################
+
+CLAUDE_MODEL = "claude-3-7-sonnet-20250219"
+GEMINI_MODEL = "gemini-2.0-flash"
+IMAGEN_MODEL = "imagen-3.0-generate-002"
+
+# プロセス全体で共有するHTTP接続プールの上限
+HTTP_MAX_CONNECTIONS = int(os.environ.get("LP_HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("LP_HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+HTTP_TIMEOUT_SECONDS = float(os.environ.get("LP_HTTP_TIMEOUT_SECONDS", "600"))
+# Claudeのプロンプトキャッシュ（システムプロンプトと、複数のエージェントで共有する入力を5分間キャッシュする）
+CLAUDE_PROMPT_CACHE = os.environ.get("LP_CLAUDE_PROMPT_CACHE", "1") not in ("0", "false", "off")
+
+# クライアントは初回利用時に作成し、以降は使い回す（TLSハンドシェイクを毎回行わない）
+_anthropic_client: Optional[anthropic.AsyncAnthropic] = None
+_gemini_client: Optional[genai.Client] = None
+_imagen_client: Optional[genai.Client] = None
+# Google系クライアントの同時リクエスト数を接続プールの上限に合わせて制限する
+_google_semaphore: Optional[asyncio.Semaphore] = None
+
+
+def get_anthropic_client() -> anthropic.AsyncAnthropic:
+    global _anthropic_client
+    if _anthropic_client is None:
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            ),
+            timeout=httpx.Timeout(HTTP_TIMEOUT_SECONDS, connect=10.0),
+        )
+        _anthropic_client = anthropic.AsyncAnthropic(
+            api_key=os.environ.get("ANTHROPIC_API_KEY"),
+            http_client=http_client,
+        )
+    return _anthropic_client
+
+
+def get_gemini_client() -> genai.Client:
+    global _gemini_client
+    if _gemini_client is None:
+        _gemini_client = genai.Client(api_key=os.environ.get("GEMINI_API_KEY"))
+    return _gemini_client
+
+
+# Imagen用クライアント（非同期呼び出しと、Rayワーカーからの同期呼び出しで共有する）
+def get_imagen_client() -> genai.Client:
+    global _imagen_client
+    if _imagen_client is None:
+        _imagen_client = genai.Client(api_key=os.environ.get("GOOGLE_IMAGEN_API_KEY"))
+    return _imagen_client
+
+
+def _get_google_semaphore() -> asyncio.Semaphore:
+    global _google_semaphore
+    if _google_semaphore is None:
+        _google_semaphore = asyncio.Semaphore(HTTP_MAX_CONNECTIONS)
+    return _google_semaphore
+
+
+## Claudeのシステムプロンプト
+## context（複数のエージェントに渡す同じ入力。例: HTML）はシステムプロンプトより前に置き、
+## エージェントが異なっても先頭が一致するようにする（プロンプトキャッシュは先頭からの一致で再利用される）
+def claude_system_blocks(system_prompt, context=None):
+    if not CLAUDE_PROMPT_CACHE:
+        return f"{context}\n\n{system_prompt}" if context else system_prompt
+    blocks = [{"type": "text", "text": text} for text in (context, system_prompt) if text]
+    for block in blocks:
+        block["cache_control"] = {"type": "ephemeral"}
+    return blocks
+
+
+## Claudeの呼び出しのパラメーター（通常の呼び出し・ストリーミング・バッチAPIで共通）
+def claude_message_params(system_prompt, prompt, model=CLAUDE_MODEL, max_tokens=8192, temperature=1,
+                          context=None) -> Dict[str, Any]:
+    return {
+        "model": model,
+        "max_tokens": max_tokens,
+        "temperature": temperature,
+        "system": claude_system_blocks(system_prompt, context),
+        "messages": [
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": prompt
+                    }
+                ]
+            }
+        ],
+    }
+
+
+## Claudeの応答のトークン使用量（入力, 出力, キャッシュから読み込んだ入力, キャッシュに書き込んだ入力）
+## 入力トークン数にはキャッシュの読み込み・書き込みの分は含まれない
+def claude_usage(usage) -> Tuple[int, int, int, int]:
+    return (
+        usage.input_tokens,
+        usage.output_tokens,
+        getattr(usage, "cache_read_input_tokens", None) or 0,
+        getattr(usage, "cache_creation_input_tokens", None) or 0,
+    )
+
+
+## Claudeでテキストを生成する
+## on_usage を渡すと (入力トークン数, 出力トークン数, キャッシュの読み込み, キャッシュの書き込み) が通知される
+async def claude_messages(system_prompt, prompt, model=CLAUDE_MODEL, max_tokens=8192, temperature=1, on_usage=None,
+                          context=None):
+    message = await get_anthropic_client().messages.create(
+        **claude_message_params(system_prompt, prompt, model, max_tokens, temperature, context)
+    )
+    if on_usage is not None:
+        on_usage(*claude_usage(message.usage))
+    return message.content[0].text
+
+
+## Claudeでテキストをストリーミング生成する
+## on_text には受信したテキスト片が順に渡される。戻り値は全文
+async def claude_stream(system_prompt, prompt, on_text=None, model=CLAUDE_MODEL, max_tokens=8192, temperature=1,
+                        on_usage=None, context=None):
+    async with get_anthropic_client().messages.stream(
+        **claude_message_params(system_prompt, prompt, model, max_tokens, temperature, context)
+    ) as stream:
+        async for text in stream.text_stream:
+            if on_text is not None:
+                on_text(text)
+        message = await stream.get_final_message()
+    if on_usage is not None:
+        on_usage(*claude_usage(message.usage))
+    return message.content[0].text
+
+
+## Geminiでテキストを生成する
+async def gemini_generate(system_instruction, prompt, generation_config: Dict[str, Any], model=GEMINI_MODEL,
+                          on_usage=None):
+    config = types.GenerateContentConfig(
+        system_instruction=system_instruction,
+        **generation_config,
+    )
+    async with _get_google_semaphore():
+        response = await get_gemini_client().aio.models.generate_content(
+            model=model,
+            contents=prompt,
+            config=config,
+        )
+    usage = response.usage_metadata
+    if on_usage is not None and usage is not None:
+        # prompt_token_count には暗黙的なキャッシュから読み込んだ分が含まれる
+        cached = getattr(usage, "cached_content_token_count", None) or 0
+        on_usage((usage.prompt_token_count or 0) - cached, usage.candidates_token_count, cached, 0)
+    return response.text
+
+
+## Imagenのレスポンスのデバッグ情報を出力する（LP_LOG_LEVEL=DEBUG の場合のみ。dir() の列挙は重いため）
+def _log_imagen_response(response):
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    logger.debug(f"Response type: {type(response)}")
+    logger.debug(f"Response dir: {dir(response)}")
+    
+    if hasattr(response, 'generated_images'):
+        logger.debug(f"Generated images count: {len(response.generated_images) if response.generated_images else 0}")
+        if response.generated_images:
+            logger.debug(f"First image type: {type(response.generated_images[0])}")
+            logger.debug(f"First image dir: {dir(response.generated_images[0])}")
+            
+            if hasattr(response.generated_images[0], 'image'):
+                logger.debug(f"Image object type: {type(response.generated_images[0].image)}")
+                logger.debug(f"Image object dir: {dir(response.generated_images[0].image)}")
+                if hasattr(response.generated_images[0].image, 'image_bytes'):
+                    image_bytes = response.generated_images[0].image.image_bytes
+                    logger.debug(f"Image bytes type: {type(image_bytes)}")
+                    logger.debug(f"Image bytes length: {len(image_bytes) if image_bytes else 'None'}")
+                    if image_bytes:
+                        logger.debug(f"First 50 bytes: {image_bytes[:50]}")
+
+
+## Imagenのレスポンスから画像のバイト列を取り出す（Base64エンコードされている場合はデコード）
+def _imagen_image_bytes(response) -> bytes:
+    _log_imagen_response(response)
+    image_bytes = response.generated_images[0].image.image_bytes
+    if isinstance(image_bytes, bytes) and image_bytes.startswith(b'iVBORw0KGgo'):
+        try:
+            return base64.b64decode(image_bytes)
+        except Exception as e:
+            logger.warning(f"Base64デコードエラー: {e}")
+    return image_bytes
+
+
+def _imagen_config(aspect_ratio: str) -> types.GenerateImagesConfig:
+    return types.GenerateImagesConfig(
+        number_of_images=1,
+        aspect_ratio=aspect_ratio,
+        personGeneration="ALLOW_ADULT",
+    )
+
+
+## Imagenで画像を生成し、画像のバイト列を返す
+async def imagen_generate(prompt, aspect_ratio, model=IMAGEN_MODEL) -> bytes:
+    async with _get_google_semaphore():
+        response = await get_imagen_client().aio.models.generate_images(
+            model=model,
+            prompt=prompt,
+            config=_imagen_config(aspect_ratio),
+        )
+    return _imagen_image_bytes(response)
+
+
+## Imagenで画像を生成する（同期版。イベントループのないRayワーカーから使う）
+def imagen_generate_sync(prompt, aspect_ratio, model=IMAGEN_MODEL) -> bytes:
+    response = get_imagen_client().models.generate_images(
+        model=model,
+        prompt=prompt,
+        config=_imagen_config(aspect_ratio),
+    )
+    return _imagen_image_bytes(response)
+
+
+## Google系クライアント（google-genai）の接続を閉じる
+## close / aclose のない古いバージョンでは内部のHTTPクライアントを閉じる
+async def _close_google_client(client: genai.Client):
+    aio = getattr(client, "aio", None)
+    if hasattr(aio, "aclose"):
+        await aio.aclose()
+    if hasattr(client, "close"):
+        client.close()
+        return
+    http_client = getattr(getattr(client, "_api_client", None), "_httpx_client", None)
+    if http_client is not None:
+        http_client.close()
+
+
+## アプリ終了時に接続プールを閉じる
+async def aclose():
+    global _anthropic_client, _gemini_client, _imagen_client
+    if _anthropic_client is not None:
+        await _anthropic_client.close()
+        _anthropic_client = None
+    for client in (_gemini_client, _imagen_client):
+        if client is None:
+            continue
+        try:
+            await _close_google_client(client)
+        except Exception as e:
+            logger.warning(f"Google系クライアントを閉じる際のエラー: {e}")
+    _gemini_client = None
+    _imagen_client = None
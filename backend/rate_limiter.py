@@ -0,0 +1,282 @@
+import asyncio
+import heapq
+import itertools
+import json
+import math
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from observability import provider_call
+
+######################################
+## プロバイダー呼び出しのレート制限（全ジョブ共通）
+######################################
+
+# 優先度クラス（先頭ほど優先）
+PRIORITIES = ("interactive", "batch")
+
+# 現在のリクエストの優先度（ジョブごとに設定する）
+request_priority: ContextVar[str] = ContextVar("request_priority", default="interactive")
+# 現在のジョブのトークン使用量（モデル → {"requests", "inputTokens", "outputTokens"}）
+# ジョブの開始時に空の辞書を設定すると、そのジョブ（と各段階のタスク）の呼び出しが集計される
+token_usage: ContextVar[Optional[Dict[str, Dict[str, int]]]] = ContextVar("token_usage", default=None)
+
+# 入力トークン数を概算する係数（日本語を含むため1トークン≒3文字とする）
+CHARS_PER_TOKEN = 3
+
+
+def estimate_tokens(*texts: str) -> int:
+    return math.ceil(sum(len(text) for text in texts if text) / CHARS_PER_TOKEN)
+
+
+# 1分あたりの上限量で補充されるトークンバケット
+class TokenBucket:
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.level = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    # amount を取り出せるまでの秒数（今すぐ取り出せるなら0）
+    def time_until(self, amount: float, now: float) -> float:
+        self._refill(now)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def take(self, amount: float, now: float):
+        self._refill(now)
+        self.level -= amount
+
+    # 予約した量と実際の使用量の差を戻す（使用量が多かった場合はマイナスになり、次の呼び出しが待つ）
+    def give(self, amount: float):
+        self._refill(time.monotonic())
+        self.level = min(self.capacity, self.level + amount)
+
+
+# 1回の呼び出しの許可（実際のトークン使用量を記録する）
+class RatePermit:
+    def __init__(self, provider: str, model: str, reserved_tokens: int, priority: str, wait_seconds: float):
+        self.provider = provider
+        self.model = model
+        self.reserved_tokens = reserved_tokens
+        self.priority = priority
+        self.wait_seconds = wait_seconds
+        self.input_tokens: Optional[int] = None
+        self.output_tokens: Optional[int] = None
+        self.cache_read_tokens = 0
+        self.cache_write_tokens = 0
+
+    # プロバイダーの応答に含まれるトークン使用量を記録する
+    # （プロンプトキャッシュの読み込み・書き込みの分は input_tokens に含めずに渡される）
+    def record_usage(self, input_tokens: Optional[int], output_tokens: Optional[int],
+                     cache_read_tokens: Optional[int] = 0, cache_write_tokens: Optional[int] = 0):
+        self.input_tokens = input_tokens or 0
+        self.output_tokens = output_tokens or 0
+        self.cache_read_tokens = cache_read_tokens or 0
+        self.cache_write_tokens = cache_write_tokens or 0
+
+    # レート制限で数えるトークン数（キャッシュから読み込んだ入力は入力トークンの上限に数えられない）
+    @property
+    def used_tokens(self) -> int:
+        if self.input_tokens is None:
+            return self.reserved_tokens
+        return self.input_tokens + self.cache_write_tokens + self.output_tokens
+
+
+# プロバイダー・モデルごとのレート制限
+#   - requests_per_minute: 1分あたりのリクエスト数
+#   - tokens_per_minute: 1分あたりのトークン数（入力と出力の合計。Noneなら制限しない）
+# 呼び出し前に想定トークン数を予約し、終了後に実際の使用量との差を精算する
+# 待機中の呼び出しは優先度の高い順、同じ優先度では到着順に許可する
+class ModelRateLimiter:
+    def __init__(self, provider: str, model: str, requests_per_minute: float,
+                 tokens_per_minute: Optional[float] = None, wait_samples: int = 1000):
+        self.provider = provider
+        self.model = model
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self._waiters: List[list] = []
+        self._sequence = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._waits: deque = deque(maxlen=wait_samples)
+        self._counters = {"granted": 0, "reservedTokens": 0, "usedTokens": 0}
+        self._granted_by_priority = {priority: 0 for priority in PRIORITIES}
+
+    async def acquire(self, tokens: int, priority: str) -> RatePermit:
+        if self.tokens is not None:
+            # 1回でバケットの容量を超える呼び出しも、満杯になれば実行できるようにする
+            tokens = min(tokens, int(self.tokens.capacity))
+        rank = PRIORITIES.index(priority) if priority in PRIORITIES else len(PRIORITIES)
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, [rank, next(self._sequence), tokens, future])
+        started = time.monotonic()
+        self._schedule()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # 許可された直後にキャンセルされた場合は予約を戻す
+                self.requests.give(1)
+                if self.tokens is not None:
+                    self.tokens.give(tokens)
+            self._schedule()
+            raise
+
+        wait_seconds = time.monotonic() - started
+        self._waits.append(wait_seconds)
+        self._counters["granted"] += 1
+        self._counters["reservedTokens"] += tokens
+        self._granted_by_priority[priority] = self._granted_by_priority.get(priority, 0) + 1
+        return RatePermit(self.provider, self.model, tokens, priority, wait_seconds)
+
+    # 予約したトークン数と実際の使用量の差を精算する
+    def settle(self, permit: RatePermit):
+        self._counters["usedTokens"] += permit.used_tokens
+        if self.tokens is not None:
+            self.tokens.give(permit.reserved_tokens - permit.used_tokens)
+        self._schedule()
+
+    # 先頭の待機者から、バケットに空きがある限り許可する。空きがなければ補充される時刻に再度呼ぶ
+    def _schedule(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        while self._waiters:
+            _, _, tokens, future = self._waiters[0]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+
+            now = time.monotonic()
+            delay = self.requests.time_until(1, now)
+            if self.tokens is not None:
+                delay = max(delay, self.tokens.time_until(tokens, now))
+            if delay > 0:
+                self._timer = asyncio.get_running_loop().call_later(delay, self._schedule)
+                return
+
+            heapq.heappop(self._waiters)
+            self.requests.take(1, now)
+            if self.tokens is not None:
+                self.tokens.take(tokens, now)
+            future.set_result(None)
+
+    def stats(self) -> Dict[str, Any]:
+        waits = sorted(self._waits)
+        waiting = {priority: 0 for priority in PRIORITIES}
+        for rank, _, _, future in self._waiters:
+            if not future.done() and rank < len(PRIORITIES):
+                waiting[PRIORITIES[rank]] += 1
+        now = time.monotonic()
+        self.requests._refill(now)
+        if self.tokens is not None:
+            self.tokens._refill(now)
+        return {
+            "provider": self.provider,
+            "model": self.model,
+            "requestsPerMinute": self.requests.capacity,
+            "tokensPerMinute": self.tokens.capacity if self.tokens is not None else None,
+            "availableRequests": round(self.requests.level, 2),
+            "availableTokens": round(self.tokens.level) if self.tokens is not None else None,
+            "waiting": waiting,
+            "grantedByPriority": dict(self._granted_by_priority),
+            **self._counters,
+            "avgWaitSeconds": round(sum(waits) / len(waits), 3) if waits else 0.0,
+            "p95WaitSeconds": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))], 3) if waits else 0.0,
+            "maxWaitSeconds": round(waits[-1], 3) if waits else 0.0,
+        }
+
+
+# 全てのプロバイダー・モデルのレート制限をまとめるクラス
+# 上限が設定されていないモデルは制限せず、トークン使用量の集計のみ行う
+class RateLimiter:
+    def __init__(self, limits: Dict[str, Dict[str, float]]):
+        self.limits = limits
+        self._limiters: Dict[Tuple[str, str], ModelRateLimiter] = {}
+
+    def _limiter(self, provider: str, model: str) -> Optional[ModelRateLimiter]:
+        key = (provider, model)
+        if key not in self._limiters:
+            limit = self.limits.get(model)
+            if limit is None:
+                return None
+            self._limiters[key] = ModelRateLimiter(
+                provider, model,
+                requests_per_minute=limit["rpm"],
+                tokens_per_minute=limit.get("tpm"),
+            )
+        return self._limiters[key]
+
+    # プロバイダーを呼び出す間、許可を保持する（呼び出しの所要時間・トークン使用量は observability で計測する）
+    #   tokens: 予約するトークン数（入力の概算 + 出力の上限）
+    #   priority: 省略時は request_priority の値
+    @asynccontextmanager
+    async def limit(self, provider: str, model: str, tokens: int = 0,
+                    priority: Optional[str] = None) -> AsyncIterator[RatePermit]:
+        priority = priority or request_priority.get()
+        limiter = self._limiter(provider, model)
+        if limiter is None:
+            permit = RatePermit(provider, model, tokens, priority, 0.0)
+        else:
+            permit = await limiter.acquire(tokens, priority)
+        try:
+            with provider_call(permit):
+                yield permit
+        finally:
+            if limiter is not None:
+                limiter.settle(permit)
+            record_token_usage(permit)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "limits": self.limits,
+            "models": [limiter.stats() for limiter in self._limiters.values()],
+        }
+
+
+# 現在のジョブのトークン使用量に加算する
+def record_token_usage(permit: RatePermit):
+    usage = token_usage.get()
+    if usage is None:
+        return
+    entry = usage.setdefault(permit.model, {"requests": 0, "inputTokens": 0, "outputTokens": 0})
+    entry["requests"] += 1
+    entry["inputTokens"] += permit.input_tokens or 0
+    entry["outputTokens"] += permit.output_tokens or 0
+    if permit.cache_read_tokens or permit.cache_write_tokens:
+        entry["cacheReadTokens"] = entry.get("cacheReadTokens", 0) + permit.cache_read_tokens
+        entry["cacheWriteTokens"] = entry.get("cacheWriteTokens", 0) + permit.cache_write_tokens
+
+
+# 既定の上限（全ワーカー合計。LP_RATE_LIMITS のJSONで上書きできる）
+DEFAULT_RATE_LIMITS = {
+    "claude-3-7-sonnet-20250219": {"rpm": 50, "tpm": 100000},
+    "gemini-2.0-flash": {"rpm": 2000, "tpm": 4000000},
+    "imagen-3.0-generate-002": {"rpm": 20},
+}
+
+
+# 環境変数から設定を読み込んでレート制限を作成する
+# 上限はワーカープロセス数（LP_WORKERS）で等分する
+def create_rate_limiter_from_env() -> RateLimiter:
+    limits = {model: dict(limit) for model, limit in DEFAULT_RATE_LIMITS.items()}
+    overrides = os.environ.get("LP_RATE_LIMITS")
+    if overrides:
+        for model, limit in json.loads(overrides).items():
+            limits[model] = limit
+    workers = max(1, int(os.environ.get("LP_WORKERS", "1")))
+    return RateLimiter({
+        model: {key: value / workers for key, value in limit.items() if value}
+        for model, limit in limits.items()
+        if limit
+    })
@@ -0,0 +1,211 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, TypeVar
+
+######################################
+## エージェント呼び出しの応答キャッシュ（内容アドレス方式）
+######################################
+
+# True の間はキャッシュを参照しない（新しい出力が欲しいリクエスト用）
+# 書き込みは行うため、次回以降のリクエストでは再利用される
+cache_bypass: ContextVar[bool] = ContextVar("cache_bypass", default=False)
+
+
+# モデル・プロンプト・生成設定から決まるキャッシュキー（SHA-256）
+def make_cache_key(kind: str, **parts: Any) -> str:
+    payload = json.dumps({"kind": kind, **parts}, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+# ディスク上に応答を保存するキャッシュ（複数のワーカープロセスで同じディレクトリを共有できる）
+#   - 合計サイズが max_bytes を超えると、最も長く使われていないものから削除（LRU）
+#   - 保存から ttl_seconds を過ぎたものは無効
+class ResponseCache:
+    def __init__(self, directory: str, max_bytes: int, ttl_seconds: float):
+        self.directory = os.path.abspath(directory)
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        # キー → (サイズ, 保存時刻)。先頭ほど長く使われていない
+        self._index: "OrderedDict[str, tuple]" = OrderedDict()
+        self._total_bytes = 0
+        self._counters = {"hits": 0, "misses": 0, "bypassed": 0, "writes": 0, "evictions": 0}
+        os.makedirs(self.directory, exist_ok=True)
+        self._load_index()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key)
+
+    # 起動時にディスク上のエントリを読み込む（更新時刻の古い順）
+    def _load_index(self):
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".tmp"):
+                    continue
+                stat = os.stat(os.path.join(root, name))
+                entries.append((stat.st_mtime, name, stat.st_size))
+        for mtime, key, size in sorted(entries):
+            self._index[key] = (size, mtime)
+            self._total_bytes += size
+        self._evict()
+
+    # 他のワーカープロセスが保存したエントリを索引に取り込む（なければNone）
+    def _adopt(self, key: str) -> Optional[tuple]:
+        try:
+            stat = os.stat(self._path(key))
+        except FileNotFoundError:
+            return None
+        entry = (stat.st_size, stat.st_mtime)
+        self._index[key] = entry
+        self._total_bytes += stat.st_size
+        return entry
+
+    def _remove(self, key: str):
+        size, _ = self._index.pop(key)
+        self._total_bytes -= size
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self):
+        while self._total_bytes > self.max_bytes and self._index:
+            self._remove(next(iter(self._index)))
+            self._counters["evictions"] += 1
+
+    def get_bytes(self, key: str) -> Optional[bytes]:
+        if cache_bypass.get():
+            with self._lock:
+                self._counters["bypassed"] += 1
+            return None
+
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is None:
+                entry = self._adopt(key)
+            if entry is not None and time.time() - entry[1] > self.ttl_seconds:
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self._counters["misses"] += 1
+                return None
+            self._index.move_to_end(key)
+
+        try:
+            with open(self._path(key), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            with self._lock:
+                if key in self._index:
+                    self._remove(key)
+                self._counters["misses"] += 1
+            return None
+
+        with self._lock:
+            self._counters["hits"] += 1
+        return data
+
+    def set_bytes(self, key: str, data: bytes):
+        if len(data) > self.max_bytes:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 書き込み途中のファイルを読まないよう、一時ファイル経由で置き換える
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            if key in self._index:
+                size, _ = self._index.pop(key)
+                self._total_bytes -= size
+            self._index[key] = (len(data), time.time())
+            self._total_bytes += len(data)
+            self._counters["writes"] += 1
+            self._evict()
+
+    def get_text(self, key: str) -> Optional[str]:
+        data = self.get_bytes(key)
+        return data.decode("utf-8") if data is not None else None
+
+    def set_text(self, key: str, text: str):
+        self.set_bytes(key, text.encode("utf-8"))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._counters["hits"] + self._counters["misses"]
+            return {
+                **self._counters,
+                "hitRate": round(self._counters["hits"] / lookups, 3) if lookups else 0.0,
+                "entries": len(self._index),
+                "bytes": self._total_bytes,
+                "maxBytes": self.max_bytes,
+                "ttlSeconds": self.ttl_seconds,
+            }
+
+
+T = TypeVar("T")
+
+
+# 同じキーの呼び出しが実行中なら、新しく実行せずにその結果を待つ（シングルフライト）
+# キャッシュは完了した呼び出ししか再利用できないため、同時に投入された同じプロンプト
+# （バッチ内の同じ段階など）の重複をここで防ぐ。対象は同じプロセス内の呼び出しのみ
+class SingleFlight:
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Future] = {}
+        self._counters = {"calls": 0, "deduplicated": 0}
+
+    # 戻り値は (結果, 自分で実行したか)
+    async def run(self, key: str, func: Callable[[], Awaitable[T]]) -> Tuple[T, bool]:
+        self._counters["calls"] += 1
+        while key in self._calls:
+            future = self._calls[key]
+            self._counters["deduplicated"] += 1
+            try:
+                # 待っている側がキャンセルされても、実行中の呼び出しは止めない
+                return await asyncio.shield(future), False
+            except asyncio.CancelledError:
+                # 実行していた側がキャンセルされた場合は、自分で実行し直す
+                if not future.cancelled():
+                    raise
+                self._counters["deduplicated"] -= 1
+
+        future = asyncio.get_running_loop().create_future()
+        self._calls[key] = future
+        try:
+            result = await func()
+        except BaseException as e:
+            if isinstance(e, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(e)
+                # 待っている呼び出しがなくても「取得されなかった例外」の警告を出さない
+                future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result, True
+        finally:
+            self._calls.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self._counters, "inFlight": len(self._calls)}
+
+
+# 環境変数から設定を読み込んでキャッシュを作成する
+def create_response_cache_from_env() -> ResponseCache:
+    directory = os.environ.get(
+        "LP_CACHE_DIR",
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache"),
+    )
+    max_bytes = int(os.environ.get("LP_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+    ttl_seconds = float(os.environ.get("LP_CACHE_TTL_SECONDS", str(7 * 24 * 60 * 60)))
+    return ResponseCache(directory, max_bytes, ttl_seconds)
@@ -0,0 +1,31 @@
+from incremental import replace_html_text, update_outline_text
+
+
+def test_replace_html_text_leaves_markup_unchanged():
+    html = (
+        '<section id="acme" class="acme-hero" data-name="Acme">\n'
+        '  <h1>Acme</h1>\n'
+        '  <img src="placeholder_html_1.png" alt="Acme">\n'
+        '  <p>Acme &amp; Co</p>\n'
+        '  <script>document.querySelector(".acme-hero")</script>\n'
+        '</section>'
+    )
+    assert replace_html_text(html, {"Acme": "Beta", "Acme & Co": "Beta & Sons"}) == (
+        '<section id="acme" class="acme-hero" data-name="Acme">\n'
+        '  <h1>Beta</h1>\n'
+        '  <img src="placeholder_html_1.png" alt="Acme">\n'
+        '  <p>Beta &amp; Sons</p>\n'
+        '  <script>document.querySelector(".acme-hero")</script>\n'
+        '</section>'
+    )
+
+
+def test_replace_html_text_matches_lowercase_class_name_only_in_text():
+    html = '<div class="hero"><p>hero</p></div>'
+    assert replace_html_text(html, {"hero": "<Hero>"}) == '<div class="hero"><p>&lt;Hero&gt;</p></div>'
+
+
+def test_update_outline_text_does_not_chain_replacements():
+    outline = {"title": "Alpha by Beta", "siteName": "Alpha", "copyright": "© Beta", "sections": []}
+    updated = update_outline_text(outline, {"Alpha": "Beta", "Beta": "Gamma"})
+    assert (updated["title"], updated["siteName"], updated["copyright"]) == ("Beta by Gamma", "Beta", "© Gamma")
@@ -0,0 +1,58 @@
+import os
+import tempfile
+from datetime import datetime
+
+# main はインポート時にジョブ保存先を決めるため、先に一時ディレクトリを指定する
+os.environ.setdefault("LP_JOBS_DIR", tempfile.mkdtemp(prefix="lp-jobs-test-"))
+os.environ.setdefault("LP_EVENT_BACKEND", "sqlite")
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+import main  # noqa: E402
+
+client = TestClient(main.app)
+
+
+def create_processing_job() -> str:
+    job_id = main.create_pending_job({"serviceName": "テスト"})
+    main.job_store.update(job_id, {"status": "processing", "updatedAt": datetime.now().isoformat()})
+    return job_id
+
+
+def published_event_ids(job_id: str):
+    rows = main.job_events._conn.execute("SELECT id FROM job_events WHERE job_id = ? ORDER BY id", (job_id,))
+    return [row[0] for row in rows]
+
+
+def parse_sse(body: str):
+    events = []
+    for block in body.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines() if not line.startswith(":"))
+        if fields:
+            events.append((int(fields["id"]), fields["event"]))
+    return events
+
+
+def test_reconnect_resumes_after_last_event_id():
+    job_id = create_processing_job()
+    main.job_events.publish(job_id, "delta", {"step": "wireframe", "offset": 0, "text": "<html>"})
+    main.job_events.publish(job_id, "delta", {"step": "wireframe", "offset": 6, "text": "<body>"})
+    main.job_events.publish(job_id, "completed", {"resultUrl": f"/api/jobs/{job_id}/result"})
+
+    first_delta, second_delta, completed = published_event_ids(job_id)
+
+    # 最初の差分まで受け取って切断した購読者が再接続する
+    response = client.get(f"/api/jobs/{job_id}/events", headers={"Last-Event-ID": str(first_delta)})
+    events = parse_sse(response.text)
+    assert events == [(second_delta, "delta"), (completed, "completed")]
+
+
+def test_reconnect_with_unknown_event_id_falls_back_to_snapshot():
+    job_id = create_processing_job()
+    main.job_events.publish(job_id, "delta", {"step": "wireframe", "offset": 0, "text": "<html>"})
+    main.job_events.publish(job_id, "error", {"error": "failed"})
+    main.job_store.update(job_id, {"status": "error", "error": "failed"})
+
+    response = client.get(f"/api/jobs/{job_id}/events", headers={"Last-Event-ID": "999999"})
+    events = parse_sse(response.text)
+    assert [event_type for _, event_type in events] == ["snapshot"]
@@ -0,0 +1,31 @@
+from wireframe_sections import fill_page, split_page
+
+PAGE = """<!DOCTYPE html>
+<html lang="ja">
+<head><title>Acme &amp; Co</title></head>
+<body>
+  <header><a href="#features">特長</a></header>
+  <section id="hero"><h1>Acme <span>LP</span></h1><section class="inner">入れ子</section></section>
+  <!-- <section>コメント</section> -->
+  <div class="cta">お申し込み</div>
+  <section id="features"><h2>特長</h2><p>速い</p></section>
+  <script>const template = "<section>";</script>
+  <footer>© Acme</footer>
+</body>
+</html>"""
+
+
+def test_split_page_keeps_top_level_sections_and_shell():
+    sections_data = split_page(PAGE)
+    outline = sections_data["outline"]
+    assert outline["title"] == "Acme & Co"
+    assert [(section["id"], section["name"]) for section in outline["sections"]] == [
+        ("hero", "Acme LP"), ("features", "特長"),
+    ]
+    assert all(section["sources"] == [] for section in outline["sections"])
+    assert "<section" not in sections_data["shell"].replace("<!-- <section>", "").replace('"<section>"', "")
+    assert fill_page(sections_data["shell"], outline, sections_data["fragments"]) == PAGE
+
+
+def test_split_page_without_sections():
+    assert split_page("<html><body><div>本文</div></body></html>") is None
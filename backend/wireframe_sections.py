@@ -0,0 +1,245 @@
+import html as html_lib
+import re
+from typing import Any, Dict, List, Optional
+
+from placeholders import PLACEHOLDER_PATTERN
+
+######################################
+## セクションごとに生成したワイヤーフレームの組み立て
+######################################
+# 構成案から作成したアウトライン（セクションの一覧）に従ってセクションごとに並行に生成したHTMLの断片を、
+# 共通の骨組み（head・ヘッダー・フッター・スクリプト）に組み込んで1つのページにする
+#   - ヘッダーのナビゲーションはアウトラインのセクションから作成する
+#   - 画像のプレースホルダー（placeholder_html_(番号).png）はセクションごとに番号が重なるため、ページ全体で振り直す
+# 1回で作成したページも、最上位の <section> ごとに分けて同じ形式で保存する（部分的な再生成に使う）
+
+SECTION_ID_PATTERN = re.compile(r"[^a-z0-9]+")
+BODY_PATTERN = re.compile(r"<body\b[^>]*>(?P<body>.*)</body\s*>", re.IGNORECASE | re.DOTALL)
+SCRIPT_PATTERN = re.compile(r"<script\b.*?</script\s*>", re.IGNORECASE | re.DOTALL)
+LEADING_HEADER_PATTERN = re.compile(r"^\s*<header\b.*?</header\s*>", re.IGNORECASE | re.DOTALL)
+TRAILING_FOOTER_PATTERN = re.compile(r"<footer\b(?:(?!<footer\b).)*</footer\s*>\s*$", re.IGNORECASE | re.DOTALL)
+FIRST_TAG_PATTERN = re.compile(r"<(?P<tag>[a-zA-Z][\w-]*)\b(?P<attributes>[^>]*?)(?P<close>/?)>")
+ID_ATTRIBUTE_PATTERN = re.compile(r"\bid\s*=", re.IGNORECASE)
+SECTION_TAG_PATTERN = re.compile(r"<(?P<close>/?)section\b[^>]*>", re.IGNORECASE)
+# <script> / <style> とその中身・コメント（<section> を探す対象から除く）
+NON_CONTENT_PATTERN = re.compile(r"<(script|style)\b.*?</\1\s*>|<!--.*?-->", re.IGNORECASE | re.DOTALL)
+ID_VALUE_PATTERN = re.compile(r"""\bid\s*=\s*(["']?)(?P<id>[^"'\s>]+)\1""", re.IGNORECASE)
+HEADING_PATTERN = re.compile(r"<h[1-6]\b[^>]*>(?P<text>.*?)</h[1-6]\s*>", re.IGNORECASE | re.DOTALL)
+TITLE_PATTERN = re.compile(r"<title\b[^>]*>(?P<title>.*?)</title\s*>", re.IGNORECASE | re.DOTALL)
+TAG_PATTERN = re.compile(r"<[^>]*>")
+# 1回で作成したページの骨組みで、セクションを置く位置
+SECTION_SLOT = "<!-- lp-section:{id} -->"
+SECTION_SLOT_PATTERN = re.compile(r"<!-- lp-section:(?P<id>\S+) -->")
+# セクションの内容の要約（作成し直すときにアウトラインの内容として渡す）の最大の文字数
+SECTION_CONTENT_CHARS = 300
+
+
+def _section_id(value: str, index: int, used: set) -> str:
+    section_id = SECTION_ID_PATTERN.sub("-", (value or "").lower()).strip("-") or f"section-{index}"
+    if section_id in used:
+        section_id = f"{section_id}-{index}"
+    used.add(section_id)
+    return section_id
+
+
+# アウトライン（JSON）を検証し、セクションのidを重複のないHTMLのidにする
+# セクションがない場合は ValueError
+def normalize_outline(outline: Any) -> Dict[str, Any]:
+    if not isinstance(outline, dict) or not isinstance(outline.get("sections"), list):
+        raise ValueError("アウトラインにセクションの一覧がありません")
+    used: set = set()
+    sections = []
+    for index, section in enumerate(outline["sections"], start=1):
+        if not isinstance(section, dict) or not section.get("name"):
+            continue
+        sections.append({
+            "id": _section_id(section.get("id", ""), index, used),
+            "name": str(section["name"]),
+            "content": str(section.get("content", "")),
+            "sources": [str(source) for source in section.get("sources", []) if source],
+        })
+    if not sections:
+        raise ValueError("アウトラインにセクションがありません")
+    return {
+        "title": str(outline.get("title") or outline.get("siteName") or ""),
+        "siteName": str(outline.get("siteName") or outline.get("title") or ""),
+        "copyright": str(outline.get("copyright") or ""),
+        "sections": sections,
+    }
+
+
+# セクションのHTMLの断片を整える
+#   - ページ全体が返された場合は <body> の中身のみにし、ヘッダー・フッターを除く（骨組みで共通のものを使う）
+#   - <script> は骨組みで読み込むため除く
+#   - 最初の要素に id がなければセクションのidを付ける（ナビゲーションのリンク先）
+def clean_section_fragment(fragment: str, section_id: str) -> str:
+    body = BODY_PATTERN.search(fragment)
+    fragment = SCRIPT_PATTERN.sub("", body.group("body") if body else fragment).strip()
+    if body:
+        fragment = TRAILING_FOOTER_PATTERN.sub("", LEADING_HEADER_PATTERN.sub("", fragment)).strip()
+    if f'id="{section_id}"' in fragment:
+        return fragment
+    first_tag = FIRST_TAG_PATTERN.search(fragment)
+    if first_tag and not ID_ATTRIBUTE_PATTERN.search(first_tag.group("attributes")):
+        return (
+            fragment[:first_tag.start()]
+            + f'<{first_tag.group("tag")} id="{section_id}"{first_tag.group("attributes")}{first_tag.group("close")}>'
+            + fragment[first_tag.end():]
+        )
+    return f'<section id="{section_id}">\n{fragment}\n</section>'
+
+
+# セクションごとに振られたHTMLの画像のプレースホルダーを、ページ全体での出現順の番号（start + 1 から）に振り直す
+def renumber_placeholders(fragments: List[str], start: int = 0) -> List[str]:
+    counter = start
+    renumbered = []
+    for fragment in fragments:
+        numbers: Dict[str, int] = {}
+
+        def replace(match: re.Match) -> str:
+            nonlocal counter
+            if match.group("kind").lower() != "html":
+                return match.group(0)
+            if match.group(0) not in numbers:
+                counter += 1
+                numbers[match.group(0)] = counter
+            return f"placeholder_html_{numbers[match.group(0)]}.{match.group('extension')}"
+
+        renumbered.append(PLACEHOLDER_PATTERN.sub(replace, fragment))
+    return renumbered
+
+
+def _indent(text: str, spaces: int) -> str:
+    return "\n".join(" " * spaces + line if line.strip() else "" for line in text.splitlines())
+
+
+# HTMLの画像のプレースホルダーの最大の番号（なければ0）
+def max_placeholder_number(fragments: List[str]) -> int:
+    return max((
+        int(match.group("number"))
+        for fragment in fragments for match in PLACEHOLDER_PATTERN.finditer(fragment)
+        if match.group("kind").lower() == "html"
+    ), default=0)
+
+
+# 共通の骨組みにセクションを組み込んだページ全体のHTML
+# （fragments はアウトラインのセクションと同じ順で、プレースホルダーの番号は振り直し済みのもの）
+def build_page(outline: Dict[str, Any], fragments: List[str]) -> str:
+    escape = html_lib.escape
+    nav = "\n".join(
+        f'          <li><a href="#{section["id"]}">{escape(section["name"])}</a></li>'
+        for section in outline["sections"]
+    )
+    body = "\n\n".join(_indent(fragment, 4) for fragment in fragments)
+    return f"""<!DOCTYPE html>
+<html lang="ja">
+<head>
+  <meta charset="UTF-8">
+  <meta name="viewport" content="width=device-width, initial-scale=1.0">
+  <title>{escape(outline["title"])}</title>
+  <link rel="stylesheet" href="style.css">
+  <script src="https://unpkg.com/lucide@latest"></script>
+</head>
+<body>
+  <header class="site-header">
+    <div class="container">
+      <a class="logo" href="#">{escape(outline["siteName"])}</a>
+      <nav class="site-nav">
+        <ul>
+{nav}
+        </ul>
+      </nav>
+    </div>
+  </header>
+
+  <main>
+{body}
+  </main>
+
+  <footer class="site-footer">
+    <div class="container">
+      <p>{escape(outline["copyright"])}</p>
+    </div>
+  </footer>
+
+  <script>
+    lucide.createIcons();
+  </script>
+  <script src="script.js"></script>
+</body>
+</html>
+"""
+
+
+def _text(html: str) -> str:
+    return " ".join(html_lib.unescape(TAG_PATTERN.sub(" ", NON_CONTENT_PATTERN.sub(" ", html))).split())
+
+
+# 最上位の <section> の範囲（入れ子の <section> は外側に含める。<script> やコメントの中は除く）
+def _top_level_sections(html: str) -> List[tuple]:
+    hidden = [(match.start(), match.end()) for match in NON_CONTENT_PATTERN.finditer(html)]
+    spans = []
+    depth = 0
+    start = 0
+    for match in SECTION_TAG_PATTERN.finditer(html):
+        if any(begin <= match.start() < end for begin, end in hidden):
+            continue
+        if not match.group("close"):
+            if depth == 0:
+                start = match.start()
+            depth += 1
+        elif depth > 0:
+            depth -= 1
+            if depth == 0:
+                spans.append((start, match.end()))
+    return spans
+
+
+# 1回で作成したページを、最上位の <section> ごとの断片と、それ以外の部分（骨組み）に分ける（<section> がなければ None）
+#   - 骨組みのセクションの位置には SECTION_SLOT を置く（fill_page で組み立てる）
+#   - セクションのidはHTMLのidをそのまま使う（ナビゲーションのリンク先を変えない）。なければ section-(番号)
+#   - 基にする項目（sources）はわからないため記録しない（内容の項目を変更した場合は全てのセクションを作成し直す）
+def split_page(html: str) -> Optional[Dict[str, Any]]:
+    spans = _top_level_sections(html)
+    if not spans:
+        return None
+    used: set = set()
+    sections = []
+    fragments = []
+    shell = []
+    position = 0
+    for index, (start, end) in enumerate(spans, start=1):
+        fragment = html[start:end]
+        opening = SECTION_TAG_PATTERN.match(fragment)
+        id_match = ID_VALUE_PATTERN.search(opening.group(0))
+        section_id = id_match.group("id") if id_match and id_match.group("id") not in used else f"section-{index}"
+        used.add(section_id)
+        heading = HEADING_PATTERN.search(fragment)
+        sections.append({
+            "id": section_id,
+            "name": (_text(heading.group("text")) if heading else "") or section_id,
+            "content": _text(fragment)[:SECTION_CONTENT_CHARS],
+            "sources": [],
+        })
+        fragments.append(fragment)
+        shell.append(html[position:start])
+        shell.append(SECTION_SLOT.format(id=section_id))
+        position = end
+    shell.append(html[position:])
+    title = TITLE_PATTERN.search(html)
+    return {
+        "outline": {
+            "title": _text(title.group("title")) if title else "",
+            "siteName": "",
+            "copyright": "",
+            "sections": sections,
+        },
+        "fragments": fragments,
+        "shell": "".join(shell),
+    }
+
+
+# 骨組み（split_page で分けたもの）にセクションを組み込んだページ全体のHTML
+def fill_page(shell: str, outline: Dict[str, Any], fragments: List[str]) -> str:
+    by_id = {section["id"]: fragment for section, fragment in zip(outline["sections"], fragments)}
+    return SECTION_SLOT_PATTERN.sub(lambda match: by_id.get(match.group("id"), ""), shell)
@@ -0,0 +1,94 @@
+import glob
+import json
+import os
+import shutil
+from typing import Any, Dict, List, Optional
+
+from observability import record_bytes_written
+
+######################################
+## ジョブごとの作業ディレクトリ
+######################################
+
+# ジョブの成果物を置くディレクトリを表すクラス
+# プロセスのカレントディレクトリに依存しないよう、全てのファイル操作を絶対パスで行う
+class JobWorkspace:
+    # 段階ごとの出力（チェックポイント）を保存するサブディレクトリ
+    CHECKPOINT_DIR = "checkpoints"
+
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+
+    def __repr__(self):
+        return f"JobWorkspace({self.root!r})"
+
+    # ワークスペース内のファイルの絶対パスを返す（外側を指す名前は拒否する）
+    def path(self, name: str) -> str:
+        full_path = os.path.abspath(os.path.join(self.root, name))
+        if os.path.commonpath([full_path, self.root]) != self.root:
+            raise ValueError(f"Path escapes workspace: {name}")
+        return full_path
+
+    def exists(self, name: str) -> bool:
+        return os.path.exists(self.path(name))
+
+    def read_text(self, name: str) -> str:
+        with open(self.path(name), "r", encoding="utf-8") as f:
+            return f.read()
+
+    def write_text(self, name: str, content: str):
+        with open(self.path(name), "w", encoding="utf-8") as f:
+            f.write(content)
+            record_bytes_written("text", f.tell())
+
+    def read_bytes(self, name: str) -> bytes:
+        with open(self.path(name), "rb") as f:
+            return f.read()
+
+    def write_bytes(self, name: str, content: bytes):
+        with open(self.path(name), "wb") as f:
+            f.write(content)
+        record_bytes_written("binary", len(content))
+
+    # パターンに一致するファイル名（ワークスペースからの相対名）を名前順で返す
+    def glob(self, pattern: str) -> List[str]:
+        return sorted(
+            os.path.relpath(path, self.root)
+            for path in glob.glob(os.path.join(glob.escape(self.root), pattern))
+        )
+
+    # JSONを保存する（書き込み途中で中断されたり、他のプロセスが途中の内容を読んだりしないよう置き換える）
+    def write_json(self, name: str, content: Any):
+        tmp_name = f"{name}.{os.getpid()}.tmp"
+        with open(self.path(tmp_name), "w", encoding="utf-8") as f:
+            json.dump(content, f, ensure_ascii=False)
+            size = f.tell()
+        os.replace(self.path(tmp_name), self.path(name))
+        record_bytes_written("checkpoint" if name.startswith(self.CHECKPOINT_DIR) else "json", size)
+
+    # JSONを読み込む（なければNone）
+    def read_json(self, name: str) -> Optional[Any]:
+        try:
+            with open(self.path(name), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def remove(self, name: str):
+        try:
+            os.remove(self.path(name))
+        except FileNotFoundError:
+            pass
+
+    # 段階の出力をチェックポイントとして保存する
+    def save_checkpoint(self, stage_id: str, outputs: Dict[str, Any]):
+        os.makedirs(self.path(self.CHECKPOINT_DIR), exist_ok=True)
+        self.write_json(os.path.join(self.CHECKPOINT_DIR, f"{stage_id}.json"), outputs)
+
+    # 保存済みのチェックポイントを読み込む（なければNone）
+    def load_checkpoint(self, stage_id: str) -> Optional[Dict[str, Any]]:
+        return self.read_json(os.path.join(self.CHECKPOINT_DIR, f"{stage_id}.json"))
+
+    def clear_checkpoints(self):
+        shutil.rmtree(self.path(self.CHECKPOINT_DIR), ignore_errors=True)
@@ -0,0 +1,78 @@
+import hashlib
+import os
+import zipfile
+from typing import Iterable, Iterator, List, Tuple
+
+######################################
+## 成果物のZIP（ストリーミング生成）
+######################################
+
+# 圧縮済みの形式（圧縮しても小さくならないため、そのまま格納する）
+STORED_EXTENSIONS = {".png", ".jpg", ".jpeg", ".gif", ".webp", ".avif", ".zip"}
+# ファイルを読み込んで送信する単位
+CHUNK_SIZE = 64 * 1024
+
+
+# ファイル名から圧縮方式を決める（画像は無圧縮、テキストはDeflate）
+def compression_for(file_name: str) -> int:
+    if os.path.splitext(file_name)[1].lower() in STORED_EXTENSIONS:
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+
+# ZipFile の書き込み先（書き込まれたバイト列を溜めておき、送信する分だけ取り出す）
+# tell / seek を持たないため、ZipFile はデータディスクリプタ付きで順に書き込む
+class _ZipStreamBuffer:
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+# ZIPを先頭から少しずつ生成する（一時ファイルやコピーを作らない）
+#   entries: (ZIP内の名前, ファイルのパス) の一覧
+#   extra_files: (ZIP内の名前, 内容) の一覧（ファイルにない内容を追加する場合）
+def iter_zip(entries: Iterable[Tuple[str, str]],
+             extra_files: Iterable[Tuple[str, bytes]] = (),
+             chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    buffer = _ZipStreamBuffer()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for arcname, content in extra_files:
+            archive.writestr(arcname, content, compress_type=compression_for(arcname))
+            yield buffer.drain()
+
+        for arcname, path in entries:
+            info = zipfile.ZipInfo.from_file(path, arcname)
+            info.compress_type = compression_for(arcname)
+            with open(path, "rb") as source, archive.open(info, "w") as destination:
+                while True:
+                    chunk = source.read(chunk_size)
+                    if not chunk:
+                        break
+                    destination.write(chunk)
+                    data = buffer.drain()
+                    if data:
+                        yield data
+            yield buffer.drain()
+    yield buffer.drain()
+
+
+# ZIPに含めるファイルの名前・サイズ・更新時刻から決まるETag（内容が変われば変わる）
+def zip_etag(entries: Iterable[Tuple[str, str]], extra_files: Iterable[Tuple[str, bytes]] = ()) -> str:
+    digest = hashlib.sha256()
+    for arcname, path in entries:
+        stat = os.stat(path)
+        digest.update(f"{arcname}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode("utf-8"))
+    for arcname, content in extra_files:
+        digest.update(f"{arcname}\0".encode("utf-8") + hashlib.sha256(content).digest())
+    return f'"{digest.hexdigest()[:32]}"'
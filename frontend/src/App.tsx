@@ -5,6 +5,7 @@ import { useForm } from "react-hook-form";
 import { zodResolver } from "@hookform/resolvers/zod";
 import { Loader2 } from "lucide-react";
 import api from "@/services/api";
+import type { JobResult } from "@/types";
 
 // shadcn/uiコンポーネントのインポート
 import {
@@ -47,13 +48,7 @@ interface JobInfo {
   currentStep: string;
   steps: Step[];
   error?: string;
-  result?: {
-    html: string;
-    css: string;
-    js: string;
-    imageUrls: string[];
-    imageBase64: string;
-  };
+  result?: JobResult;
 }
 
 // フォームのスキーマ定義
@@ -86,21 +81,17 @@ const updateIframeContent = (
   iframe: HTMLIFrameElement,
   html: string,
   css: string,
-  js: string,
-  imageBase64: string
+  js: string
 ) => {
   const iframeDoc = iframe.contentDocument || iframe.contentWindow?.document;
 
   if (iframeDoc) {
-    // CSSの中の${imageBase64}プレースホルダーを実際の画像データで置き換え
-    const updatedCss = css.replace("${imageBase64}", imageBase64);
-
     iframeDoc.open();
     iframeDoc.write(`
       <!DOCTYPE html>
       <html>
         <head>
-          <style>${updatedCss}</style>
+          <style>${css}</style>
         </head>
         <body>
           ${html}
@@ -117,6 +108,12 @@ const App = () => {
   const [jobInfo, setJobInfo] = useState<JobInfo | null>(null);
   const [downloadLoading, setDownloadLoading] = useState(false);
   const iframeRef = useRef<HTMLIFrameElement>(null);
+  // ジョブイベントの購読解除関数と、生成途中のHTML
+  const unsubscribeRef = useRef<(() => void) | null>(null);
+  const partialHtmlRef = useRef("");
+
+  // アンマウント時に購読を終了
+  useEffect(() => () => unsubscribeRef.current?.(), []);
 
   // フォームの状態管理
   const form = useForm<FormData>({
@@ -193,46 +190,56 @@ const App = () => {
         ],
       });
 
-      // ジョブステータスのポーリングを開始
-      const pollInterval = setInterval(async () => {
-        try {
-          const statusResponse = await fetch(`http://localhost:8000/api/jobs/${jobId}`);
-          if (!statusResponse.ok) {
-            throw new Error("ジョブステータスの取得に失敗しました");
-          }
-
-          const jobStatus = await statusResponse.json();
-          setJobInfo(jobStatus);
-
-          // ジョブが完了またはエラーの場合、ポーリングを停止
-          if (jobStatus.status === "completed" || jobStatus.status === "error") {
-            clearInterval(pollInterval);
-
-            // 完了時にプレビューを更新
-            if (jobStatus.status === "completed" && jobStatus.result && iframeRef.current) {
-              updateIframeContent(
-                iframeRef.current,
-                jobStatus.result.html,
-                jobStatus.result.css,
-                jobStatus.result.js,
-                jobStatus.result.imageBase64
-              );
-            }
-          }
-        } catch (error) {
-          console.error("Error polling job status:", error);
-          clearInterval(pollInterval);
+      // ジョブの状態変化の購読を開始（ポーリングの代わりにSSEで差分を受信）
+      unsubscribeRef.current?.();
+      partialHtmlRef.current = "";
+      unsubscribeRef.current = api.subscribeJobEvents(jobId, {
+        onSnapshot: (snapshot) => setJobInfo(snapshot as JobInfo),
+        onStep: (step) =>
+          setJobInfo((prev) =>
+            prev
+              ? { ...prev, steps: prev.steps.map((s) => (s.id === step.id ? step : s)) }
+              : prev
+          ),
+        onStatus: (status) => setJobInfo((prev) => (prev ? { ...prev, ...status } : prev)),
+        onProgress: ({ progress, stepId, stepProgress }) =>
           setJobInfo((prev) =>
             prev
               ? {
                   ...prev,
-                  status: "error",
-                  error: "ジョブステータスの取得に失敗しました",
+                  progress,
+                  steps: prev.steps.map((s) =>
+                    s.id === stepId ? { ...s, progress: stepProgress } : s
+                  ),
                 }
-              : null
-          );
-        }
-      }, 3000); // 3秒ごとにポーリング
+              : prev
+          ),
+        onDelta: ({ stepId, offset, text }) => {
+          // ワイヤーフレーム生成中は、生成途中のHTMLをプレビューに表示
+          if (stepId !== "wireframe" || !iframeRef.current) return;
+          partialHtmlRef.current = partialHtmlRef.current.slice(0, offset) + text;
+          updateIframeContent(iframeRef.current, partialHtmlRef.current, "", "");
+        },
+        onCompleted: async () => {
+          try {
+            const result = await api.getJobResult(jobId);
+            setJobInfo((prev) =>
+              prev ? { ...prev, status: "completed", progress: 100, result } : prev
+            );
+          } catch (error) {
+            console.error("Error fetching job result:", error);
+            setJobInfo((prev) =>
+              prev ? { ...prev, status: "error", error: "生成結果の取得に失敗しました" } : prev
+            );
+          }
+        },
+        onError: (error) =>
+          setJobInfo((prev) =>
+            prev
+              ? { ...prev, status: "error", error: error || "ジョブの実行中にエラーが発生しました" }
+              : prev
+          ),
+      });
     } catch (error) {
       console.error("Error starting job:", error);
       setJobInfo({
@@ -272,21 +279,17 @@ const App = () => {
 
   // ジョブのリセット - 新しいLP生成を開始できるようにする
   const resetJob = () => {
+    unsubscribeRef.current?.();
+    unsubscribeRef.current = null;
     setJobInfo(null);
   };
 
-  // プレビューを更新
+  // プレビューを更新（生成されたHTMLを直接読み込み、CSS・JS・画像はブラウザのキャッシュを利用する）
   useEffect(() => {
     if (jobInfo?.status === "completed" && jobInfo.result && iframeRef.current) {
-      updateIframeContent(
-        iframeRef.current,
-        jobInfo.result.html,
-        jobInfo.result.css,
-        jobInfo.result.js,
-        jobInfo.result.imageBase64
-      );
+      iframeRef.current.src = api.getFileUrl(jobInfo.jobId, "index.html");
     }
-  }, [jobInfo?.result, jobInfo?.status]);
+  }, [jobInfo?.result, jobInfo?.status, jobInfo?.jobId]);
 
   // 日本語のステップ名を取得
 
@@ -1,4 +1,9 @@
-import { LPGenerationData, JobStatus } from "@/types";
+import {
+  LPGenerationData,
+  JobStatus,
+  JobPartial,
+  JobEventHandlers,
+} from "@/types";
 
 // APIの基本URL
 const API_BASE_URL = import.meta.env.VITE_API_URL || "http://localhost:8000/api";
@@ -52,6 +57,70 @@ const api = {
     }
   },
 
+  // 完了したジョブの生成結果を取得する
+  getJobResult: async (jobId: string): Promise<NonNullable<JobStatus["result"]>> => {
+    try {
+      const response = await fetch(`${API_BASE_URL}/jobs/${jobId}/result`);
+      return checkResponse(response);
+    } catch (error) {
+      console.error(`Error getting result for ${jobId}:`, error);
+      throw error;
+    }
+  },
+
+  // ジョブの状態変化をServer-Sent Eventsで購読する（戻り値の関数で購読を終了）
+  subscribeJobEvents: (jobId: string, handlers: JobEventHandlers): (() => void) => {
+    const source = new EventSource(`${API_BASE_URL}/jobs/${jobId}/events`);
+    const parse = (event: Event) => JSON.parse((event as MessageEvent).data);
+
+    source.addEventListener("snapshot", (event) => {
+      const snapshot = parse(event);
+      handlers.onSnapshot?.(snapshot);
+      if (snapshot.status === "completed") {
+        source.close();
+        handlers.onCompleted?.({
+          resultUrl: snapshot.resultUrl,
+          downloadUrl: `/api/jobs/${jobId}/download`,
+        });
+      } else if (snapshot.status === "error") {
+        source.close();
+        handlers.onError?.(snapshot.error ?? "");
+      }
+    });
+    source.addEventListener("step", (event) => handlers.onStep?.(parse(event)));
+    source.addEventListener("status", (event) => handlers.onStatus?.(parse(event)));
+    source.addEventListener("progress", (event) => handlers.onProgress?.(parse(event)));
+    source.addEventListener("delta", (event) => handlers.onDelta?.(parse(event)));
+    source.addEventListener("completed", (event) => {
+      source.close();
+      handlers.onCompleted?.(parse(event));
+    });
+    source.addEventListener("error", (event) => {
+      // サーバーから送られたエラーイベント（接続エラーの場合は自動で再接続される）
+      if (event instanceof MessageEvent && event.data) {
+        source.close();
+        handlers.onError?.(parse(event).error);
+      }
+    });
+
+    return () => source.close();
+  },
+
+  // 成果物（HTML / CSS / JS / 画像）のURL
+  getFileUrl: (jobId: string, fileName: string): string =>
+    `${API_BASE_URL}/jobs/${jobId}/files/${encodeURIComponent(fileName)}`,
+
+  // 生成途中の成果物（ストリーミング中のHTML/CSS/JS）を取得する
+  getJobPartial: async (jobId: string): Promise<JobPartial> => {
+    try {
+      const response = await fetch(`${API_BASE_URL}/jobs/${jobId}/partial`);
+      return checkResponse(response);
+    } catch (error) {
+      console.error(`Error getting partial result for ${jobId}:`, error);
+      throw error;
+    }
+  },
+
   // 生成結果をダウンロードする
   downloadResults: async (jobId: string): Promise<Blob> => {
     try {
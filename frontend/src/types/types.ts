@@ -25,10 +25,88 @@ export interface JobStatus {
   currentStep: string;
   steps: Step[];
   error?: string;
-  result?: {
-    html: string;
-    css: string;
-    js: string;
-    imageUrls: string[];
+  // 完了後に生成結果・ZIPを取得するURL（ジョブの状態には生成結果を含めない）
+  resultUrl?: string;
+  downloadUrl?: string;
+  result?: JobResult;
+}
+
+// 生成結果の型定義（成果物の本体は含めず、URLとサイズのみ）
+export interface JobResult {
+  jobId: string;
+  previewUrl: string;
+  files: JobFile[];
+  downloadUrl: string;
+  imageFallbacks?: ImageFallback[];
+  // 画像ライブラリから再利用した画像（プロンプトの類似度）
+  reusedImages?: {
+    fileName: string;
+    similarity: number;
+  }[];
+  // 部分的な再生成で、前回の成果物からそのまま引き継いだ画像
+  carriedOverImages?: {
+    fileName: string;
+  }[];
+  // 最適化した画像の合計サイズ（元画像と最適化後、バイト）
+  imageBytes?: {
+    original: number;
+    optimized: number;
   };
+  createdAt: string;
+}
+
+// 成果物の型定義（url は GET /api/jobs/{jobId}/files/{name}）
+export interface JobFile {
+  name: string;
+  url: string;
+  size: number;
+  contentType: string;
+}
+
+// 生成に失敗し、代替画像を使った画像の型定義
+export interface ImageFallback {
+  fileName: string;
+  fallback: "similar" | "gradient";
+  source?: string;
+  error?: string;
+}
+
+// 生成途中の成果物の型定義
+export interface JobPartial {
+  stepId: string;
+  content: string;
+}
+
+// ジョブイベント（SSE）の型定義
+export interface JobStatusEvent {
+  status: JobStatus["status"];
+  progress: number;
+  currentStep: string;
+}
+
+export interface JobProgressEvent {
+  progress: number;
+  stepId: string;
+  stepProgress: number;
+}
+
+export interface JobDeltaEvent {
+  stepId: string;
+  offset: number;
+  text: string;
+}
+
+export interface JobCompletedEvent {
+  resultUrl: string;
+  downloadUrl: string;
+}
+
+export interface JobEventHandlers {
+  onSnapshot?: (snapshot: JobStatus) => void;
+  onStep?: (step: Step) => void;
+  onStatus?: (status: JobStatusEvent) => void;
+  onProgress?: (progress: JobProgressEvent) => void;
+  onDelta?: (delta: JobDeltaEvent) => void;
+  onCompleted?: (completed: JobCompletedEvent) => void;
+  onError?: (error: string) => void;
 }